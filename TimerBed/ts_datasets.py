@@ -0,0 +1,40 @@
+"""
+TimerBed真实数据集登记表：每个数据集一项，转换脚本据此批量处理各数据集的TRAIN/TEST划分
+- dir: 数据集目录，其中的.ts文件命名为 <名称>_<划分>.ts，输出同目录下的 <名称>_<划分>.jsonl
+- task: 写入JSONL的task字段
+- id2label: 原数据集类别编号到标签文本的映射
+- question: 问题模板，<ts><ts/>处在后续阶段填入时序数据
+新增数据集只需在DATASETS中添加一项
+"""
+
+SPLITS = ("TRAIN", "TEST")
+
+DATASETS = {
+    "TEE": {
+        "dir": "./TEE",
+        "task": "TEE",
+        "id2label": {
+            "0": "CG Positive",
+            "1": "IR Negative",
+            "2": "Subsequent Return Stroke",
+            "3": "Impulsive",
+            "4": "Impulsive Pair",
+            "5": "Gradual Intra-Cloud",
+            "6": "Off-record",
+        },
+        "question": "You are a time series analysis expert. This is a time series signal derived from lightning-related electromagnetic events, recorded by the FORTE satellite: <ts><ts/>. Your task is to classify the signal into one of the following seven event types: - CG Positive: A positive charge is lowered from a cloud to the ground. The waveform shows a sharp turn-on of radiation followed by hundreds of microseconds of noise. - IR Negative: A negative charge moves cloud-to-ground. The waveform gradually ramps up, peaks sharply (attachment point), then declines exponentially. - Subsequent Return Stroke: A follow-up negative stroke after an initial one. Similar waveform but without the ramp-up phase. - Impulsive: A sudden, sharp peak in the waveform, typical of intra-cloud events. - Impulsive Pair: Two sharp, closely spaced peaks—also known as TIPPs (Trans-Ionospheric Pulse Pairs). - Gradual Intra-Cloud: A gradual increase in power, more spread out than impulsive types. - Off-record: The signal is incomplete; the event extends beyond the 800 microsecond window. You are required to identify and report the approximate value ranges (minimum and maximum) of the signals over the time period. Choose the best matching label for the full signal from: a)CG Positive, b)IR Negative, c)Subsequent Return Stroke, d)Impulsive, e)Impulsive Pair, f)Gradual Intra-Cloud, g)Off-record.",
+    },
+    "HAR": {
+        "dir": "./HAR",
+        "task": "HAR",
+        "id2label": {
+            "0": "walking",
+            "1": "walking_upstairs",
+            "2": "walking_downstairs",
+            "3": "sitting",
+            "4": "standing",
+            "5": "laying",
+        },
+        "question": "",
+    },
+}
@@ -0,0 +1,121 @@
+import re
+import sys
+import json
+import time
+import random
+from word2number import w2n
+from extract_label import INFER_PATTERNS, extract_inferential_label
+
+'''
+对比extract_label.extract_inferential_label（单遍优先级匹配 + 预计算数字词表）与原先逐个模式re.search版本
+- 回归：与原版本（模式列表补上漏掉的逗号后）的label必须完全一致；另外列出补逗号本身带来的label变化
+- 速度：传入数据文件时取其中Inferential calculation样本的output测试（如2万条推理计算样本），否则用构造的语料
+用法：python bench_extract_inferential.py [xxx.jsonl ...]
+'''
+
+# 原模式列表：can be identified / occurred / the time series shows 三项之间漏了逗号，被拼接成了一个模式
+ORIGINAL_PATTERNS = INFER_PATTERNS[:14] + ["".join(INFER_PATTERNS[14:17])] + INFER_PATTERNS[17:]
+
+SPECIAL_MAP = {"no": "0", "zero": "0", "none": "0", "a": "1", "an": "1", "once": "1", "twice": "2"}
+
+
+def legacy_extract_inferential_label(output, patterns=INFER_PATTERNS):
+    """原实现：按优先级逐个模式在全文re.search，命中后每次调用w2n"""
+    output_clean = output.strip().replace("\n", " ") if isinstance(output, str) else ""
+    if not output_clean:
+        return None
+    for pattern in patterns:
+        match = re.search(pattern, output_clean, re.IGNORECASE)
+        if match:
+            num_raw = match.group(1).strip()
+            if num_raw.isdigit():
+                return num_raw
+            if num_raw in SPECIAL_MAP:
+                return SPECIAL_MAP[num_raw]
+            try:
+                return str(w2n.word_to_num(num_raw))
+            except ValueError:
+                return num_raw
+    return None
+
+
+def load_outputs(paths):
+    outputs = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if str(data.get("task", "")).strip() == "Inferential calculation" and "output" in data:
+                    outputs.append(data["output"])
+    return outputs
+
+
+def regression_corpus(n=20000, seed=0):
+    """按各计数句式构造回归语料：每条随机拼接若干句式，覆盖优先级冲突、大小写、英文数字和特殊词"""
+    rng = random.Random(seed)
+    numbers = ["3", "12", "one", "Two", "twenty", "hundred", "no", "No", "none", "None", "a", "An", "once",
+               "twice", "zero", "several", "many", "onehundred", "3rd", "point", "Eleven", "forty"]
+    templates = [
+        "I've found that there are {n} anomalies.", "I've found that there is {n} spike.",
+        "I've found that there were {n} drops", "I've found that there was {n} peak,", "I've found {n} events.",
+        "I've identified {n} segments.", "there is {n} outlier", "There are approximately {n} dips.",
+        "there was {n} surge", "There were about {n} cycles.", "It was observed that {n} values exceed the bound.",
+        "The number of peaks above 0.5 is {n}.", "It took {n} hours to recover.", "it took {n} steps",
+        "{n} distinct upward spikes can be identified in the series.", "The maximum occurred {n} times.",
+        "The time series shows {n} plateaus.", "It rose {n} times", "for {n} day", "lasting {n} days",
+        "{n} minute later", "about {n} minutes", "{n} hour", "{n} hours", "{n} second", "{n} seconds",
+        "{n} point above", "{n} points", "based on {n} observations",
+    ]
+    filler = ["The series is stable overall.", "Values fluctuate around the mean", "Considering the trend,",
+              "Therefore the answer follows.", "the data look noisy\n"]
+    corpus = []
+    for _ in range(n):
+        parts = [rng.choice(filler)]
+        for _ in range(rng.randint(1, 4)):
+            parts.append(rng.choice(templates).format(n=rng.choice(numbers)))
+            if rng.random() < 0.5:
+                parts.append(rng.choice(filler))
+        corpus.append(" ".join(parts))
+    return corpus
+
+
+def bench(name, fn, outputs, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for output in outputs:
+            fn(output)
+        best = min(best, time.perf_counter() - t0)
+    print(f"  {name:<8} {best:.4f}s ({len(outputs) / best:.0f} 条/s)")
+    return best
+
+
+def compare(title, outputs):
+    print(f"{title}: {len(outputs)} 条")
+    new = [extract_inferential_label(o) for o in outputs]
+    legacy = [legacy_extract_inferential_label(o) for o in outputs]
+    original = [legacy_extract_inferential_label(o, ORIGINAL_PATTERNS) for o in outputs]
+    mismatches = [i for i, (a, b) in enumerate(zip(new, legacy)) if a != b]
+    print(f"  与原版本结果不一致: {len(mismatches)} 条")
+    for i in mismatches[:3]:
+        print(f"    {outputs[i][:120]!r}\n    新: {new[i]!r} 旧: {legacy[i]!r}")
+    changed = sum(a != b for a, b in zip(legacy, original))
+    print(f"  补上模式列表逗号后label变化: {changed} 条")
+    t_old = bench("逐个模式", legacy_extract_inferential_label, outputs)
+    t_new = bench("单遍", extract_inferential_label, outputs)
+    print(f"  加速 {t_old / t_new:.1f}x")
+    return not mismatches
+
+
+if __name__ == "__main__":
+    ok = True
+    if len(sys.argv) > 1:
+        ok &= compare(f"数据文件 {sys.argv[1:]}", load_outputs(sys.argv[1:]))
+    ok &= compare("构造语料", regression_corpus())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,119 @@
+import re
+import sys
+import json
+import time
+import random
+from cot_correct import parse_cot_steps
+
+'''
+对比cot_correct.parse_cot_steps（单遍扫描）与原先逐个Step正则匹配版本的速度和结果
+- 传入cot_deepseekr1的输出文件时用真实R1输出测试，否则用构造的样本
+- 另外构造只有Step标题和[Judgment]而缺少[Description]的对抗样本，原正则版本在这类输入上回溯耗时随长度超线性（约三次方）增长
+用法：python bench_parse_cot_steps.py [xxx_labeled_cot.jsonl]
+'''
+
+
+def legacy_parse_cot_steps(cot_content):
+    """原正则版本（Step6未匹配时会抛NameError，这里按修复后的行为返回unknown以便比较）"""
+    step_labels = {"step1_label": None, "step2_label": None, "step4_label": None, "step6_label": None}
+    if not isinstance(cot_content, str) or cot_content.strip() == "":
+        return step_labels
+    cot_clean = cot_content.strip().replace("\n", " ").replace("  ", " ")
+    for n in (1, 2, 4):
+        pattern = rf"Step {n}.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*(?:\*\*)?\s*\[Description\]\s*(?:\*\*)?"
+        match = re.search(pattern, cot_clean, re.IGNORECASE)
+        if match:
+            step_labels[f"step{n}_label"] = match.group(1).strip().replace("**", "").capitalize()
+    step6_tmp = None
+    match = re.search(r"Step 6.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*$", cot_clean, re.IGNORECASE)
+    if match:
+        step6_tmp = match.group(1).strip().replace("**", "").capitalize()
+    step_labels["step6_label"] = re.sub(r'[.;]$', '', step6_tmp).strip() if step6_tmp else "unknown"
+    for key in step_labels:
+        if step_labels[key] in ["", "none", "null"]:
+            step_labels[key] = None
+    return step_labels
+
+
+def load_real_cots(path):
+    cots = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                cot = json.loads(line).get("cot_deepseekr1")
+            except json.JSONDecodeError:
+                continue
+            if isinstance(cot, str):
+                cots.append(cot)
+    return cots
+
+
+def synthetic_cots(n, seed=0):
+    """按cot_deepseekr1.py的输出格式构造样本，随机加入**、大小写、缺失小节等变化"""
+    rng = random.Random(seed)
+    words = ["trend", "amplitude", "fluctuation", "continuity", "upward", "stable", "the", "series", "shows", "Step 2"]
+    cots = []
+    for _ in range(n):
+        parts = []
+        for step in range(1, 7):
+            star = rng.choice(["", "**"])
+            judgment = rng.choice(["Yes", "no", "UPWARD trend", "trend; amplitude", "none", "", "42."])
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(20, 120)))
+            header = rng.choice([f"Step {step}:", f"**Step {step}**", f"step {step} -"])
+            if step == 6:
+                parts.append(f"{header}\n{star}[Judgment]{star} {judgment}{rng.choice(['', '.', ';'])}")
+            elif rng.random() < 0.05:
+                parts.append(f"{header}\n[Analysis] {text}")
+            else:
+                parts.append(f"{header}\n[Analysis] {text}\n{star}[Judgment]{star} {judgment}\n"
+                             f"{star}[Description]{star} {text}")
+        cots.append("\n\n".join(parts))
+    return cots
+
+
+def adversarial_cots(sizes=(25, 50, 100)):
+    return [" ".join(["Step 1 [Judgment] x"] * size) for size in sizes]
+
+
+def bench(name, fn, cots, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for cot in cots:
+            fn(cot)
+        best = min(best, time.perf_counter() - t0)
+    print(f"  {name:<8} {best:.4f}s ({len(cots) / best:.0f} 条/s)")
+    return best
+
+
+def compare(title, cots):
+    print(f"{title}: {len(cots)} 条")
+    mismatches = [cot for cot in cots if parse_cot_steps(cot) != legacy_parse_cot_steps(cot)]
+    print(f"  结果不一致: {len(mismatches)} 条")
+    for cot in mismatches[:3]:
+        print(f"    {cot[:120]!r}\n    新: {parse_cot_steps(cot)}\n    旧: {legacy_parse_cot_steps(cot)}")
+    t_old = bench("regex", legacy_parse_cot_steps, cots)
+    t_new = bench("单遍", parse_cot_steps, cots)
+    print(f"  加速 {t_old / t_new:.1f}x")
+    return not mismatches
+
+
+if __name__ == "__main__":
+    ok = True
+    if len(sys.argv) > 1:
+        ok &= compare(f"真实R1输出 {sys.argv[1]}", load_real_cots(sys.argv[1]))
+    ok &= compare("构造样本", synthetic_cots(2000))
+
+    print("对抗样本（缺少[Description]）:")
+    for cot in adversarial_cots():
+        t0 = time.perf_counter()
+        legacy_parse_cot_steps(cot)
+        t_old = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        parse_cot_steps(cot)
+        t_new = time.perf_counter() - t0
+        print(f"  长度 {len(cot):>6}: regex {t_old:.4f}s | 单遍 {t_new:.5f}s")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,74 @@
+import json
+import os
+
+"""
+LLM阶段的断点续跑日志（append-only）
+- 每处理完一条样本，先将输出文件flush+fsync，再向日志追加一行 {"id": ..., "sizes": [各输出文件字节数]} 并fsync
+- 续跑（resume=True）时读取日志得到已完成的id，并把输出文件截断到最后一条日志记录的大小，
+  丢弃崩溃时写了一半、尚未记入日志的内容，保证输出文件与日志一致、不会重复写入
+"""
+
+
+class Checkpoint:
+    def __init__(self, output_paths, journal_path=None, resume=False):
+        if isinstance(output_paths, str):
+            output_paths = [output_paths]
+        self.output_paths = list(output_paths)
+        self.journal_path = journal_path or self.output_paths[0] + ".ckpt"
+        self.done_ids = set()
+
+        if resume:
+            self._restore()
+        elif os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _restore(self):
+        last_sizes = None
+        if os.path.exists(self.journal_path):
+            valid_bytes = 0
+            with open(self.journal_path, "rb") as f:
+                for raw in f:
+                    try:
+                        entry = json.loads(raw)
+                    except json.JSONDecodeError:
+                        # 崩溃时写了一半的日志行，丢弃
+                        break
+                    self.done_ids.add(entry["id"])
+                    last_sizes = entry["sizes"]
+                    valid_bytes += len(raw)
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+        # 将输出文件截断到最后一次记录的大小（无日志时说明尚未完成任何样本）
+        for i, path in enumerate(self.output_paths):
+            size = last_sizes[i] if last_sizes is not None and i < len(last_sizes) else 0
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        print(f"断点续跑：已完成 {len(self.done_ids)} 条样本，将跳过这些样本")
+
+    def is_done(self, id) -> bool:
+        return id in self.done_ids
+
+    def mark_done(self, id, out_files=()) -> None:
+        """out_files为本阶段打开的输出文件对象，顺序与output_paths一致"""
+        sizes = []
+        for f in out_files:
+            f.flush()
+            os.fsync(f.fileno())
+        for path in self.output_paths:
+            sizes.append(os.path.getsize(path) if os.path.exists(path) else 0)
+        self._journal.write(json.dumps({"id": id, "sizes": sizes}, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.done_ids.add(id)
+
+    def close(self) -> None:
+        self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,7 +1,15 @@
+import os
+import sys
 import json
 import re
-import time
 from openai import OpenAI
+import llm_utils
+from llm_utils import count_tokens
+from llm_cache import configure_cache, print_cache_stats
+from llm_telemetry import export_telemetry, print_telemetry_stats
+from checkpoint import Checkpoint
+from classify_rule_based import classify_ts_task_with_confidence
+from jsonl_index import JsonlIndex
 
 """conda envvironment: rebuttal"""
 
@@ -12,26 +20,10 @@ client = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.chatanywhere.tech/
 
 # 大模型请求函数
 def gpt_chat(content, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            response = client.chat.completions.create(
-                model=gpt_model,
-                temperature=0.2,
-                messages=[{"role": "user", "content": content}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
-            retry_count += 1
-            if retry_count < max_retries:
-                time.sleep(5)
-    print("已达到最大重试次数，请求失败。")
-    return None
-
-
-def process_data(input_file, start_idx, end_idx):
-    prompt_template = """
+    return llm_utils.gpt_chat(client, gpt_model, content, max_retries)
+
+
+prompt_template = """
         **Task:** Classify the given question into one of these categories:  
         1. Anomaly detection: Anomaly detection: The question must contain at least one of the following keywords: "normal", "abnormal", "anomalous", "anomaly", "anomalies", "usual", "unusual", or "expected", and is a true/false task that explicitly asks whether the time series data is normal, abnormal, or usual.
         2. Scenario attribution: The question involves scenario attribution or future scenario prediction, and must explicitly require choosing from several provided options (a multiple-choice task). Questions that involve scenario attribution or prediction but do not provide options are excluded.
@@ -61,75 +53,182 @@ def process_data(input_file, start_idx, end_idx):
         **Output format:**  
         - Category: [1/2/3/4]  
     """
+
+# 批量模式：一次请求中放入多个编号问题，共用上面的任务定义和示例
+batch_prompt_template = prompt_template.split("**Question:**")[0] + """**Questions:**  
+{questions}
+
+        **Output format:**  
+        - Classify each numbered question independently and output one line per question, in order:  
+        - Question <n> Category: [1/2/3/4]  
+"""
+
+# 类别编号到任务名称的映射
+task_map = {
+    1: "Anomaly detection",
+    2: "Scenario attribution",
+    3: "Inferential calculation"
+}
+
+
+def build_single_prompt(input_text):
+    return prompt_template.format(question=input_text)
+
+
+def build_batch_prompt(input_texts):
+    questions = "\n".join(f"        Question {n}: {text}" for n, text in enumerate(input_texts, 1))
+    return batch_prompt_template.format(questions=questions)
+
+
+def classify_single(idx, input_text):
+    """单条分类，失败返回None"""
+    response = gpt_chat(build_single_prompt(input_text))
+    if response is None:
+        print(f"ID {idx}: API调用失败")
+        return None
+
+    # 提取分类结果
+    match = re.search(r'Category:\s*(\d)', response)
+    if not match:
+        print(f"ID {idx}: 未找到分类结果 - {response}")
+        return None
+    return int(match.group(1))
+
+
+def classify_batch(items, max_prompt_tokens=None):
+    """
+    items: [(idx, input_text), ...]；将多个问题编号后放入一次请求，
+    结果缺失或格式不正确的问题自动单独重发。返回与items等长的类别列表（失败为None）
+    max_prompt_tokens: 批量prompt超过该token数时对半拆分后分别请求
+    """
+    if len(items) == 1:
+        return [classify_single(*items[0])]
+
+    prompt = build_batch_prompt([text for _, text in items])
+    if max_prompt_tokens and count_tokens(prompt) > max_prompt_tokens:
+        mid = len(items) // 2
+        return classify_batch(items[:mid], max_prompt_tokens) + classify_batch(items[mid:], max_prompt_tokens)
+    response = gpt_chat(prompt)
+    categories = llm_utils.parse_batch_categories(response, len(items))
+
+    for i, (idx, input_text) in enumerate(items):
+        if categories[i] is None:
+            print(f"ID {idx}: 批量结果缺失或格式错误，单独重发")
+            categories[i] = classify_single(idx, input_text)
+    return categories
+
+
+def write_classified(idx, data, category, f_uni, f_multi):
+    """按<ts>标签数量将分类结果写入单变量/多变量文件"""
+    input_text = data["input"]
+    if category == 4:
+        print(f"ID {idx}: 分类为4(其他)，跳过")
+        return
+
+    # 统计<ts>标签数量
+    ts_count = len(re.findall(r'<ts><ts/>', input_text))
     
-    with open('./univariate_1round.jsonl', 'a') as f_uni, open('./multivariate_1round.jsonl', 'a') as f_multi:
-        with open(input_file, 'r') as f_in:
-            for idx, line in enumerate(f_in):
-                if idx < start_idx:
+    # 构建输出对象
+    output_data = {
+        "id": idx,
+        "task": task_map[category],
+        "question": input_text,
+        "output": data["output"],
+        "label": "",
+        "timeseries": data["timeseries"]
+    }
+     
+    if ts_count == 1:
+        f_uni.write(json.dumps(output_data) + '\n')
+        print(f"ID {idx}: 写入univariate.json (分类: {category})")
+    elif ts_count >= 2:
+        f_multi.write(json.dumps(output_data) + '\n')
+        print(f"ID {idx}: 写入multivariate.json (分类: {category}, TS数量: {ts_count})")
+    else:
+        print(f"ID {idx}: 未找到<ts>标签")
+
+
+def process_data(input_file, start_idx, end_idx, resume=False, batch_size=1,
+                 cascade=False, confidence_threshold=0.9, routing_file='./routing_1round.jsonl',
+                 max_prompt_tokens=None):
+    """
+    batch_size > 1 时每次请求打包多个问题，节省重复发送的指令和示例token；
+    批量prompt超过max_prompt_tokens时自动拆分（可先用token_planner.py预估）
+    cascade=True 时先用classify_rule_based的规则分类，置信度不低于confidence_threshold的样本直接由规则判定，
+    其余样本才交给GPT；每条样本的路由结果写入routing_file
+    """
+    out_paths = ['./univariate_1round.jsonl', './multivariate_1round.jsonl']
+    if cascade:
+        out_paths.append(routing_file)
+    # 断点续跑日志：resume=True时跳过已完成的样本
+    ckpt = Checkpoint(out_paths, resume=resume)
+    route_cnt = {"rule": 0, "llm": 0}
+    with ckpt, open(out_paths[0], 'a') as f_uni, open(out_paths[1], 'a') as f_multi, \
+         open(routing_file if cascade else os.devnull, 'a' if resume else 'w') as f_route:
+        out_files = [f_uni, f_multi, f_route] if cascade else [f_uni, f_multi]
+
+        def flush(batch):
+            # batch: [(idx, data, rule_category, confidence, route)]，route为"llm"的样本需要GPT分类
+            llm_items = [(idx, data["input"]) for idx, data, _, _, route in batch if route == "llm"]
+            try:
+                llm_categories = iter(classify_batch(llm_items, max_prompt_tokens)) if llm_items else iter(())
+            except Exception as e:
+                print(f"ID {batch[0][0]}-{batch[-1][0]}: 处理错误 - {e}")
+                return
+            for idx, data, rule_category, confidence, route in batch:
+                category = rule_category if route == "rule" else next(llm_categories)
+                if category is None:
+                    continue
+                try:
+                    write_classified(idx, data, category, f_uni, f_multi)
+                    if cascade:
+                        route_cnt[route] += 1
+                        f_route.write(json.dumps({
+                            "id": idx, "route": route, "rule_category": rule_category,
+                            "confidence": confidence, "category": category
+                        }) + '\n')
+                    ckpt.mark_done(idx, out_files)
+                except KeyError as e:
+                    print(f"ID {idx}: 缺少必要字段 - {e}")
+                except Exception as e:
+                    print(f"ID {idx}: 处理错误 - {e}")
+
+        batch = []
+        pending_llm = 0
+        # 借助行偏移索引直接定位到start_idx，无需从头逐行跳过
+        with JsonlIndex(input_file) as index:
+            for idx, line in index.iter_range(start_idx, end_idx):
+                if ckpt.is_done(idx):
                     continue
-                if idx > end_idx:
-                    break
                     
                 try:
                     data = json.loads(line.strip())
-                    input_text = data["input"]
-                    
-                    # 构建prompt并调用API
-                    prompt = prompt_template.format(question=input_text)
-                    response = gpt_chat(prompt)
-                    
-                    if response is None:
-                        print(f"ID {idx}: API调用失败")
-                        continue
-                    
-                    # 提取分类结果
-                    match = re.search(r'Category:\s*(\d)', response)
-                    if not match:
-                        print(f"ID {idx}: 未找到分类结果 - {response}")
-                        continue
-                        
-                    category = int(match.group(1))                    
-                    if category == 4:
-                        print(f"ID {idx}: 分类为4(其他)，跳过")
-                        continue
-                    
-                    # 统计<ts>标签数量
-                    ts_count = len(re.findall(r'<ts><ts/>', input_text))
-                    
-                    # 确定任务类型
-                    task_map = {
-                        1: "Anomaly detection",
-                        2: "Scenario attribution",
-                        3: "Inferential calculation"
-                    }
-                    
-                    # 构建输出对象
-                    output_data = {
-                        "id": idx,
-                        "task": task_map[category],
-                        "question": input_text,
-                        "output": data["output"],
-                        "label": "",
-                        "timeseries": data["timeseries"]
-                    }
-                     
-                    if ts_count == 1:
-                        f_uni.write(json.dumps(output_data) + '\n')
-                        print(f"ID {idx}: 写入univariate.json (分类: {category})")
-                    elif ts_count >= 2:
-                        f_multi.write(json.dumps(output_data) + '\n')
-                        print(f"ID {idx}: 写入multivariate.json (分类: {category}, TS数量: {ts_count})")
-                    else:
-                        print(f"ID {idx}: 未找到<ts>标签")
-                        
+                    data["input"]
+                    rule_category, confidence, route = None, None, "llm"
+                    if cascade:
+                        rule_category, confidence = classify_ts_task_with_confidence(data["input"], data.get("output", ""))
+                        if confidence >= confidence_threshold:
+                            route = "rule"
                 except json.JSONDecodeError:
                     print(f"ID {idx}: JSON解析错误")
+                    continue
                 except KeyError as e:
                     print(f"ID {idx}: 缺少必要字段 - {e}")
-                except Exception as e:
-                    print(f"ID {idx}: 处理错误 - {e}")
-                
-                time.sleep(1)
+                    continue
+
+                batch.append((idx, data, rule_category, confidence, route))
+                if route == "llm":
+                    pending_llm += 1
+                # 规则判定的样本与GPT样本一起按输入顺序写出
+                if pending_llm >= batch_size or len(batch) >= max(batch_size, 1000):
+                    flush(batch)
+                    batch = []
+                    pending_llm = 0
+            if batch:
+                flush(batch)
+
+    if cascade:
+        print(f"级联分类：规则判定 {route_cnt['rule']} 条，GPT判定 {route_cnt['llm']} 条，路由记录已保存到{routing_file}")
 
 if __name__ == "__main__":
     input_file = "./sft/chatts_sft_train.jsonl"   #"./chatts_sft_train.jsonl"
@@ -139,11 +238,23 @@ if __name__ == "__main__":
     卓敏0-10000; 湘婷10001-20000; 李林20001-30000; 奕非30001-40000
     """
     
-    open('univariate_1round.jsonl', 'w').close()
-    open('multivariate_1round.jsonl', 'w').close()
+    # LLM响应缓存：mode="replay"时只读回放缓存，不发起新请求
+    configure_cache("./llm_cache.sqlite", mode="readwrite")
+
+    resume = "--resume" in sys.argv  # 断点续跑：python classification_gpt4omini_1round.py --resume
+    if not resume:
+        open('univariate_1round.jsonl', 'w').close()
+        open('multivariate_1round.jsonl', 'w').close()
     
-    process_data(input_file, start_index, end_index)
+    batch_size = 10  # 每次请求打包的问题数；1为逐条请求
+    cascade = True   # 规则置信度高的样本直接判定，只有难判断的样本调用GPT
+    # 批量prompt超过上下文预算时对半拆分；token_planner.py按同一预算预估
+    process_data(input_file, start_index, end_index, resume=resume, batch_size=batch_size, cascade=cascade,
+                 max_prompt_tokens=llm_utils.batch_prompt_budget(batch_size))
     print("处理完成.结果已保存到univariate_1round.jsonl和multivariate_1round.jsonl")
+    print_cache_stats()
+    print_telemetry_stats()
+    export_telemetry("./llm_telemetry_1round.json", "./llm_telemetry_1round.prom")
 
 
 
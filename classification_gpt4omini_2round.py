@@ -1,9 +1,15 @@
 
 
+import sys
 import json
 import re
-import time
 from openai import OpenAI
+import llm_utils
+from llm_utils import count_tokens
+from llm_cache import configure_cache, print_cache_stats
+from llm_telemetry import export_telemetry, print_telemetry_stats
+from checkpoint import Checkpoint
+from jsonl_index import JsonlIndex
 
 """conda environment: rebuttal"""
 
@@ -14,27 +20,11 @@ client = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.chatanywhere.tech/
 
 # 大模型请求函数（复用）
 def gpt_chat(content, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            response = client.chat.completions.create(
-                model=gpt_model,
-                temperature=0.2,
-                messages=[{"role": "user", "content": content}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
-            retry_count += 1
-            if retry_count < max_retries:
-                time.sleep(5)
-    print("已达到最大重试次数，请求失败。")
-    return None
-
-
-def process_secondary(input_file, output_file, start_idx, end_idx):
-    # 最新任务定义（基于修改后内容）
-    prompt_template = """
+    return llm_utils.gpt_chat(client, gpt_model, content, max_retries)
+
+
+# 最新任务定义（基于修改后内容）
+prompt_template = """
         **Task:** Evaluate if the given question is correctly classified into the task category based on the task definitions. If correctly, only ouput the corresponding category number (1/2/3/4). If not, reclassify it into the correct task category and only output the final category number (1/2/3/4).  
 
         **Task Definitions:**  
@@ -59,88 +49,167 @@ def process_secondary(input_file, output_file, start_idx, end_idx):
         **Output format:**  
         - Final Category: [1/2/3/4]  
     """
-    
-    # 映射任务名称到原始类别编号（1/2/3）
-    task_to_category = {
-        "Anomaly detection": 1,
-        "Scenario attribution": 2,
-        "Inferential calculation": 3,
-        "Others": 4
-    }
-    
-    cnt = 0
-    # 打开输出文件（_2round）
-    with open(output_file, 'a') as f_sec:
-        
-        with open(input_file, 'r') as f_in:
-            for idx, line in enumerate(f_in):
-                if idx < start_idx:
-                    continue
-                if idx > end_idx:
-                    break
-                
-                try:
-                    data = json.loads(line.strip())
-                    question = data["question"]
-                    original_task = data["task"]
-                    id = data["id"]
 
-                    # 获取原始类别编号（1/2/3）
-                    if original_task not in task_to_category:
-                        print(f"ID {id}: 原始任务类型无效 - {original_task}，跳过")
-                        continue
-                    original_category = task_to_category[original_task]
+# 批量模式：一次请求中放入多个编号问题（各自附带原始分类），共用上面的任务定义和要求
+batch_prompt_template = (
+    prompt_template.split("**Original Classification:**")[0]
+    + """**Questions (evaluate each numbered question independently against its own original classification):**  
+{questions}
+
+        **Guidelines:**"""
+    + prompt_template.split("**Guidelines:**")[1].split("**Output format:**")[0]
+    + """**Output format:**  
+        - Output one line per question, in order:  
+        - Question <n> Final Category: [1/2/3/4]  
+"""
+)
+
+# 映射任务名称到原始类别编号（1/2/3）
+task_to_category = {
+    "Anomaly detection": 1,
+    "Scenario attribution": 2,
+    "Inferential calculation": 3,
+    "Others": 4
+}
+
+# 更新任务类型
+task_map = {
+    1: "Anomaly detection", 
+    2: "Scenario attribution", 
+    3: "Inferential calculation",
+    4: "Others"
+} 
+
+
+def build_single_prompt(question, original_task):
+    return prompt_template.format(
+        original_category=original_task,
+        question=question
+    )
+
+
+def build_batch_prompt(pairs):
+    """pairs: [(question, original_task), ...]"""
+    questions = "\n".join(
+        f"        Question {n} (Original Classification: {original_task}): {question}"
+        for n, (question, original_task) in enumerate(pairs, 1)
+    )
+    return batch_prompt_template.format(questions=questions)
+
+
+def verify_single(id, question, original_task):
+    """单条二次筛选，失败返回None"""
+    response = gpt_chat(build_single_prompt(question, original_task))
+
+    if response is None:
+        print(f"ID {id}: API调用失败")
+        return None
+
+    # 提取最终分类结果
+    match = re.search(r'Final Category:\s*(\d)', response)
+    if not match:
+        print(f"ID {id}: 未找到最终分类结果 - {response}")
+        return None
+    return int(match.group(1))
+
+
+def verify_batch(items, max_prompt_tokens=None):
+    """
+    items: [(id, question, original_task), ...]；将多个问题编号后放入一次请求，
+    结果缺失或格式不正确的问题自动单独重发。返回与items等长的最终类别列表（失败为None）
+    max_prompt_tokens: 批量prompt超过该token数时对半拆分后分别请求
+    """
+    if len(items) == 1:
+        return [verify_single(*items[0])]
 
-                    # 构建二次筛选prompt
-                    prompt = prompt_template.format(
-                        original_category=original_task,
-                        question=question
-                    )
-                    response = gpt_chat(prompt)
+    prompt = build_batch_prompt([(question, original_task) for _, question, original_task in items])
+    if max_prompt_tokens and count_tokens(prompt) > max_prompt_tokens:
+        mid = len(items) // 2
+        return verify_batch(items[:mid], max_prompt_tokens) + verify_batch(items[mid:], max_prompt_tokens)
+    response = gpt_chat(prompt)
+    categories = llm_utils.parse_batch_categories(response, len(items), label="Final Category")
 
-                    if response is None:
-                        print(f"ID {id}: API调用失败")
-                        continue
+    for i, item in enumerate(items):
+        if categories[i] is None:
+            print(f"ID {item[0]}: 批量结果缺失或格式错误，单独重发")
+            categories[i] = verify_single(*item)
+    return categories
 
-                    # 提取最终分类结果
-                    match = re.search(r'Final Category:\s*(\d)', response)
-                    if not match:
-                        print(f"ID {id}: 未找到最终分类结果 - {response}")
-                        continue
-                    final_category = int(match.group(1))
-                    
+
+def process_secondary(input_file, output_file, start_idx, end_idx, resume=False, batch_size=1,
+                      max_prompt_tokens=None):
+    """
+    batch_size > 1 时每次请求打包多个问题，节省重复发送的任务定义token；
+    批量prompt超过max_prompt_tokens时自动拆分（可先用token_planner.py预估）
+    """
+    cnt = 0
+    # 断点续跑日志：resume=True时跳过已完成的样本
+    ckpt = Checkpoint(output_file, resume=resume)
+    # 打开输出文件（_2round）
+    with ckpt, open(output_file, 'a') as f_sec:
+
+        def flush(batch):
+            nonlocal cnt
+            try:
+                final_categories = verify_batch([(data["id"], data["question"], data["task"]) for data in batch], max_prompt_tokens)
+            except Exception as e:
+                print(f"ID {batch[0]['id']}-{batch[-1]['id']}: 处理错误 - {e}")
+                return
+            for data, final_category in zip(batch, final_categories):
+                id = data["id"]
+                if final_category is None:
+                    continue
+                try:
                     # 计数二次筛选掉的样本
-                    if final_category != original_category:
+                    if final_category != task_to_category[data["task"]]:
                         cnt += 1
 
-                    # print("question:", question)
                     # 仅保留1/2/3类
                     if final_category not in [1, 2, 3]:
                         print(f"ID {id}: 最终分类为{final_category}(其他)，跳过")
+                        ckpt.mark_done(id, [f_sec])
                         continue
 
-                    # 更新任务类型
-                    task_map = {
-                        1: "Anomaly detection", 
-                        2: "Scenario attribution", 
-                        3: "Inferential calculation",
-                        4: "Others"
-                    } 
-                    
                     data["task"] = task_map[final_category]
 
                     # 写入输出文件
                     f_sec.write(json.dumps(data) + '\n')
-                    print(f"ID {id}: 二次分类为{final_category}，已写入./univariate_2round.jsonl")
+                    print(f"ID {id}: 二次分类为{final_category}，已写入{output_file}")
+                    ckpt.mark_done(id, [f_sec])
+                except Exception as e:
+                    print(f"ID {id}: 处理错误 - {e}")
 
+        batch = []
+        # 借助行偏移索引直接定位到start_idx，无需从头逐行跳过
+        with JsonlIndex(input_file) as index:
+            for idx, line in index.iter_range(start_idx, end_idx):
+                
+                id = idx
+                try:
+                    data = json.loads(line.strip())
+                    data["question"]  # 必要字段校验，缺失时在此处跳过而不是在批量请求中报错
+                    original_task = data["task"]
+                    id = data["id"]
                 except json.JSONDecodeError:
                     print(f"ID {id}: JSON解析错误")
+                    continue
                 except KeyError as e:
                     print(f"ID {id}: 缺少必要字段 - {e}")
-                except Exception as e:
-                    print(f"ID {id}: 处理错误 - {e}")
+                    continue
+                if ckpt.is_done(id):
+                    continue
 
-                time.sleep(1)
+                # 获取原始类别编号（1/2/3）
+                if original_task not in task_to_category:
+                    print(f"ID {id}: 原始任务类型无效 - {original_task}，跳过")
+                    continue
+
+                batch.append(data)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
                 
     print(f"数据二次筛选完成，共修改 {cnt} 条记录。")
 
@@ -153,8 +222,19 @@ if __name__ == "__main__":
     start_index = 0  # 起始索引(包含)
     end_index = 250  # 结束索引(包含)
     
-    # 清空输出文件
-    open(output_path, 'w').close()
+    # LLM响应缓存：mode="replay"时只读回放缓存，不发起新请求
+    configure_cache("./llm_cache.sqlite", mode="readwrite")
+
+    resume = "--resume" in sys.argv  # 断点续跑：python classification_gpt4omini_2round.py --resume
+    # 清空输出文件（续跑时保留已有结果）
+    if not resume:
+        open(output_path, 'w').close()
     
-    process_secondary(input_path, output_path, start_index, end_index)
-    print(f"二次筛选完成. 结果已保存到{output_path}")
\ No newline at end of file
+    batch_size = 10  # 每次请求打包的问题数；1为逐条请求
+    # 批量prompt超过上下文预算时对半拆分；token_planner.py按同一预算预估
+    process_secondary(input_path, output_path, start_index, end_index, resume=resume, batch_size=batch_size,
+                      max_prompt_tokens=llm_utils.batch_prompt_budget(batch_size))
+    print(f"二次筛选完成. 结果已保存到{output_path}")
+    print_cache_stats()
+    print_telemetry_stats()
+    export_telemetry("./llm_telemetry_2round.json", "./llm_telemetry_2round.prom")
\ No newline at end of file
@@ -2,6 +2,7 @@ import re
 import json
 from typing import List, Dict
 from word2number import w2n 
+from record_codec import LazyRecord
 
 
 def process_jsonl_label(input_file: str) -> None:
@@ -18,7 +19,8 @@ def process_jsonl_label(input_file: str) -> None:
                 continue
             
             try:
-                data = json.loads(line.strip())
+                # 只解码id和task，不解析timeseries
+                data = LazyRecord(line.strip())
                 
                 id = data["id"]
                 task = data["task"].strip()
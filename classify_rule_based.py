@@ -1,7 +1,13 @@
+import os
 import json
 import re
 import time
+import shutil
+import multiprocessing
 from openai import OpenAI
+from jsonl_shards import split_byte_ranges, shard_line_offsets, iter_lines_in_range
+from jsonl_index import JsonlIndex
+from record_codec import LazyRecord, dumps_fields
 
 """conda envvironment: rebuttal"""
 
@@ -15,40 +21,151 @@ def classify_ts_task(input_text, output_text) -> int:
     4. Others(类别4): 不满足上述三类的其他任务
     返回: 任务类别编号(1/2/3/4)
     """
-    # 不区分大小写
+    return classify_ts_task_with_confidence(input_text, output_text)[0]
+
+
+# 异常检测关键词
+anomaly_keywords = {
+    "normal", 
+    "abnormal", "anomalous", "anomaly", "anomalies", 
+    "usual", "unusual", 
+    "expected", "unexpected",
+    "extreme",
+}
+
+# 规则置信度：高于阈值的样本可直接由规则判定，低于阈值的交给大模型
+CONFIDENCE_HIGH = 0.95
+CONFIDENCE_LOW = 0.5
+
+# 所有input侧规则信号编译成一个带命名分组的正则，一次扫描即可得到全部信号
+# （各信号的词组互不重叠，非重叠扫描不会漏掉信号）
+_INPUT_SIGNAL_RE = re.compile(
+    r'\b(?:'
+    r'(?P<choose_from>choose\s+from)'
+    r'|(?P<how_many>how\s+many)'
+    r'|(?P<anomaly>' + '|'.join(sorted(map(re.escape, anomaly_keywords), key=len, reverse=True)) + r')'
+    r'|(?P<option>options?|select|which of the following)'
+    r')\b'
+)
+_OUTPUT_YES_NO_RE = re.compile(r'\b(?:yes|no)\b')
+
+
+def scan_signals(input_text, output_text) -> tuple[set, bool, bool]:
+    """
+    一次扫描小写后的input和output，返回 (input命中的信号集合, output是否含yes/no, output是否以yes/no开头)
+    """
     input_lower = input_text.lower()
     output_lower = output_text.lower()
+
+    signals = {match.lastgroup for match in _INPUT_SIGNAL_RE.finditer(input_lower)}
+    yes_no = _OUTPUT_YES_NO_RE.search(output_lower)
+    starts_with_yes_no = yes_no is not None and output_lower[:yes_no.start()].strip() == ""
+    return signals, yes_no is not None, starts_with_yes_no
+
+
+def classify_ts_task_with_confidence(input_text, output_text) -> tuple[int, float]:
+    """
+    与classify_ts_task规则相同，额外返回规则判定的置信度(0~1)
+    多条规则信号相互冲突、或只命中弱信号时置信度较低
+    返回: (任务类别编号, 置信度)
+    """
+    signals, output_contains_yes_no, starts_with_yes_no = scan_signals(input_text, output_text)
     
     # 1. Scenario attribution
-    if re.search(r'\bchoose\b\s+\bfrom\b', input_lower):
-        return 2
+    if "choose_from" in signals:
+        # 同时含"how many"时大模型按计数优先规则可能判为类别3，交给大模型
+        return 2, (CONFIDENCE_LOW if "how_many" in signals else CONFIDENCE_HIGH)
     
     # 2. Inferential calculation
     # 匹配"how many"及常见扩展形式(如how many occasions/times/days等)
-    if re.search(r'\bhow\b\s+\bmany\b', input_lower):
-        return 3
+    if "how_many" in signals:
+        return 3, CONFIDENCE_HIGH
     
     # 3. Anomaly detection: 含异常相关关键词 + 是/否判断逻辑
-    anomaly_keywords = {
-        "normal", 
-        "abnormal", "anomalous", "anomaly", "anomalies", 
-        "usual", "unusual", 
-        "expected", "unexpected",
-        "extreme",
-    }
-    # 检查是否包含至少一个异常关键词
-    has_anomaly_keyword = any(
-        re.search(r'\b' + re.escape(keyword) + r'\b', input_lower) 
-        for keyword in anomaly_keywords
-    )
-    # 检查output
-    output_contains_yes_no = re.search(r'\byes\b', output_lower) or re.search(r'\bno\b', output_lower)
-    
-    if has_anomaly_keyword and output_contains_yes_no:
-        return 1
+    if "anomaly" in signals and output_contains_yes_no:
+        # 回答以yes/no开头才是明确的是非题，否则yes/no可能只是出现在解释里
+        if starts_with_yes_no:
+            return 1, CONFIDENCE_HIGH
+        return 1, CONFIDENCE_LOW
     
     # 4. Others(类别4)
-    return 4
+    # 含异常关键词或选项类表述、但不满足上述规则的样本较难判断；不含任何信号的一般问题可直接判为类别4
+    if "anomaly" in signals or "option" in signals:
+        return 4, CONFIDENCE_LOW
+    return 4, CONFIDENCE_HIGH
+
+
+def classify_ts_tasks(records) -> list[int]:
+    """批量分类：records为含input/output字段的字典列表，返回与之等长的类别编号列表"""
+    return [category for category, _ in classify_ts_tasks_with_confidence(records)]
+
+
+def classify_ts_tasks_with_confidence(records) -> list[tuple[int, float]]:
+    """批量版本的classify_ts_task_with_confidence"""
+    return [
+        classify_ts_task_with_confidence(record.get("input", ""), record.get("output", ""))
+        for record in records
+    ]
+
+
+# 确定任务类型
+task_map = {
+    1: "Anomaly detection",
+    2: "Scenario attribution",
+    3: "Inferential calculation"
+}
+
+
+def classify_line(idx, line, verbose=True):
+    """
+    对一行原始ChatTS样本做规则分类
+    返回: ("uni"/"multi", 输出行字符串)；类别4、无<ts>标签或解析失败时返回None
+    """
+    try:
+        # 只解码分类用到的字段，timeseries按原始JSON文本直接写出
+        data = LazyRecord(line.strip())
+        input_text = data.get("input", "")
+        output_text = data.get("output", "")
+        
+        # rule based分类
+        category = classify_ts_task(input_text, output_text)
+                           
+        if category == 4:
+            if verbose:
+                print(f"ID {idx}: 分类为4(其他)，跳过")
+            return None
+        
+        # 统计<ts>标签数量
+        ts_count = input_text.count('<ts><ts/>')
+        
+        # 构建输出对象
+        output_data = [
+            ("id", idx),
+            ("task", task_map[category]),
+            ("question", input_text),
+            ("output", data["output"]),
+            ("label", ""),
+            ("timeseries", data.raw("timeseries"))
+        ]
+         
+        if ts_count == 1:
+            if verbose:
+                print(f"ID {idx}: 写入univariate.json (分类: {category})")
+            return "uni", dumps_fields(output_data) + '\n'
+        elif ts_count >= 2:
+            if verbose:
+                print(f"ID {idx}: 写入multivariate.json (分类: {category}, TS数量: {ts_count})")
+            return "multi", dumps_fields(output_data) + '\n'
+        else:
+            print(f"ID {idx}: 未找到<ts>标签")
+            
+    except json.JSONDecodeError:
+        print(f"ID {idx}: JSON解析错误")
+    except KeyError as e:
+        print(f"ID {idx}: 缺少必要字段 - {e}")
+    except Exception as e:
+        print(f"ID {idx}: 处理错误 - {e}")
+    return None
 
 
 def process_data(input_file, univariate_out_file, multivariate_out_file, start_idx, end_idx):
@@ -56,61 +173,70 @@ def process_data(input_file, univariate_out_file, multivariate_out_file, start_i
     open(multivariate_out_file, 'w').close()
     
     with open(univariate_out_file, 'a') as f_uni, open(multivariate_out_file, 'a') as f_multi:
-        with open(input_file, 'r') as f_in:
-            for idx, line in enumerate(f_in):
-                if idx < start_idx:
-                    continue
-                if idx > end_idx:
-                    break
+        # 借助行偏移索引直接定位到start_idx，无需从头逐行跳过
+        with JsonlIndex(input_file) as index:
+            for idx, line in index.iter_range(start_idx, end_idx):
                     
-                try:
-                    data = json.loads(line.strip())
-                    input_text = data.get("input", "")
-                    output_text = data.get("output", "")
-                    
-                    # rule based分类
-                    category = classify_ts_task(input_text, output_text)
-                                       
-                    if category == 4:
-                        print(f"ID {idx}: 分类为4(其他)，跳过")
-                        continue
-                    
-                    # 统计<ts>标签数量
-                    ts_count = len(re.findall(r'<ts><ts/>', input_text))
-                    
-                    # 确定任务类型
-                    task_map = {
-                        1: "Anomaly detection",
-                        2: "Scenario attribution",
-                        3: "Inferential calculation"
-                    }
-                    
-                    # 构建输出对象
-                    output_data = {
-                        "id": idx,
-                        "task": task_map[category],
-                        "question": input_text,
-                        "output": data["output"],
-                        "label": "",
-                        "timeseries": data["timeseries"]
-                    }
-                     
-                    if ts_count == 1:
-                        f_uni.write(json.dumps(output_data) + '\n')
-                        print(f"ID {idx}: 写入univariate.json (分类: {category})")
-                    elif ts_count >= 2:
-                        f_multi.write(json.dumps(output_data) + '\n')
-                        print(f"ID {idx}: 写入multivariate.json (分类: {category}, TS数量: {ts_count})")
-                    else:
-                        print(f"ID {idx}: 未找到<ts>标签")
-                        
-                except json.JSONDecodeError:
-                    print(f"ID {idx}: JSON解析错误")
-                except KeyError as e:
-                    print(f"ID {idx}: 缺少必要字段 - {e}")
-                except Exception as e:
-                    print(f"ID {idx}: 处理错误 - {e}")
-    
+                result = classify_line(idx, line)
+                if result is None:
+                    continue
+                target, out_line = result
+                (f_uni if target == "uni" else f_multi).write(out_line)
+
+
+def _classify_shard(input_file, byte_start, byte_end, first_idx, start_idx, end_idx, uni_tmp, multi_tmp):
+    """子进程：分类一个字节分片，结果写入该分片自己的临时文件，返回各类计数"""
+    counts = {"uni": 0, "multi": 0, "skipped": 0}
+    with open(uni_tmp, 'w') as f_uni, open(multi_tmp, 'w') as f_multi:
+        for idx, line in enumerate(iter_lines_in_range(input_file, byte_start, byte_end), start=first_idx):
+            if idx < start_idx:
+                continue
+            if idx > end_idx:
+                break
+            result = classify_line(idx, line, verbose=False)
+            if result is None:
+                counts["skipped"] += 1
+                continue
+            target, out_line = result
+            (f_uni if target == "uni" else f_multi).write(out_line)
+            counts[target] += 1
+    return counts
+
+
+def process_data_parallel(input_file, univariate_out_file, multivariate_out_file, start_idx, end_idx, workers=None):
+    """
+    多进程版本的process_data：按换行符对齐的字节范围切分输入文件，每个分片在独立进程中分类，
+    最后按分片顺序合并，输出内容和顺序与单进程版本一致（id仍为原始行号）
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = split_byte_ranges(input_file, workers * 4)  # 分片数多于进程数，便于负载均衡
+
+    with multiprocessing.Pool(workers) as pool:
+        first_idxs = shard_line_offsets(input_file, ranges, pool)
+        tasks = []
+        for i, ((byte_start, byte_end), first_idx) in enumerate(zip(ranges, first_idxs)):
+            # 整个分片都不在[start_idx, end_idx]内时跳过
+            next_idx = first_idxs[i + 1] if i + 1 < len(first_idxs) else float("inf")
+            if next_idx <= start_idx or first_idx > end_idx:
+                continue
+            tasks.append((input_file, byte_start, byte_end, first_idx, start_idx, end_idx,
+                          f"{univariate_out_file}.shard{i}", f"{multivariate_out_file}.shard{i}"))
+        results = pool.starmap(_classify_shard, tasks)
+
+    # 按分片顺序合并临时文件
+    totals = {"uni": 0, "multi": 0, "skipped": 0}
+    with open(univariate_out_file, 'wb') as f_uni, open(multivariate_out_file, 'wb') as f_multi:
+        for task, counts in zip(tasks, results):
+            uni_tmp, multi_tmp = task[-2], task[-1]
+            for tmp, f_out in ((uni_tmp, f_uni), (multi_tmp, f_multi)):
+                with open(tmp, 'rb') as f_tmp:
+                    shutil.copyfileobj(f_tmp, f_out)
+                os.remove(tmp)
+            for key in totals:
+                totals[key] += counts[key]
+    print(f"并行分类完成（{workers}进程，{len(tasks)}个分片）: 单变量 {totals['uni']} 条，"
+          f"多变量 {totals['multi']} 条，跳过 {totals['skipped']} 条")
+
 
 if __name__ == "__main__":
     input_file = "./sft/chatts_sft_train.jsonl"   #"./chatts_sft_train.jsonl"
@@ -120,6 +246,10 @@ if __name__ == "__main__":
     univariate_out_file = 'univariate_rule_based.jsonl'
     multivariate_out_file = 'multivariate_rule_based.jsonl'
 
-    process_data(input_file, univariate_out_file, multivariate_out_file, start_index, end_index)
+    workers = os.cpu_count()  # 并行进程数；设为1时使用单进程版本
+    if workers and workers > 1:
+        process_data_parallel(input_file, univariate_out_file, multivariate_out_file, start_index, end_index, workers)
+    else:
+        process_data(input_file, univariate_out_file, multivariate_out_file, start_index, end_index)
     print(f"处理完成.结果已保存到{univariate_out_file}和{multivariate_out_file}")
 
@@ -2,6 +2,91 @@ import re
 import json
 from typing import List, Dict
 from word2number import w2n 
+from record_codec import LazyRecord, insert_after
+from stage_cache import StageCache, code_hash, DEFAULT_STAGE_CACHE_PATH
+
+# 单遍扫描CoT的标记：Step N 标题与 [Judgment]/[Description]/[Analysis] 小节标记
+# 与原先逐个Step做正则回溯匹配不同，这里对全文只做一次线性扫描，之后只在标记列表上查找
+_COT_TOKEN_RE = re.compile(r"step ([0-9])|\[(judgment|description|analysis)\]", re.IGNORECASE)
+
+
+def _clean_cot(cot_content: str) -> str:
+    # 先统一处理换行和多余空格，避免格式干扰
+    return cot_content.strip().replace("\n", " ").replace("  ", " ")
+
+
+def _tokenize_cot(cot_clean: str) -> List[tuple]:
+    """返回 [(start, end, step编号或None, 小节名小写或None)]"""
+    return [(m.start(), m.end(), int(m.group(1)) if m.group(1) else None,
+             m.group(2).lower() if m.group(2) else None)
+            for m in _COT_TOKEN_RE.finditer(cot_clean)]
+
+
+def parse_cot_sections(cot_content: str) -> Dict[int, Dict[str, str]]:
+    """
+    把CoT按 Step 1..Step 6 标题切分一次，提取每个Step中各小节的内容
+    返回格式：{1: {"judgment": ..., "description": ..., "analysis": ...}, 2: {...}, ...}
+    - 标题按编号递增识别，正文中对前面Step的引用（如"as in Step 2"）不会切出新的Step
+    - 小节内容到下一个标记为止，去除首尾空白和**符号；同名小节只取第一个
+    """
+    sections = {}
+    if not isinstance(cot_content, str) or cot_content.strip() == "":
+        return sections
+    cot_clean = _clean_cot(cot_content)
+
+    step, name, content_start = None, None, 0
+    for start, end, step_num, section in _tokenize_cot(cot_clean):
+        if step_num is not None and step is not None and step_num <= step:
+            continue
+        if step is not None and name is not None:
+            sections[step].setdefault(name, cot_clean[content_start:start].replace("**", "").strip())
+        if step_num is not None:
+            step, name = step_num, None
+            sections.setdefault(step, {})
+        elif step is not None:
+            name = section
+        content_start = end
+    if step is not None and name is not None:
+        sections[step].setdefault(name, cot_clean[content_start:].replace("**", "").strip())
+    return sections
+
+
+def _find_judgment(cot_clean: str, tokens: List[tuple], step_num: int, until_description: bool) -> str | None:
+    """
+    与原正则 Step N.*?[Judgment]\s*(**)?\s*(内容)\s*(**)?\s*[Description] 的匹配结果一致：
+    取第一个Step N之后的第一个[Judgment]，先跳过其后的空白和一层**，内容到其后第一个[Description]为止
+    （内容至少一个字符；until_description=False时到全文结尾）
+    """
+    i = next((i for i, t in enumerate(tokens) if t[2] == step_num), None)
+    if i is None:
+        return None
+    j = next((j for j in range(i + 1, len(tokens)) if tokens[j][3] == "judgment"), None)
+    if j is None:
+        return None
+    rest = cot_clean[tokens[j][1]:].lstrip()
+    if rest.startswith("**"):
+        rest = rest[2:].lstrip()
+    content_start = len(cot_clean) - len(rest)
+    skipped = content_start > tokens[j][1]
+
+    if until_description:
+        k = next((k for k in range(j + 1, len(tokens))
+                  if tokens[k][3] == "description" and tokens[k][0] > content_start), None)
+        if k is None:
+            # 原正则回退时内容只剩空白或**，结果为空
+            has_adjacent = any(t[3] == "description" and t[0] == content_start for t in tokens[j + 1:])
+            return "" if skipped and has_adjacent else None
+        content = cot_clean[content_start:tokens[k][0]].rstrip()
+        if content.endswith("**") and len(content) > 2:
+            content = content[:-2].rstrip()
+    else:
+        content = cot_clean[content_start:].rstrip()
+        if not content:
+            return "" if skipped else None
+
+    # 去除内容首尾空白和**符号
+    return content.strip().replace("**", "").capitalize()
+
 
 def parse_cot_steps(cot_content: str) -> Dict[str, str | None]:
     """
@@ -17,33 +102,15 @@ def parse_cot_steps(cot_content: str) -> Dict[str, str | None]:
     if not isinstance(cot_content, str) or cot_content.strip() == "":
         return step_labels
 
-    # 先统一处理换行和多余空格，避免格式干扰
-    cot_clean = cot_content.strip().replace("\n", " ").replace("  ", " ")
-    
-    # Step1: 匹配 Step1 中 [Judgment] 到 [Description] 之间的纯内容
-    step1_pattern = r"Step 1.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*(?:\*\*)?\s*\[Description\]\s*(?:\*\*)?"
-    match = re.search(step1_pattern, cot_clean, re.IGNORECASE)
-    if match:
-        # 去除内容首尾空白和**符号
-        step_labels["step1_label"] = match.group(1).strip().replace("**", "").capitalize()
-
-    # Step2
-    step2_pattern = r"Step 2.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*(?:\*\*)?\s*\[Description\]\s*(?:\*\*)?"
-    match = re.search(step2_pattern, cot_clean, re.IGNORECASE)
-    if match:
-        step_labels["step2_label"] = match.group(1).strip().replace("**", "").capitalize()
-
-    # Step4
-    step4_pattern = r"Step 4.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*(?:\*\*)?\s*\[Description\]\s*(?:\*\*)?"
-    match = re.search(step4_pattern, cot_clean, re.IGNORECASE)
-    if match:
-        step_labels["step4_label"] = match.group(1).strip().replace("**", "").capitalize()
-
-    # Step6: 匹配 Step6 中 [Judgment] 到字符串结尾的纯内容（无Description）
-    step6_pattern = r"Step 6.*?(?:\*\*)?\s*\[Judgment\]\s*(?:\*\*)?\s*([\s\S]+?)\s*$"
-    match = re.search(step6_pattern, cot_clean, re.IGNORECASE)
-    if match:
-        step6_tmp = match.group(1).strip().replace("**", "").capitalize()
+    cot_clean = _clean_cot(cot_content)
+    tokens = _tokenize_cot(cot_clean)
+
+    # Step1/2/4: [Judgment] 到 [Description] 之间的纯内容
+    for step_num in (1, 2, 4):
+        step_labels[f"step{step_num}_label"] = _find_judgment(cot_clean, tokens, step_num, until_description=True)
+
+    # Step6: [Judgment] 到字符串结尾的纯内容（无Description）
+    step6_tmp = _find_judgment(cot_clean, tokens, 6, until_description=False)
     # 移除句末的标点
     if step6_tmp and isinstance(step6_tmp, str):
         # 匹配字符串末尾的一个英文句号/分号，替换为空
@@ -78,7 +145,72 @@ def extract_pure_number(text: str) -> int | None:
     except ValueError:
         return None
 
-def process_jsonl(input_file: str, correct_file: str, wrong_file: str) -> None:
+def normalize_text(text: str) -> str:
+    """推理最终答案比较前的归一化：忽略大小写、标点和空格"""
+    return re.sub(r"[^\w\s]", "", text.strip().lower()).replace(" ", "")
+
+
+def check_record(data):
+    """
+    单条样本：从cot_deepseekr1中提取stepx_label插入到label之后，并判断step6答案与label是否一致（原地修改data，dict或LazyRecord均可）
+    返回 (是否匹配, step6_label, 标签为空的step列表)
+    """
+    id = data["id"]
+    label = data["label"]
+    task = data["task"].strip()
+    cot_content = data["cot_deepseekr1"]
+    
+    # 提取stepx_label
+    step_labels = parse_cot_steps(cot_content)
+    
+    # 检查是否有空白标签并记录
+    empty_steps = []
+    for step, l in step_labels.items():
+        if l is None or l.strip() == "":
+            empty_steps.append(step)
+            print(f" ID {id} : {step} 标签为none或空白")
+
+    step6_label = step_labels.get("step6_label") or "unknown"
+
+    # 在label后依次插入新字段（stepx字段），保持其余字段顺序
+    # 若原始数据中没有label字段，新字段添加到末尾
+    anchor = "label"
+    for key, value in step_labels.items():
+        insert_after(data, anchor, key, value)
+        anchor = key
+        
+    # 推理最终答案是否正确,忽略大小写
+    norm_base = normalize_text(label)
+    norm_step6 = normalize_text(step6_label)
+    if task == "Inferential calculation":
+        # 提取出数值进行比较
+        step6_num = extract_pure_number(norm_step6)
+        base_num = extract_pure_number(norm_base)
+        # 只有数值相等才视为匹配
+        if step6_num is not None and base_num is not None:
+            is_match = (step6_num == base_num)
+        else:
+            is_match = False
+    else:
+        is_match = norm_step6 in norm_base or norm_base in norm_step6
+    return is_match, step6_label, empty_steps
+
+
+# stepx_label提取和答案比对实际用到的函数和正则（不含本文件__main__中的路径等配置）
+CHECK_RULES = (check_record, parse_cot_steps, _find_judgment, _tokenize_cot, _clean_cot, _COT_TOKEN_RE,
+               extract_pure_number, normalize_text)
+
+
+def check_stage_cache(path=DEFAULT_STAGE_CACHE_PATH, config_version="1") -> StageCache:
+    """stepx_label提取的阶段缓存：task/label/cot_deepseekr1及CHECK_RULES不变的样本复用上次的结果"""
+    return StageCache("cot_correct", ["task", "label", "cot_deepseekr1"],
+                      ["step1_label", "step2_label", "step4_label", "step6_label"],
+                      code_hash(*CHECK_RULES), config_version, path=path)
+
+
+def process_jsonl(input_file: str, correct_file: str, wrong_file: str, stage_cache_path=None) -> None:
+    """stage_cache_path不为None时启用阶段缓存，修改step解析规则后重跑只重算受影响的样本"""
+    cache = check_stage_cache(stage_cache_path) if stage_cache_path else None
     total_count = 0
     correct_count = 0
     wrong_count = 0
@@ -97,69 +229,31 @@ def process_jsonl(input_file: str, correct_file: str, wrong_file: str) -> None:
                 total_count += 1
 
                 try:
-                    data = json.loads(line)
+                    # 惰性解码：timeseries等大字段不解析，写出时原样拷贝
+                    data = LazyRecord(line)
                     # 必要字段校验
                     required_fields = ["id", "task", "output", "timeseries", "cot_deepseekr1", "label"]
                     for field in required_fields:
-                        if field not in data:
+                        if field not in data and not (field == "timeseries" and "timeseries_ref" in data):
                             raise KeyError(f"缺失必要字段: {field}")
                         
                     label = data["label"]
                     id = data["id"]
-                    task = data["task"].strip()
-                    cot_content = data["cot_deepseekr1"]
-                    
-                    # 提取stepx_label
-                    step_labels = parse_cot_steps(cot_content)
                     
-                    # 检查是否有空白标签并记录
-                    for step, l in step_labels.items():
-                        if l is None or l.strip() == "":
-                            empty_label_id.append(id)
-                            print(f" ID {id} : {step} 标签为none或空白")
-
-                    step6_label = step_labels.get("step6_label") or "unknown"
-
-                    # 准备要插入的新字段（stepx字段）
-                    new_fields = {**step_labels}
-                    # 创建新字典并保持字段顺序，在label后插入新字段
-                    new_data = {}
-                    label_found = False  # 标记是否已插入新字段
-                    for key, value in data.items():
-                        new_data[key] = value
-                        if key == "label" and not label_found:
-                            new_data.update(new_fields)
-                            label_found = True
-                    
-                    # 若原始数据中没有label字段，将新字段添加到末尾
-                    if not label_found:
-                        new_data.update(new_fields)
-                        
-                    # 推理最终答案是否正确,忽略大小写
-                    def normalize_text(text: str) -> str:
-                        return re.sub(r"[^\w\s]", "", text.strip().lower()).replace(" ", "")
-
-                    norm_base = normalize_text(label)
-                    norm_step6 = normalize_text(step6_label)
-                    if task == "Inferential calculation":
-                        # 提取出数值进行比较
-                        step6_num = extract_pure_number(norm_step6)
-                        base_num = extract_pure_number(norm_base)
-                        # 只有数值相等才视为匹配
-                        if step6_num is not None and base_num is not None:
-                            is_match = (step6_num == base_num)
-                        else:
-                            is_match = False
+                    if cache is not None:
+                        is_match, step6_label, empty_steps = cache.apply(data, check_record)
                     else:
-                        is_match = norm_step6 in norm_base or norm_base in norm_step6
+                        is_match, step6_label, empty_steps = check_record(data)
+                    new_data = data
+                    empty_label_id.extend([id] * len(empty_steps))
 
                     # 分别输出
                     if is_match:
-                        f_match.write(json.dumps(new_data, ensure_ascii=False) + "\n")
+                        f_match.write(new_data.dumps(ensure_ascii=False) + "\n")
                         correct_count += 1
                         print(f" ID {id} : 推理正确 | Step6_label: {step6_label} | label: {label}")
                     else:
-                        f_mismatch.write(json.dumps(new_data, ensure_ascii=False) + "\n")
+                        f_mismatch.write(new_data.dumps(ensure_ascii=False) + "\n")
                         wrong_count += 1
                         print(f" ID {id} : 推理失败 | Step6_label: {step6_label} | label: {label}")
 
@@ -185,6 +279,9 @@ def process_jsonl(input_file: str, correct_file: str, wrong_file: str) -> None:
     print(f"匹配失败：{wrong_count} 条（输出至 {wrong_file}）")
     print(f"处理错误：{error_count} 条, 失败ID: {error_id}")
     print(f"包含空白标签的ID: {empty_label_id}")
+    if cache is not None:
+        cache.print_stats()
+        cache.close()
     
 
 
@@ -199,4 +296,4 @@ if __name__ == "__main__":
     open(wrong_path, 'w').close()
 
     # 执行批量处理
-    process_jsonl(input_path, correct_path, wrong_path)
\ No newline at end of file
+    process_jsonl(input_path, correct_path, wrong_path, stage_cache_path="./stage_cache.sqlite")
\ No newline at end of file
@@ -1,31 +1,31 @@
+import sys
 import json
 import re
-import time
-from openai import OpenAI
+import asyncio
+import httpx
+from openai import OpenAI, AsyncOpenAI
+import llm_utils
+from llm_cache import configure_cache, print_cache_stats
+from llm_telemetry import set_task, attach_usage, configure_telemetry, export_telemetry, print_telemetry_stats
+from checkpoint import Checkpoint
+from rate_limiter import configure_limiter
+from record_codec import LazyRecord
+from series_store import resolve_timeseries
+from ts_serializer import configure_serializer, serialize_timeseries, print_serializer_stats
 
 # 配置OpenAI客户端
 gpt_model = "deepseek-r1"
 OPENAI_API_KEY = ""  # 替换为你的API密钥
-client = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.chatanywhere.tech/v1")
+BASE_URL = "https://api.chatanywhere.tech/v1"
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=BASE_URL)
+
+# prompt中时序的序列化格式：保留4位小数、去掉末尾0、紧凑分隔符；precision=None恢复原先的完整精度
+# token_planner.py预估时使用同一配置
+SERIALIZER_CONFIG = dict(precision=4, strip_zeros=True, scale=False, sep=",")
 
 # 大模型请求函数
 def gpt_chat(content, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            response = client.chat.completions.create(
-                model=gpt_model,
-                temperature=0.2,
-                messages=[{"role": "user", "content": content}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
-            retry_count += 1
-            if retry_count < max_retries:
-                time.sleep(5)
-    print("已达到最大重试次数，请求失败。")
-    return None
+    return llm_utils.gpt_chat(client, gpt_model, content, max_retries)
 
 
 template_Anomaly_detection = '''
@@ -142,77 +142,231 @@ Step 6 Summarizing the thinking process to output the answer:
 '''
 
 
-def process_jsonl_file(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-         open(output_file, 'w', encoding='utf-8') as outfile:
+def build_prompt(data):
+    """将时序数据填入question中的<ts><ts/>标签，并拼接对应任务的模板；格式不符合要求时返回None"""
+    # 提取所需字段
+    task = data.get('task', '')
+    question = data.get('question', '')
+    # 记录中可能只有timeseries_ref引用，此时从列式存储读取
+    timeseries2 = resolve_timeseries(data) if ('timeseries' in data or 'timeseries_ref' in data) else []
+
+    if isinstance(timeseries2, list) and all(isinstance(seq, list) for seq in timeseries2):
+        # 统计变量数量和标签数量
+        var_count = len(timeseries2)
+        ts_count = question.count('<ts><ts/>')
+
+        # 检查数量匹配
+        if var_count == 0:
+            print("错误：时间序列为空列表")
+            return None
+        elif ts_count != var_count:
+            print(f"警告：变量数量({var_count})与<ts><ts/>标签数量({ts_count})不匹配")
+            return None
+        else:
+            updated_question = question  # 数量匹配，正常替换
+
+        # 按顺序替换每个标签（无论数量是否匹配，都尝试替换已有的变量）
+        # 序列化格式（小数位数、分隔符等）由ts_serializer配置
+        for seq_str in serialize_timeseries(timeseries2, record_id=data.get('id')):
+            updated_question = updated_question.replace('<ts><ts/>', seq_str, 1)  # 每次替换1个
+    else:
+        # 格式错误（非列表或内层有非列表元素）
+        print("数据格式错误：请提供列表嵌套列表的格式，如[[数据1], [数据2]]")
+        return None
+
+    # 根据任务类型选择模板
+    if task == "Anomaly detection":
+        return updated_question + template_Anomaly_detection
+    elif task == "Inferential calculation":
+        return updated_question + template_Inferential_calculation
+    elif task == "Scenario attribution":
+        return updated_question + template_Scenario_attribution
+    print(f"未知任务类型: {task}")
+    return None
+
+
+def insert_cot_field(data, cot_response):
+    """在label和timeseries之间添加cot_deepseekr1字段，保持原有字段顺序"""
+    if isinstance(data, LazyRecord):
+        # 惰性记录原位插入，timeseries等字段写出时原样拷贝
+        if 'label' in data:
+            data.insert_after('label', 'cot_deepseekr1', cot_response)
+        return data
+    new_data = {}
+    for key, value in data.items():
+        new_data[key] = value
+        if key == 'label':
+            new_data['cot_deepseekr1'] = cot_response
+    return new_data
+
+
+def cot_record(data):
+    """单条样本：构造prompt并请求DeepSeek，返回添加cot_deepseekr1字段后的记录；prompt不符合要求或请求失败时返回None"""
+    prompt = build_prompt(data)
+    if prompt is None:
+        return None
+    set_task(data.get('task', ''))
+    cot_response = gpt_chat(prompt)
+    if cot_response is None:
+        return None
+    return attach_usage(insert_cot_field(data, cot_response), "cot_deepseekr1")
+
+
+def process_jsonl_file(input_file, output_file, resume=False):
+    # resume=True时跳过日志中已完成的样本，在原输出文件后继续追加
+    ckpt = Checkpoint(output_file, resume=resume)
+    with ckpt, open(input_file, 'r', encoding='utf-8') as infile, \
+         open(output_file, 'a' if resume else 'w', encoding='utf-8') as outfile:
         
         wrong_id = []
+        failed_id = []
         for line in infile:
             data = json.loads(line.strip())
-            
-            # 提取所需字段
-            task = data.get('task', '')
-            question = data.get('question', '')
-            timeseries2 = data.get('timeseries', [])
             id = data.get('id', '未知')
+            task = data.get('task', '')
+            if ckpt.is_done(id):
+                continue
 
-            if isinstance(timeseries2, list) and all(isinstance(seq, list) for seq in timeseries2):
-                # 统计变量数量和标签数量
-                var_count = len(timeseries2)
-                ts_count = question.count('<ts><ts/>')
-
-                # 检查数量匹配
-                if var_count == 0:
-                    print("错误：时间序列为空列表")
-                    wrong_id.append(id)
-                    continue
-                elif ts_count != var_count:
-                    print(f"警告：变量数量({var_count})与<ts><ts/>标签数量({ts_count})不匹配")
-                    wrong_id.append(id)
-                    continue
-                else:
-                    updated_question = question  # 数量匹配，正常替换
-
-                # 按顺序替换每个标签（无论数量是否匹配，都尝试替换已有的变量）
-                for seq in timeseries2:
-                    seq_str = ', '.join(map(str, seq))
-                    updated_question = updated_question.replace('<ts><ts/>', seq_str, 1)  # 每次替换1个
-            else:
-                # 格式错误（非列表或内层有非列表元素）
-                updated_question = question.replace('<ts><ts/>', "时间序列格式不符合要求（需为[[...], [...]]形式）")
-                print("数据格式错误：请提供列表嵌套列表的格式，如[[数据1], [数据2]]")
+            prompt = build_prompt(data)
+            if prompt is None:
                 wrong_id.append(id)
                 continue
 
-
-            # 根据任务类型选择模板
-            if task == "Anomaly detection":
-                prompt = updated_question + template_Anomaly_detection
-            elif task == "Inferential calculation":
-                prompt = updated_question + template_Inferential_calculation
-            elif task == "Scenario attribution":
-                prompt = updated_question + template_Scenario_attribution
-
             print(f"处理ID {id}，任务: {task}")
+            set_task(task)
             cot_response = gpt_chat(prompt)
+            if cot_response is None:
+                # 请求失败的样本不写出、不记入日志，--resume时重新请求
+                failed_id.append(id)
+                continue
             
-            # 在label和timeseries之间添加cot_deepseekr1字段
-            # 创建一个新字典，保持原有字段顺序
-            new_data = {}
-            for key, value in data.items():
-                new_data[key] = value
-                if key == 'label':
-                    new_data['cot_deepseekr1'] = cot_response
-            
-            json.dump(new_data, outfile)
+            json.dump(attach_usage(insert_cot_field(data, cot_response), "cot_deepseekr1"), outfile)
             outfile.write('\n')
+            ckpt.mark_done(id, [outfile])
         
         print(f'处理失败的样本ID: {wrong_id}')
-            
+        print(f'请求失败的样本ID（可用--resume重试）: {failed_id}')
+
+
+# 异步大模型请求函数：与gpt_chat逻辑一致，供并发模式使用
+async def async_gpt_chat(aclient, content, max_retries=3):
+    return await llm_utils.async_gpt_chat(aclient, gpt_model, content, max_retries)
+
+
+async def _process_jsonl_file_async(input_file, output_file, max_concurrency, reorder_window, resume):
+    # 所有协程共享同一个带连接池的客户端，连接数与并发数一致
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        timeout=httpx.Timeout(600.0, connect=10.0),
+    )
+    aclient = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=BASE_URL, http_client=http_client)
+
+    inflight = asyncio.Semaphore(max_concurrency)   # 同时在途的请求数
+    window = asyncio.Semaphore(reorder_window)      # 已读入但尚未写出的样本数（限制重排缓冲区大小）
+    reorder_buffer = {}                             # 序号 -> 已完成的样本
+    next_seq = 0
+    wrong_id = []
+    failed_id = []
+
+    ckpt = Checkpoint(output_file, resume=resume)
+    with ckpt, open(input_file, 'r', encoding='utf-8') as infile, \
+         open(output_file, 'a' if resume else 'w', encoding='utf-8') as outfile:
+
+        def flush_ready():
+            # 按输入顺序写出所有已连续完成的样本
+            nonlocal next_seq
+            while next_seq in reorder_buffer:
+                id, new_data = reorder_buffer.pop(next_seq)
+                if new_data is None:
+                    # 请求失败的样本不写出、不记入日志，--resume时重新请求
+                    failed_id.append(id)
+                else:
+                    json.dump(new_data, outfile)
+                    outfile.write('\n')
+                    ckpt.mark_done(id, [outfile])
+                next_seq += 1
+                window.release()
+
+        async def worker(seq, data, prompt):
+            id = data.get('id', '未知')
+            set_task(data.get('task', ''))  # 每个协程有自己的上下文，互不影响
+            try:
+                async with inflight:
+                    cot_response = await async_gpt_chat(aclient, prompt)
+            except Exception as e:
+                print(f"ID {id}: 处理错误 - {e}")
+                cot_response = None
+            # 保证序号连续，失败的样本也占用一个序号
+            new_data = attach_usage(insert_cot_field(data, cot_response), "cot_deepseekr1") if cot_response is not None else None
+            reorder_buffer[seq] = (id, new_data)
+            flush_ready()
+
+        tasks = []
+        seq = 0
+        try:
+            for line in infile:
+                data = json.loads(line.strip())
+                id = data.get('id', '未知')
+                task = data.get('task', '')
+                if ckpt.is_done(id):
+                    continue
+
+                prompt = build_prompt(data)
+                if prompt is None:
+                    wrong_id.append(id)
+                    continue
+
+                await window.acquire()
+                print(f"处理ID {id}，任务: {task}")
+                tasks.append(asyncio.create_task(worker(seq, data, prompt)))
+                seq += 1
+                # 定期清理已完成的任务引用
+                if len(tasks) >= reorder_window * 2:
+                    tasks = [t for t in tasks if not t.done()]
+
+            await asyncio.gather(*tasks)
+        finally:
+            await aclient.close()
+
+    print(f'处理失败的样本ID: {wrong_id}')
+    print(f'请求失败的样本ID（可用--resume重试）: {failed_id}')
+
+
+def process_jsonl_file_async(input_file, output_file, max_concurrency=8, reorder_window=None, resume=False):
+    """
+    并发版本的process_jsonl_file：最多max_concurrency个请求同时在途，
+    结果经重排缓冲区按输入顺序写出，输出格式与同步版本完全一致。
+    reorder_window: 已读入但尚未写出的最大样本数，默认为并发数的4倍
+    resume: 跳过日志中已完成的样本，在原输出文件后继续追加
+    """
+    if reorder_window is None:
+        reorder_window = max_concurrency * 4
+    reorder_window = max(reorder_window, max_concurrency)
+    asyncio.run(_process_jsonl_file_async(input_file, output_file, max_concurrency, reorder_window, resume))
 
 
 if __name__ == "__main__":
     input_filename = "./multivariate_classified_2001_6000 copy 2.jsonl"
     output_filename = "./multivariate_classified_2001_6000_cot.jsonl"
     
-    process_jsonl_file(input_filename, output_filename)
+    # LLM响应缓存：mode="replay"时只读回放缓存，不发起新请求
+    configure_cache("./llm_cache.sqlite", mode="readwrite")
+
+    use_async = True      # 并发模式（推荐）；False为逐条请求的同步模式
+    max_concurrency = 8   # 同时在途的请求数上限（限流器会根据429/延迟自动在1~上限之间调整）
+    configure_limiter(rpm=60, tpm=400000, max_concurrency=max_concurrency)
+    resume = "--resume" in sys.argv  # 断点续跑：python cot_deepseekr1.py --resume
+
+    configure_serializer(**SERIALIZER_CONFIG, report_tokens=True)
+    # 请求遥测：record_usage=True时在每条样本中写入llm_usage字段（耗时、token数、重试次数）
+    configure_telemetry(record_usage=False)
+
+    if use_async:
+        process_jsonl_file_async(input_filename, output_filename, max_concurrency=max_concurrency, resume=resume)
+    else:
+        process_jsonl_file(input_filename, output_filename, resume=resume)
+    print_cache_stats()
+    print_serializer_stats()
+    print_telemetry_stats()
+    # 各模型x任务的耗时分位数、token用量、重试率；.prom文件可放到node_exporter的textfile目录
+    export_telemetry("./llm_telemetry.json", "./llm_telemetry.prom")
@@ -0,0 +1,35 @@
+import math
+
+"""
+值 -> 次数 计数器（collections.Counter）的分位数和直方图，profile_dataset.py、llm_telemetry.py、token_planner.py共用
+计数器的大小只与不同取值的个数有关，大文件/长时间运行时不需要保存每个值
+"""
+
+
+def percentiles(counter, qs=(0.5, 0.9, 0.99), ndigits=1) -> dict:
+    """分位数（最近秩），另给出count/min/max/mean（mean保留ndigits位小数）；计数器为空时返回{}"""
+    total = sum(counter.values())
+    if not total:
+        return {}
+    result = {"count": total, "min": min(counter), "max": max(counter),
+              "mean": round(sum(v * c for v, c in counter.items()) / total, ndigits)}
+    targets = [(q, max(1, math.ceil(q * total))) for q in qs]
+    seen = 0
+    for value in sorted(counter):
+        seen += counter[value]
+        while targets and seen >= targets[0][1]:
+            result[f"p{round(targets[0][0] * 100)}"] = value
+            targets.pop(0)
+    return result
+
+
+def histogram(counter, edges) -> list:
+    """按桶边界edges（左闭右开）分桶，返回非空桶的 [(区间, 次数)]"""
+    counts = [0] * (len(edges) + 1)
+    for value, c in counter.items():
+        i = 0
+        while i < len(edges) and value >= edges[i]:
+            i += 1
+        counts[i] += c
+    labels = [f"<{edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(edges, edges[1:])] + [f">={edges[-1]}"]
+    return [(label, c) for label, c in zip(labels, counts) if c]
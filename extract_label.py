@@ -1,7 +1,12 @@
 import re
 import json
+from functools import lru_cache
 from typing import List, Dict
 from word2number import w2n 
+from jsonl_index import JsonlIndex
+from record_codec import LazyRecord, peek
+from series_store import REF_FIELD, round_floats, NonNumericValueError
+from stage_cache import StageCache, code_hash, DEFAULT_STAGE_CACHE_PATH
 
 
 def extract_anomaly_label(output: str) -> str | None:
@@ -47,93 +52,188 @@ def extract_scenario_label(output: str) -> str | None:
         return output_clean.strip() if output_clean.strip() else None
 
 
+# 覆盖常见计数句式的正则模式，按优先级排列：靠前的模式在输出中任意位置命中即优先采用
+INFER_PATTERNS = [
+    r"I've found that there are (\w+|\d+)",
+    r"I've found that there is (\w+|\d+)",
+    r"I've found that there were (\w+|\d+)",
+    r"I've found that there was (\w+|\d+)",
+    r"I've found (\w+|\d+)",
+    r"I've identified (\w+|\d+)",
+    r"there is (\w+|\d+)",
+    r"there are (?:approximately|about|roughly) (\w+|\d+)",
+    r"there was (\w+|\d+)",
+    r"there were (?:approximately|about|roughly) (\w+|\d+)",
+    r"it was observed that (\w+|\d+)",
+    r"the number of .*? is (\w+|\d+)",
+    r"it took (\w+|\d+)",
+    r"It took (\w+|\d+)",
+    r"(\w+|\d+) \w+(?: \w+)* can be identified",
+
+    # 优先级靠后
+    r"occurred (\w+|\d+)",
+    r"the time series shows (\w+|\d+)",
+    r"(\w+|\d+) times\b",
+    r"(\w+|\d+) day\b",
+    r"(\w+|\d+) days\b",
+    r"(\w+|\d+) minute\b",
+    r"(\w+|\d+) minutes\b",
+    r"(\w+|\d+) hour\b",
+    r"(\w+|\d+) hours\b",
+    r"(\w+|\d+) second\b",
+    r"(\w+|\d+) seconds\b",
+    r"(\w+|\d+) point\b",
+    r"(\w+|\d+) points\b",
+    r"on (\w+|\d+)",
+]
+
+# 区分大小写（如"No"不在表中，按英文数字解析失败后原样返回）
+INFER_SPECIAL_MAP = {
+    "no": "0",
+    "zero": "0",
+    "none": "0",
+    "a": "1",
+    "an": "1",
+    "once": "1",
+    "twice": "2"
+}
+
+
+def _number_word_table() -> Dict[str, str]:
+    """预先计算单个英文数字词的结果（与w2n.word_to_num一致），计数结果绝大多数是单个词"""
+    table = {}
+    for word in w2n.american_number_system:
+        try:
+            table[word] = str(w2n.word_to_num(word))
+        except ValueError:
+            continue
+    return table
+
+
+NUMBER_WORDS = _number_word_table()
+
+
+@lru_cache(maxsize=4096)
+def _word_to_num(num_raw: str) -> str:
+    """表中没有的词（大小写不同、连写等）才调用w2n，结果缓存"""
+    try:
+        return str(w2n.word_to_num(num_raw))  # 转为字符串，保持输出格式统一
+    # 容错：若英文数字格式不规范（如"onehundred"连写），返回原始值
+    except ValueError:
+        return num_raw
+
+
+# 形如 (\w+|\d+) <单位>\b 的模式（times/day/days/...）：不逐个在每个位置尝试\w+，
+# 而是一次扫描所有" <单位>"出现的位置，再向前取紧邻的单词
+_UNIT_PATTERN_RE = re.compile(r"^\(\\w\+\|\\d\+\) (\w+)\\b$")
+# 以(\w+)开头、回溯代价高的模式：先确认必需的字面量出现在输出中再匹配
+INFER_GUARDS = {
+    r"(\w+|\d+) \w+(?: \w+)* can be identified": "can be identified",
+}
+_WORD_CHAR_RE = re.compile(r"\w")
+
+
+def _build_infer_matchers():
+    """按优先级预编译：("unit", 单位) 或 ("regex", (字面量前置检查或None, 模式))"""
+    matchers, units = [], []
+    for pattern in INFER_PATTERNS:
+        unit = _UNIT_PATTERN_RE.match(pattern)
+        if unit:
+            units.append(unit.group(1))
+            matchers.append(("unit", unit.group(1)))
+        else:
+            guard = INFER_GUARDS.get(pattern)
+            matchers.append(("regex", (re.compile(re.escape(guard), re.IGNORECASE) if guard else None,
+                                       re.compile(pattern, re.IGNORECASE))))
+    unit_re = re.compile(" (?:" + "|".join(rf"(?P<{u}>{u})\b" for u in units) + ")", re.IGNORECASE)
+    return matchers, unit_re
+
+
+_INFER_MATCHERS, _UNIT_RE = _build_infer_matchers()
+
+
+def _scan_units(output_clean: str) -> Dict[str, str]:
+    """单位 -> 该单位第一次前接单词出现时的单词，与 re.search(r"(\w+|\d+) <单位>\b") 的结果相同"""
+    found = {}
+    for match in _UNIT_RE.finditer(output_clean):
+        unit, end = match.lastgroup, match.start()
+        if unit in found or end == 0 or not _WORD_CHAR_RE.match(output_clean, end - 1):
+            continue
+        start = end - 1
+        while start > 0 and _WORD_CHAR_RE.match(output_clean, start - 1):
+            start -= 1
+        found[unit] = output_clean[start:end]
+    return found
+
+
+def match_inferential_count(output_clean: str) -> str | None:
+    """按优先级返回第一个命中模式的计数词，结果与逐个模式 re.search(pattern, output, re.IGNORECASE) 相同"""
+    units = None
+    for kind, matcher in _INFER_MATCHERS:
+        if kind == "unit":
+            if units is None:
+                units = _scan_units(output_clean)
+            if matcher in units:
+                return units[matcher]
+            continue
+        guard, regex = matcher
+        if guard is not None and not guard.search(output_clean):
+            continue
+        match = regex.search(output_clean)
+        if match:
+            return match.group(1)
+    return None
+
+
 def extract_inferential_label(output: str) -> str | None:
     """推理计算：提取计数结果（兼容中英文数字）"""
     output_clean = output.strip().replace("\n", " ") if isinstance(output, str) else ""
     if not output_clean:
         return None
-    # 覆盖常见计数句式的正则模式
-    infer_patterns = [
-        r"I've found that there are (\w+|\d+)",
-        r"I've found that there is (\w+|\d+)",
-        r"I've found that there were (\w+|\d+)",
-        r"I've found that there was (\w+|\d+)",
-        r"I've found (\w+|\d+)",
-        r"I've identified (\w+|\d+)",
-        r"there is (\w+|\d+)",
-        r"there are (?:approximately|about|roughly) (\w+|\d+)",
-        r"there was (\w+|\d+)",
-        r"there were (?:approximately|about|roughly) (\w+|\d+)",
-        r"it was observed that (\w+|\d+)",
-        r"the number of .*? is (\w+|\d+)",
-        r"it took (\w+|\d+)",
-        r"It took (\w+|\d+)",
-        r"(\w+|\d+) \w+(?: \w+)* can be identified"
-        
-        # 优先级靠后
-        r"occurred (\w+|\d+)"
-        r"the time series shows (\w+|\d+)",
-        r"(\w+|\d+) times\b",
-        r"(\w+|\d+) day\b",
-        r"(\w+|\d+) days\b",
-        r"(\w+|\d+) minute\b",
-        r"(\w+|\d+) minutes\b",
-        r"(\w+|\d+) hour\b",
-        r"(\w+|\d+) hours\b",
-        r"(\w+|\d+) second\b",
-        r"(\w+|\d+) seconds\b",
-        r"(\w+|\d+) point\b",
-        r"(\w+|\d+) points\b",
-        r"on (\w+|\d+)", 
-
-    ]
-
-    special_map = {
-        "no": "0",
-        "zero": "0",
-        "none": "0",
-        "a": "1",
-        "an": "1",
-        "once": "1",
-        "twice": "2"
-    }
-    # 遍历匹配
-    for pattern in infer_patterns:
-        match = re.search(pattern, output_clean, re.IGNORECASE)
-        if match:
-            num_raw = match.group(1).strip()
-            
-            # 数字直接返回
-            if num_raw.isdigit():
-                return num_raw
-            
-            if num_raw in special_map:
-                return special_map[num_raw]
-
-            try:                
-                num_digit = w2n.word_to_num(num_raw)
-                return str(num_digit)  # 转为字符串，保持输出格式统一
-            # 容错：若英文数字格式不规范（如"onehundred"连写），返回原始值
-            except ValueError:
-                return num_raw
-            
-    return None
 
-# 自定义异常：用于标识timeseries中的非数值类型错误
-class NonNumericValueError(Exception):
-    pass
+    num_raw = match_inferential_count(output_clean)
+    if num_raw is None:
+        return None
+    num_raw = num_raw.strip()
+
+    # 数字直接返回
+    if num_raw.isdigit():
+        return num_raw
+    if num_raw in INFER_SPECIAL_MAP:
+        return INFER_SPECIAL_MAP[num_raw]
+    if num_raw in NUMBER_WORDS:
+        return NUMBER_WORDS[num_raw]
+    return _word_to_num(num_raw)
+
 # 提取标签为空的异常
 class EmptyLabelError(Exception):
     pass
 
+def _round_series(seq):
+    """单条序列（一维列表）保留4位小数，纯数值时一次向量化完成；含列表或非数值元素时返回None"""
+    types = set(map(type, seq))
+    if types <= {float}:
+        return round_floats(seq)
+    if types <= {int}:
+        return list(seq)  # round(int, 4) 仍为原整数
+    if types <= {int, float, bool}:
+        # 整数与浮点混合：非浮点元素按内置round处理（保持int类型，bool转为int）
+        rounded = round_floats(seq)
+        return [r if type(v) is float else round(v, 4) for v, r in zip(seq, rounded)]
+    return None
+
+
 def round_timeseries_values(timeseries):
-    """递归处理timeseries列表，将所有数值保留4位小数"""
+    """处理timeseries列表（可为多层嵌套、各变量不等长），将所有数值保留4位小数"""
+    processed = _round_series(timeseries)
+    if processed is not None:
+        return processed
     processed = []
     for item in timeseries:
         if isinstance(item, list):
-            processed.append(round_timeseries_values(item))  # 递归处理嵌套列表
+            processed.append(round_timeseries_values(item))  # 递归处理嵌套列表（如多变量）
         elif isinstance(item, (int, float)):
-            processed.append(round(item, 4))  # 保留4位小数
+            processed.append(round(item, 4))
         else:
             # 非数值类型主动报错
             raise NonNumericValueError(
@@ -141,22 +241,92 @@ def round_timeseries_values(timeseries):
             )
     return processed
 
-def process_jsonl_label(input_file: str, output_file: str, start_idx: int, end_idx: int) -> None:
-    # 任务类型到提取函数的映射
-    task_to_extractor = {
-        "Anomaly detection": extract_anomaly_label,
-        "Scenario attribution": extract_scenario_label,
-        "Inferential calculation": extract_inferential_label
-    }
+# 任务类型到提取函数的映射
+task_to_extractor = {
+    "Anomaly detection": extract_anomaly_label,
+    "Scenario attribution": extract_scenario_label,
+    "Inferential calculation": extract_inferential_label
+}
+
+
+def extract_record_label(data) -> bool:
+    """单条样本：按任务类型提取label写入data，返回是否需要人工核查（标签为空或计算推理任务标签非数字）"""
+    id = data["id"]
+    task = data["task"].strip()
+    output = data["output"]
+    
+    # 调用对应的提取函数 
+    extractor = task_to_extractor[task]
+    label = extractor(output)
+    suspicious = False
+    if label == None:
+        print(f"ID {id}: 任务 '{task}' 提取到空字符串标签")
+        suspicious = True
+    if task == "Inferential calculation" and not str(label).isdigit():
+        print(f"ID {id}: 任务 {task}，提取标签为非数字: {data['label']}")
+        suspicious = True
     
+    data["label"] = label if label is not None else ""
+    return suspicious
+
+
+def add_timeseries2(data) -> None:
+    """生成timeseries2：timeseries每个数值只保留4位小数
+    时序已外置到列式存储（timeseries_ref）时不再重复存储，读取时按需保留4位小数"""
+    if REF_FIELD not in data:
+        data["timeseries2"] = round_timeseries_values(peek(data, "timeseries"))
+
+
+def _label_and_round(data) -> bool:
+    """label_record中可由阶段缓存复用的部分：生成timeseries2并提取label"""
+    add_timeseries2(data)
+    return extract_record_label(data)
+
+
+def label_record(data, cache=None) -> bool | None:
+    """
+    单条样本：提取label并生成timeseries2（原地修改data，dict或LazyRecord均可）
+    返回是否需要人工核查；未知任务类型返回None，该样本不写出
+    cache: label_stage_cache()（data须为LazyRecord）；先查缓存，task/output/timeseries及该任务的提取规则均未变化的样本
+        直接写回上次的timeseries2和label，不再解码和舍入时序
+    """
+    task = data["task"].strip()
+    if task not in task_to_extractor:
+        print(f"ID {data['id']}: 未知任务类型 {task}，跳过")
+        return None
+    if cache is not None:
+        return cache.apply(data, _label_and_round)
+    return _label_and_round(data)
+
+
+# 各任务提取label实际用到的函数和规则表：只改某个任务的规则时，只有该任务的样本重算
+TASK_RULES = {
+    "Anomaly detection": (extract_anomaly_label,),
+    "Scenario attribution": (extract_scenario_label,),
+    "Inferential calculation": (extract_inferential_label, match_inferential_count, _scan_units,
+                                _build_infer_matchers, _word_to_num, INFER_PATTERNS, INFER_GUARDS,
+                                _UNIT_PATTERN_RE, INFER_SPECIAL_MAP, NUMBER_WORDS),
+}
+# 所有任务共用：label写入与核查判定、timeseries2的生成
+COMMON_RULES = (extract_record_label, _label_and_round, add_timeseries2, round_timeseries_values, _round_series, round_floats)
+
+
+def label_stage_cache(path=DEFAULT_STAGE_CACHE_PATH, config_version="1") -> StageCache:
+    """label提取的阶段缓存：代码版本按任务类型分别计算（该任务的提取函数/规则表 + 共用函数）"""
+    versions = {task: code_hash(*COMMON_RULES, *rules) for task, rules in TASK_RULES.items()}
+    return StageCache("extract_label", ["task", "output", "timeseries", REF_FIELD], ["timeseries2", "label"],
+                      lambda data: versions.get(data["task"].strip(), ""), config_version, path=path)
+
+
+def process_jsonl_label(input_file: str, output_file: str, start_idx: int, end_idx: int,
+                        stage_cache_path=None) -> None:
+    """stage_cache_path不为None时启用阶段缓存，修改提取规则后重跑只重算受影响的样本"""
+    cache = label_stage_cache(stage_cache_path) if stage_cache_path else None
     wrong_id = [] # 记录处理失败的ID，人工核查重点
     with open(output_file, 'a', encoding="utf-8") as f_out:
-        with open(input_file, 'r', encoding="utf-8") as f_in:
-            for idx, line in enumerate(f_in):
-                if idx < start_idx:
-                    continue
-                if idx > end_idx:
-                    break
+        # 借助行偏移索引直接定位到start_idx，无需从头逐行跳过
+        with JsonlIndex(input_file) as index:
+            for idx, line in index.iter_range(start_idx, end_idx):
                 
                 # 过滤空行
                 line = line.strip()
@@ -164,33 +334,20 @@ def process_jsonl_label(input_file: str, output_file: str, start_idx: int, end_i
                     continue
                 
                 try:
-                    data = json.loads(line.strip())
+                    # 惰性解码：未改动的字段写出时原样拷贝
+                    data = LazyRecord(line.strip())
                     
                     id = data["id"]
                     task = data["task"].strip()
-                    output = data["output"]
-                    timeseries = data["timeseries"]
                     
-                    if task not in task_to_extractor:
-                        print(f"ID {id}: 未知任务类型 {task}，跳过")
+                    suspicious = label_record(data, cache)
+                    if suspicious is None:
                         continue
-                    
-                    # 调用对应的提取函数 
-                    extractor = task_to_extractor[task]
-                    label = extractor(output)
-                    if label == None:
-                        print(f"ID {id}: 任务 '{task}' 提取到空字符串标签")
-                        wrong_id.append(id)
-                    if task == "Inferential calculation" and not str(label).isdigit():
-                        print(f"ID {id}: 任务 {task}，提取标签为非数字: {data['label']}")
+                    if suspicious:
                         wrong_id.append(id)
                     
-                    # 处理timeseries，每个数值只保留4位小数
-                    data["timeseries2"] = round_timeseries_values(timeseries)
-                    
-                    data["label"] = label if label is not None else ""
                     # 写入输出文件
-                    f_out.write(json.dumps(data, ensure_ascii=False) + '\n')
+                    f_out.write(data.dumps(ensure_ascii=False) + '\n')
                     print(f"ID {id}: 任务 {task}，提取标签: {data['label']}")
                 
                 except json.JSONDecodeError as e:
@@ -202,6 +359,9 @@ def process_jsonl_label(input_file: str, output_file: str, start_idx: int, end_i
                 
             print(f"失败 {len(wrong_id)} 条. 失败样本ID: {wrong_id}")
             print("已将timeseries中的数值最多保留4位小数，保留在timeseries2字段中")
+    if cache is not None:
+        cache.print_stats()
+        cache.close()
     
 
 
@@ -216,6 +376,6 @@ if __name__ == "__main__":
     # 清空输出文件
     open(output_path, 'w').close()
 
-    # 执行批量处理
-    process_jsonl_label(input_path,output_path,start_index,end_index)
+    # 执行批量处理；阶段缓存：只重算task/output或提取规则有变化的样本
+    process_jsonl_label(input_path,output_path,start_index,end_index, stage_cache_path="./stage_cache.sqlite")
     print(f"处理完成. 结果已保存到 {output_path}")
\ No newline at end of file
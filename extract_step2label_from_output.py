@@ -1,7 +1,11 @@
+import sys
 import json
 import re
-import time
 from openai import OpenAI
+import llm_utils
+from llm_cache import configure_cache, print_cache_stats
+from llm_telemetry import set_task, attach_usage, export_telemetry, print_telemetry_stats
+from checkpoint import Checkpoint
 
 # 配置OpenAI客户端
 gpt_model = "gpt-4o-mini"
@@ -10,22 +14,7 @@ client = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.chatanywhere.tech/
 
 # 大模型请求函数
 def gpt_chat(content, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            response = client.chat.completions.create(
-                model=gpt_model,
-                temperature=0.2,
-                messages=[{"role": "user", "content": content}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
-            retry_count += 1
-            if retry_count < max_retries:
-                time.sleep(5)
-    print("已达到最大重试次数，请求失败。")
-    return None
+    return llm_utils.gpt_chat(client, gpt_model, content, max_retries)
 
 prompt_template = """
 Please complete the task based on the following instructions:
@@ -40,36 +29,64 @@ Output Format:
 <Only list the complete key pattern names after supplementation (including the patterns in the original and the newly added patterns), no extra details, analysis or conclusions; separate multiple items with semicolons>.
 """
 
-def process_jsonl_file(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-         open(output_file, 'w', encoding='utf-8') as outfile:
+def step2_record(data):
+    """单条样本：根据output补充step2_label（原地修改data），返回模型输出；请求失败时不修改data，返回None"""
+    output = data.get('output', 'unknown')
+    original_label = data.get('step2_label', 'unknown')
+    prompt = prompt_template.format(output=output, step2_label=original_label)
+    set_task(data.get('task', ''))
+    updated_label = gpt_chat(prompt)
+    if not updated_label:
+        return None  # 请求失败时不修改记录
+    data['step2_label'] = updated_label
+    attach_usage(data, "step2_label")
+    return updated_label
+
+
+def process_jsonl_file(input_file, output_file, resume=False):
+    # resume=True时跳过日志中已完成的样本，在原输出文件后继续追加
+    ckpt = Checkpoint(output_file, resume=resume)
+    with ckpt, open(input_file, 'r', encoding='utf-8') as infile, \
+         open(output_file, 'a' if resume else 'w', encoding='utf-8') as outfile:
         
+        failed_id = []
         for line in infile:
             data = json.loads(line.strip())
             
             # 提取所需字段
-            output = data.get('output', 'unknown')
             id = data.get('id', '未知')
             original_label = data.get('step2_label', 'unknown')
+            if ckpt.is_done(id):
+                continue
            
-            prompt = prompt_template.format(output=output, step2_label=original_label)
-            updated_label = gpt_chat(prompt)
-            
-            data['step2_label'] = updated_label if updated_label else "unknown"
+            updated_label = step2_record(data)
+            if updated_label is None:
+                # 请求失败的样本不写出、不记入日志，--resume时重新请求
+                failed_id.append(id)
+                continue
 
             # 写入输出文件
             outfile.write(json.dumps(data) + '\n')
+            ckpt.mark_done(id, [outfile])
             print(f"ID {id}: step2_label 处理完成")
             print(f"BEFORE: {original_label}")
             print(f"AFTER : {updated_label}\n")
-            
-            time.sleep(1)
+
+        print(f'请求失败的样本ID（可用--resume重试）: {failed_id}')
 
 
 if __name__ == "__main__":
     input_filename = "./univariate_0_2000_filtered_labeled_cot_stepLabeled_correct.jsonl"
     output_filename = "./univariate_0_2000_filtered_labeled_cot_stepLabeled_correct_step2label.jsonl"
     
-    open(output_filename, 'w').close()
+    # LLM响应缓存：mode="replay"时只读回放缓存，不发起新请求
+    configure_cache("./llm_cache.sqlite", mode="readwrite")
+
+    resume = "--resume" in sys.argv  # 断点续跑：python extract_step2label_from_output.py --resume
+    if not resume:
+        open(output_filename, 'w').close()
     
-    process_jsonl_file(input_filename, output_filename)
+    process_jsonl_file(input_filename, output_filename, resume=resume)
+    print_cache_stats()
+    print_telemetry_stats()
+    export_telemetry("./llm_telemetry_step2label.json", "./llm_telemetry_step2label.prom")
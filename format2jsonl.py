@@ -1,31 +1,198 @@
-import json
 import re
+import sys
+import json
+from record_codec import LazyRecord, RawValue, dumps_fields
 
-def fix_jsonl_format(input_path, output_path):
-    # 读取原始文件内容
-    with open(input_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # 用正则表达式匹配每个独立的 JSON 对象（以 { 开头，} 结尾）
-    # 注意：确保你的 JSON 中没有嵌套的 {} 导致匹配错误（你的数据中未出现这种情况）
-    json_objects = re.findall(r'\{[\s\S]*?\}', content)
-    
-    wrong_id = []  # 记录无效 JSON 的 ID
-    # 写入修复后的 JSONL 文件（每行一个 JSON 对象）
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for obj_str in json_objects:
+"""
+人工核查文件（格式化的多行JSON）与JSONL之间的转换
+- fix_jsonl_format: 流式读取格式化文件，用JSONDecoder.raw_decode逐个解析对象后压缩为一行；
+  支持嵌套对象和字符串中的花括号，以及整个文件是（缩进的）JSON数组；内存占用只与单个对象大小有关；
+  无效对象报告其字节偏移、行号和id
+- pretty_print_jsonl: 反方向，每个字段一行便于人工核查；timeseries等数组保持原始JSON文本在同一行，不解码
+"""
+
+READ_SIZE = 1 << 20
+MAX_OBJECT_CHARS = 1 << 28  # 单个对象超过该长度仍未闭合时视为无效（如引号缺失导致后续内容都被当成字符串）
+_WS_RE = re.compile(r"[\s,\[\]]*")  # 对象之间的空白、逗号，以及整个文件是JSON数组时的方括号
+_STRUCT_RE = re.compile(r'["{}\[\]]')
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_ID_RE = re.compile(r'"id"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+# 无效对象之后在下一个顶层对象开头重新同步：格式化文件中顶层对象从行首的"{"开始；
+# JSON数组文件中顶层对象缩进相同，按第一个对象的缩进匹配（嵌套对象缩进更深，不会误匹配）
+_BOUNDARY = "\n{"
+
+
+def _object_end(buf, pos):
+    """从pos处的"{"开始按括号深度（跳过字符串）找到对象结束位置；缓冲区内容不完整时返回None"""
+    depth = 0
+    while True:
+        match = _STRUCT_RE.search(buf, pos)
+        if not match:
+            return None
+        if match.group() == '"':
+            string_match = _STRING_RE.match(buf, match.start())
+            if not string_match:
+                return None
+            pos = string_match.end()
+            continue
+        pos = match.end()
+        depth += 1 if match.group() in "{[" else -1
+        if depth == 0:
+            return pos
+
+
+def _guess_id(text):
+    match = _ID_RE.search(text)
+    if not match:
+        return "unknown_id"
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return match.group(1)
+
+
+def iter_json_objects(f, read_size=READ_SIZE):
+    """
+    f: 以newline=""打开的文本文件（不转换换行符，保证字节偏移准确）
+    依次产出 (字节偏移, 行号, 对象, None, 对象原文)；无效对象产出 (字节偏移, 行号, id, 错误信息, 原文)
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    mark, mark_byte, mark_line = 0, 0, 1  # buf[mark]对应的字节偏移和行号
+    boundary_marker = None  # 由第一个对象的缩进确定
+
+    def fill(min_len):
+        nonlocal buf, eof
+        while not eof and len(buf) < min_len:
+            chunk = f.read(max(read_size, min_len - len(buf)))
+            if not chunk:
+                eof = True
+            buf += chunk
+
+    def locate(index):
+        nonlocal mark, mark_byte, mark_line
+        mark_byte += len(buf[mark:index].encode("utf-8"))
+        mark_line += buf.count("\n", mark, index)
+        mark = index
+        return mark_byte, mark_line
+
+    def find_boundary(start, limit):
+        """下一个顶层对象开头"{"的位置，只在buf[start:limit]中查找；找不到返回None"""
+        boundary = buf.find(boundary_marker or _BOUNDARY, start, limit)
+        return boundary + len(boundary_marker or _BOUNDARY) - 1 if boundary >= 0 else None
+
+    while True:
+        # 已处理的内容累计超过一次读取量时才丢弃，避免每个对象都复制整个缓冲区
+        if mark >= read_size:
+            buf, pos, mark = buf[mark:], pos - mark, 0
+        pos = _WS_RE.match(buf, pos).end()
+        while pos >= len(buf) and not eof:
+            fill(len(buf) + read_size)
+            pos = _WS_RE.match(buf, pos).end()
+        if pos >= len(buf):
+            return
+        byte_offset, line = locate(pos)
+
+        if buf[pos] != "{":
+            # 对象之间的无效内容：最多向后读一次读取量找下一个对象开头，找不到时先跳过这一段，缓冲区不随之增长
+            fill(pos + read_size)
+            resync = find_boundary(pos + 1, pos + read_size)
+            if resync is None:
+                resync = min(len(buf), pos + read_size)
+            yield byte_offset, line, _guess_id(buf[pos:resync]), f"不是JSON对象: {buf[pos:pos + 20]!r}", buf[pos:resync]
+            pos = resync
+            continue
+
+        if boundary_marker is None:
+            indent = buf[buf.rfind("\n", 0, pos) + 1:pos]
+            boundary_marker = "\n" + indent + "{" if not indent.strip() else _BOUNDARY
+
+        while True:
             try:
-                # 解析 JSON 确保格式正确，再压缩为一行
-                obj = json.loads(obj_str)
-                id = obj.get("id", "unknown_id")
-                f.write(json.dumps(obj, ensure_ascii=False) + '\n')
+                obj, end = decoder.raw_decode(buf, pos)
             except json.JSONDecodeError as e:
-                print(f"ID {id} 跳过无效 JSON: {e}")
-                wrong_id.append(id)
-    
-    print(f"修复完成，已保存至 {output_path}")
+                error = e
+            else:
+                yield byte_offset, line, obj, None, buf[pos:end]
+                pos = end
+                break
+            # 缓冲区中的对象还不完整：继续读入后重试（缓冲区只需容纳当前对象，与文件大小无关）
+            end = _object_end(buf, pos)
+            if end is None and not eof and len(buf) - pos < MAX_OBJECT_CHARS:
+                fill(len(buf) + max(read_size, len(buf) - pos))
+                continue
+            # 无效对象：跳到对象结尾；引号缺失等导致括号配对越过了下一个对象开头时，在该处重新同步
+            resync = find_boundary(pos + 1, len(buf) if end is None else end)
+            end = resync if resync is not None else (len(buf) if end is None else end)
+            yield byte_offset, line, _guess_id(buf[pos:end]), f"{error.msg} (对象内第{error.pos - pos}个字符)", buf[pos:end]
+            pos = end
+            break
+
+
+def compact_object(text):
+    """
+    把一个已校验的格式化JSON对象压缩为一行（字段分隔与json.dumps相同）
+    本身只占一行的数组/数值直接沿用原文，不重新序列化；跨行的值和字符串按json.dumps(ensure_ascii=False)重新编码
+    """
+    data = LazyRecord(text)
+    pairs = []
+    for key in data.keys():
+        raw = data.raw(key)
+        if raw.startswith('"') or "\n" in raw:
+            raw = json.dumps(data[key], ensure_ascii=False)
+        pairs.append((key, RawValue(raw)))
+    return dumps_fields(pairs, ensure_ascii=False)
+
+
+def fix_jsonl_format(input_path, output_path):
+    """格式化的多行JSON文件 -> JSONL（每行一个对象），返回无效对象的id列表"""
+    wrong_id = []  # 记录无效 JSON 的 ID
+    count = 0
+    with open(input_path, 'r', encoding='utf-8', newline='') as f_in, \
+         open(output_path, 'w', encoding='utf-8') as f_out:
+        for byte_offset, line, obj, error, text in iter_json_objects(f_in):
+            if error is None:
+                f_out.write(compact_object(text) + '\n')
+                count += 1
+            else:
+                print(f"ID {obj} 跳过无效 JSON（字节偏移 {byte_offset}，第{line}行）: {error}")
+                wrong_id.append(obj)
+
+    print(f"修复完成，共 {count} 条，已保存至 {output_path}")
     print(f"跳过无效 JSON 的 ID 列表: {wrong_id}")
+    return wrong_id
+
+
+def pretty_record(data, indent=2) -> str:
+    """LazyRecord -> 人工核查格式：每个字段一行，字符串解码为可读文本，数组/数值保持原始JSON文本"""
+    pad = " " * indent
+    fields = []
+    for key in data.keys():
+        raw = data.raw(key)
+        value = json.dumps(data[key], ensure_ascii=False) if raw.startswith('"') else raw
+        fields.append(f"{pad}{json.dumps(key, ensure_ascii=False)}: {value}")
+    return "{\n" + ",\n".join(fields) + "\n}\n"
+
+
+def pretty_print_jsonl(input_path, output_path, indent=2):
+    """JSONL -> 人工核查用的格式化文件"""
+    count = 0
+    with open(input_path, 'r', encoding='utf-8') as f_in, open(output_path, 'w', encoding='utf-8') as f_out:
+        for line in f_in:
+            line = line.strip()
+            if not line:
+                continue
+            f_out.write(pretty_record(LazyRecord(line), indent))
+            count += 1
+    print(f"已格式化 {count} 条，保存至 {output_path}")
+
 
 # 使用示例
 if __name__ == "__main__":
-    fix_jsonl_format("univariate_0_2000_filtered_labeled_cot_stepLabeled_correct2 copy.jsonl", "univariate_0_2000_filtered_labeled_cot_stepLabeled_correct2 copy testtt.jsonl")  # 替换为你的输入输出路径
\ No newline at end of file
+    # python format2jsonl.py --pretty 输入.jsonl 输出.json：生成人工核查文件；默认把核查后的文件修复为JSONL
+    if len(sys.argv) == 4 and sys.argv[1] == "--pretty":
+        pretty_print_jsonl(sys.argv[2], sys.argv[3])
+    else:
+        fix_jsonl_format("univariate_0_2000_filtered_labeled_cot_stepLabeled_correct2 copy.jsonl", "univariate_0_2000_filtered_labeled_cot_stepLabeled_correct2 copy testtt.jsonl")  # 替换为你的输入输出路径
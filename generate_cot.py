@@ -2,6 +2,7 @@ import re
 import json
 from typing import List, Dict
 from word2number import w2n 
+from record_codec import LazyRecord, insert_after
 
 '''
 人工核查完stepx label是否为空+正确性后，再组成我们的cot，避免反复修改
@@ -21,6 +22,17 @@ def generate_cot_field(cot_content: str, step6_label: str | None) -> str:
     return f"<think>{cot_clean}</think><ANSWER>{answer_part}</ANSWER>"
 
 
+def add_cot_field(data) -> str:
+    """单条样本：由cot_deepseekr1和step6_label组成cot字段插入到label之后（原地修改data，dict或LazyRecord均可），返回使用的step6_label"""
+    step6_label = data.get("step6_label") or "unknown"
+    cot_field = generate_cot_field(data["cot_deepseekr1"], step6_label)
+
+    # 保持字段顺序，在label后插入新字段
+    if "label" in data:
+        insert_after(data, "label", 'cot', cot_field)
+    return step6_label
+
+
 def process_jsonl(input_file: str, output_file: str) -> None:
     error_count = 0
     error_id = []
@@ -34,7 +46,8 @@ def process_jsonl(input_file: str, output_file: str) -> None:
                     continue
 
                 try:
-                    data = json.loads(line)
+                    # 惰性解码：timeseries等大字段不解析，写出时原样拷贝
+                    data = LazyRecord(line)
                     # 必要字段校验
                     required_fields = ["id", "cot_deepseekr1", "step6_label"]
                     for field in required_fields:
@@ -42,19 +55,9 @@ def process_jsonl(input_file: str, output_file: str) -> None:
                             raise KeyError(f"缺失必要字段: {field}")
                         
                     id = data["id"]
-                    step6_label = data.get("step6_label") or "unknown"
-                    cot_deepseekr1 = data["cot_deepseekr1"]
-                    
-                    cot_field = generate_cot_field(cot_deepseekr1, step6_label)
-
-                    # 创建新字典并保持字段顺序，在label后插入新字段
-                    new_data = {}
-                    for key, value in data.items():
-                        new_data[key] = value
-                        if key == "label":
-                            new_data['cot'] = cot_field
+                    step6_label = add_cot_field(data)
                             
-                    json.dump(new_data, f_out, ensure_ascii=False, indent=None)
+                    f_out.write(data.dumps(ensure_ascii=False))
                     f_out.write('\n')
 
                     print(f" ID {id} : 处理成功  step6_label: {step6_label}")
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import mmap
+from array import array
+
+"""
+JSONL文件的行偏移索引（sidecar文件：<文件名>.idx）
+- 首次使用时扫描一遍文件，记录每行起始字节偏移和每行的id字段，之后直接读取索引
+- 索引记录了原文件的大小和修改时间，文件变化后自动重建
+- 读取时用mmap按偏移直接切片，start_idx很大时也无需从头逐行跳过
+"""
+
+INDEX_VERSION = 1
+CHUNK_SIZE = 16 * 1024 * 1024
+# id为第一个字段时的快速匹配（本仓库各阶段输出的id都在第一个字段）
+_LEADING_ID_RE = re.compile(rb'\s*\{\s*"id"\s*:\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+
+
+def _extract_id(line: bytes):
+    match = _LEADING_ID_RE.match(line)
+    if match:
+        return json.loads(match.group(1))
+    if b'"id"' not in line:
+        return None
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return data.get("id") if isinstance(data, dict) else None
+
+
+class JsonlIndex:
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.offsets = array('Q')  # 第i行的起始偏移，末尾多存一个文件大小
+        self.ids = []
+        self._id_to_line = None
+        if not self._load():
+            self.build()
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b""
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def _load(self) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        size, mtime_ns = self._stat()
+        with open(self.index_path, 'rb') as f:
+            try:
+                header = json.loads(f.readline())
+            except json.JSONDecodeError:
+                return False
+            if header.get("version") != INDEX_VERSION or header.get("size") != size \
+                    or header.get("mtime_ns") != mtime_ns:
+                return False
+            offsets = array('Q')
+            offsets.frombytes(f.read((header["lines"] + 1) * offsets.itemsize))
+            self.offsets = offsets
+            self.ids = json.loads(f.read(header["ids_bytes"]))
+        return True
+
+    def build(self) -> None:
+        """扫描文件建立索引，并原子地写入sidecar文件"""
+        size, mtime_ns = self._stat()
+        offsets = array('Q')
+        ids = []
+        pos = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                offsets.append(pos)
+                ids.append(_extract_id(line))
+                pos += len(line)
+        offsets.append(pos)
+        self.offsets = offsets
+        self.ids = ids
+        self._id_to_line = None
+
+        ids_bytes = json.dumps(ids, ensure_ascii=False).encode('utf-8')
+        header = {"version": INDEX_VERSION, "size": size, "mtime_ns": mtime_ns,
+                  "lines": len(offsets) - 1, "ids_bytes": len(ids_bytes)}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(offsets.tobytes())
+            f.write(ids_bytes)
+        os.replace(tmp_path, self.index_path)
+        print(f"已建立行索引 {self.index_path}（{len(offsets) - 1} 行）")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read_line(self, idx: int) -> bytes:
+        return self._mm[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def iter_range(self, start_idx: int, end_idx: int):
+        """按行号读取[start_idx, end_idx]（包含两端）范围内的行，返回 (行号, str)"""
+        start_idx = max(start_idx, 0)
+        end_idx = min(end_idx, len(self) - 1)
+        for idx in range(start_idx, end_idx + 1):
+            yield idx, self.read_line(idx).decode('utf-8')
+
+    def line_of_id(self, id):
+        if self._id_to_line is None:
+            self._id_to_line = {}
+            for idx, value in enumerate(self.ids):
+                if value is not None:
+                    self._id_to_line.setdefault(value, idx)
+        return self._id_to_line.get(id)
+
+    def iter_ids(self, ids):
+        """按给定的id集合读取对应行（按文件中的顺序），返回 (行号, str)；不存在的id忽略"""
+        line_idxs = sorted(idx for idx in (self.line_of_id(i) for i in ids) if idx is not None)
+        for idx in line_idxs:
+            yield idx, self.read_line(idx).decode('utf-8')
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_jsonl_range(path, start_idx, end_idx):
+    """等价于 enumerate(open(path)) 后按 start_idx <= 行号 <= end_idx 过滤，但借助索引直接定位"""
+    with JsonlIndex(path) as index:
+        yield from index.iter_range(start_idx, end_idx)
@@ -0,0 +1,79 @@
+import os
+
+"""
+按字节范围切分大JSONL文件，供多进程并行处理
+- 切分点对齐到换行符之后，保证每个分片都由完整的行组成
+- 各分片的行数可并行统计，前缀和即为每个分片第一行的全局行号，便于保持id稳定
+"""
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def split_byte_ranges(path, n_shards):
+    """将文件切成最多n_shards个[start, end)字节范围，每个范围都从行首开始、在行尾结束"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    n_shards = max(1, min(n_shards, size))
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n_shards):
+            target = size * i // n_shards
+            if target <= bounds[-1]:
+                continue
+            f.seek(target)
+            f.readline()  # 跳到下一行的行首
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def count_lines_in_range(path, start, end):
+    """统计[start, end)范围内的行数（最后一行没有换行符时也计为一行）"""
+    count = 0
+    last_byte = b'\n'
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            count += chunk.count(b'\n')
+            last_byte = chunk[-1:]
+            remaining -= len(chunk)
+    if last_byte != b'\n':
+        count += 1
+    return count
+
+
+def iter_lines_in_range(path, start, end):
+    """逐行读取[start, end)范围内的内容（bytes，含换行符）"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def shard_line_offsets(path, ranges, pool=None):
+    """返回每个分片第一行的全局行号（从0开始）；pool不为None时并行统计"""
+    args = [(path, start, end) for start, end in ranges]
+    if pool is not None:
+        counts = pool.starmap(count_lines_in_range, args)
+    else:
+        counts = [count_lines_in_range(*a) for a in args]
+    offsets = []
+    total = 0
+    for c in counts:
+        offsets.append(total)
+        total += c
+    return offsets
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+"""
+大模型响应的本地持久化缓存（SQLite）
+- 键：模型名 + temperature + prompt的sha256，相同请求重复运行时直接返回缓存结果
+- 按最近访问时间做LRU淘汰，总大小不超过max_bytes
+- mode: "readwrite"(默认，未命中时请求并写入) / "replay"(只读回放，未命中不请求) / "off"(关闭缓存)
+"""
+
+DEFAULT_CACHE_PATH = "./llm_cache.sqlite"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2GB
+CACHE_MODES = ("readwrite", "replay", "off")
+
+
+def prompt_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, mode: str = "readwrite"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知缓存模式: {mode}，可选 {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+        if mode == "off":
+            return
+        if mode == "replay":
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"回放模式下缓存文件不存在: {path}")
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, temperature REAL, prompt_hash TEXT, "
+                "response TEXT, size INTEGER, created REAL, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+            self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        self._total_bytes = row[0]
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def replay_only(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def make_key(model: str, temperature: float, content: str) -> str:
+        return f"{model}|{temperature}|{prompt_hash(content)}"
+
+    def get(self, model: str, temperature: float, content: str) -> str | None:
+        if not self.enabled:
+            return None
+        key = self.make_key(model, temperature, content)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.replay_only:
+                # 更新访问时间，用于LRU淘汰
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+            return row[0]
+
+    def put(self, model: str, temperature: float, content: str, response: str | None) -> None:
+        # 失败的请求（None）不缓存，下次重新请求
+        if not self.enabled or self.replay_only or response is None:
+            return
+        key = self.make_key(model, temperature, content)
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, temperature, prompt_hash(content), response, size, now, now),
+            )
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # 按最久未访问的顺序删除，直到总大小降到上限的90%
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._total_bytes,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_cache = None
+
+
+def configure_cache(path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, mode: str = "readwrite") -> LLMCache:
+    """设置进程内共享的缓存，需在第一次请求前调用"""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = LLMCache(path, max_bytes, mode)
+    return _cache
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
+
+
+def print_cache_stats() -> None:
+    stats = get_cache().stats()
+    print(f"LLM缓存统计: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+          f"命中率 {stats['hit_rate']:.2%}, 淘汰 {stats['evictions']} 条, 大小 {stats['size_bytes'] / 1024 ** 2:.1f}MB")
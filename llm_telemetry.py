@@ -0,0 +1,243 @@
+import os
+import json
+import threading
+import contextvars
+from collections import Counter
+from counter_stats import percentiles
+
+"""
+大模型请求的遥测：用于估算并发数和预算
+- 每次gpt_chat/async_gpt_chat调用（含重试）记录：墙钟时间（含限流等待和重试退避）、API耗时、
+  prompt/completion/推理token数、重试次数、各次失败的错误类型、最终结果（成功/失败/缓存命中/回放未命中）
+- 按 模型 x 任务类型 聚合；任务类型由调用方用set_task设置（contextvar，线程和asyncio协程之间互不影响）
+- 最近一次调用的用量保存在contextvar中，configure_telemetry(record_usage=True)时各阶段用attach_usage写入记录的llm_usage字段
+- 聚合结果可导出为Prometheus textfile（node_exporter的textfile collector）和JSON摘要
+"""
+
+# 请求耗时直方图的桶上界（秒），DeepSeek-R1单次请求可达数分钟
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+NO_TASK = "unspecified"
+OUTCOMES = ("ok", "failed", "cached", "replay_miss")
+
+USAGE_FIELD = "llm_usage"
+_config = {"record_usage": False}  # 为True时attach_usage把用量写入记录的llm_usage字段
+
+_task_var = contextvars.ContextVar("llm_task", default=NO_TASK)
+_usage_var = contextvars.ContextVar("llm_last_usage", default=None)
+
+
+def set_task(task):
+    """设置当前线程/协程后续请求的任务类型，返回的token可传给reset_task恢复"""
+    return _task_var.set(str(task).strip() or NO_TASK)
+
+
+def reset_task(token) -> None:
+    _task_var.reset(token)
+
+
+def last_usage():
+    """当前线程/协程最近一次请求的用量（dict），没有请求过时为None"""
+    return _usage_var.get()
+
+
+def configure_telemetry(record_usage=False) -> None:
+    _config["record_usage"] = record_usage
+
+
+def attach_usage(data, stage):
+    """record_usage开启时，把当前线程/协程最近一次请求的用量写入 data["llm_usage"][stage]（dict和LazyRecord均可）"""
+    usage = _usage_var.get()
+    if not _config["record_usage"] or usage is None:
+        return data
+    field = dict(data.get(USAGE_FIELD) or {})
+    field[stage] = {key: value for key, value in usage.items() if key != "task" and value is not None}
+    data[USAGE_FIELD] = field
+    return data
+
+
+def response_usage(response) -> dict:
+    """从openai响应中取token用量，字段缺失时为None"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "reasoning_tokens": getattr(details, "reasoning_tokens", None),
+    }
+
+
+class _Series:
+    """一个 模型 x 任务 的聚合统计"""
+
+    def __init__(self):
+        self.outcomes = Counter()
+        self.attempts = 0
+        self.retries = 0
+        self.errors = Counter()             # 错误类型 -> 失败次数（含重试成功前的失败）
+        self.tokens = Counter()             # prompt/completion/reasoning -> token总数
+        self.wall_seconds = 0.0
+        self.api_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latencies = Counter()          # 墙钟时间（按10ms取整） -> 次数，用于计算分位数
+
+    def add(self, usage) -> None:
+        self.outcomes[usage["outcome"]] += 1
+        self.attempts += usage["attempts"]
+        self.retries += usage["retries"]
+        self.errors.update(usage["errors"])
+        for kind in ("prompt_tokens", "completion_tokens", "reasoning_tokens"):
+            if usage[kind]:
+                self.tokens[kind[:-len("_tokens")]] += usage[kind]
+        if usage["outcome"] in ("cached", "replay_miss"):
+            return  # 未发起请求，不计入耗时
+        self.wall_seconds += usage["wall_seconds"]
+        self.api_seconds += usage["api_seconds"]
+        i = 0
+        while i < len(LATENCY_BUCKETS) and usage["wall_seconds"] > LATENCY_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.latencies[round(usage["wall_seconds"], 2)] += 1
+
+    def summary(self) -> dict:
+        requests = sum(self.outcomes.values())
+        sent = self.outcomes["ok"] + self.outcomes["failed"]
+        ok = self.outcomes["ok"]
+        return {
+            "requests": requests,
+            "outcomes": {outcome: self.outcomes[outcome] for outcome in OUTCOMES},
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "retry_rate": round(self.retries / self.attempts, 4) if self.attempts else 0.0,
+            "errors": dict(self.errors.most_common()),
+            "tokens": dict(self.tokens),
+            "tokens_per_ok_request": {kind: round(n / ok, 1) for kind, n in self.tokens.items()} if ok else {},
+            "wall_seconds": percentiles(self.latencies, ndigits=3),
+            # 平均在途请求数 = 吞吐量 x 平均API耗时（利特尔法则），据此设置并发上限
+            "mean_api_seconds": round(self.api_seconds / sent, 3) if sent else None,
+        }
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class LLMTelemetry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (模型, 任务) -> _Series
+
+    def record(self, model, outcome, wall_seconds=0.0, api_seconds=0.0, attempts=0, errors=(), response=None) -> dict:
+        """
+        记录一次调用（含全部重试），返回本次用量并存入last_usage
+        errors: 各次失败的错误类型名，最终成功时即为重试的原因
+        """
+        usage = {"model": model, "task": _task_var.get(), "outcome": outcome,
+                 "wall_seconds": round(wall_seconds, 3), "api_seconds": round(api_seconds, 3),
+                 "attempts": attempts, "retries": max(0, attempts - 1), "errors": list(errors)}
+        usage.update(response_usage(response))
+        with self._lock:
+            series = self._series.get((model, usage["task"]))
+            if series is None:
+                series = self._series[(model, usage["task"])] = _Series()
+            series.add(usage)
+        _usage_var.set(usage)
+        return usage
+
+    def summary(self) -> dict:
+        """JSON摘要：{"模型 | 任务": 统计}，模型有多个任务时另加该模型的合计"""
+        with self._lock:
+            items = sorted(self._series.items())
+            totals = {}
+            for (model, _), series in items:
+                total = totals.setdefault(model, _Series())
+                total.outcomes.update(series.outcomes)
+                total.attempts += series.attempts
+                total.retries += series.retries
+                total.errors.update(series.errors)
+                total.tokens.update(series.tokens)
+                total.wall_seconds += series.wall_seconds
+                total.api_seconds += series.api_seconds
+                total.latencies.update(series.latencies)
+            result = {f"{model} | {task}": series.summary() for (model, task), series in items}
+            n_tasks = Counter(model for model, _ in self._series)
+            result.update({f"{model} | 合计": total.summary() for model, total in sorted(totals.items()) if n_tasks[model] > 1})
+        return result
+
+    def prometheus_text(self, prefix="llm") -> str:
+        lines = [
+            f"# HELP {prefix}_requests_total LLM calls by final outcome (retries included in one call).",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            for (model, task), s in items:
+                base = f'model="{_label(model)}",task="{_label(task)}"'
+                for outcome in OUTCOMES:
+                    lines.append(f'{prefix}_requests_total{{{base},outcome="{outcome}"}} {s.outcomes[outcome]}')
+            lines += [f"# HELP {prefix}_attempts_total HTTP attempts sent to the API.",
+                      f"# TYPE {prefix}_attempts_total counter"]
+            lines += [f'{prefix}_attempts_total{{model="{_label(m)}",task="{_label(t)}"}} {s.attempts}' for (m, t), s in items]
+            lines += [f"# HELP {prefix}_retries_total Attempts beyond the first one.",
+                      f"# TYPE {prefix}_retries_total counter"]
+            lines += [f'{prefix}_retries_total{{model="{_label(m)}",task="{_label(t)}"}} {s.retries}' for (m, t), s in items]
+            lines += [f"# HELP {prefix}_errors_total Failed attempts by exception class.",
+                      f"# TYPE {prefix}_errors_total counter"]
+            for (model, task), s in items:
+                for error, n in sorted(s.errors.items()):
+                    lines.append(f'{prefix}_errors_total{{model="{_label(model)}",task="{_label(task)}",error="{_label(error)}"}} {n}')
+            lines += [f"# HELP {prefix}_tokens_total Tokens reported by the API usage field.",
+                      f"# TYPE {prefix}_tokens_total counter"]
+            for (model, task), s in items:
+                for kind, n in sorted(s.tokens.items()):
+                    lines.append(f'{prefix}_tokens_total{{model="{_label(model)}",task="{_label(task)}",kind="{kind}"}} {n}')
+            lines += [f"# HELP {prefix}_request_duration_seconds Wall time per call, including rate-limit waits and retries.",
+                      f"# TYPE {prefix}_request_duration_seconds histogram"]
+            for (model, task), s in items:
+                base = f'model="{_label(model)}",task="{_label(task)}"'
+                cumulative = 0
+                for bound, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], s.buckets):
+                    cumulative += n
+                    lines.append(f'{prefix}_request_duration_seconds_bucket{{{base},le="{bound}"}} {cumulative}')
+                lines.append(f"{prefix}_request_duration_seconds_sum{{{base}}} {s.wall_seconds:.3f}")
+                lines.append(f"{prefix}_request_duration_seconds_count{{{base}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="llm") -> None:
+        """先写临时文件再替换，textfile collector不会读到写了一半的文件"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path, path)
+
+    def write_json(self, path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+
+_telemetry = None
+
+
+def get_telemetry() -> LLMTelemetry:
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = LLMTelemetry()
+    return _telemetry
+
+
+def export_telemetry(json_path=None, prom_path=None) -> None:
+    telemetry = get_telemetry()
+    if json_path:
+        telemetry.write_json(json_path)
+    if prom_path:
+        telemetry.write_prometheus(prom_path)
+
+
+def print_telemetry_stats() -> None:
+    for name, s in get_telemetry().summary().items():
+        if not s["requests"]:
+            continue
+        wall = s["wall_seconds"]
+        latency = f"p50={wall['p50']}s p99={wall['p99']}s" if wall else "无请求"
+        print(f"LLM请求统计 [{name}]: {s['requests']} 次, 成功 {s['outcomes']['ok']}, 失败 {s['outcomes']['failed']}, "
+              f"缓存命中 {s['outcomes']['cached']}, 重试率 {s['retry_rate']:.2%}, 耗时 {latency}, "
+              f"token {s['tokens']}, 错误 {s['errors']}")
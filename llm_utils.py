@@ -0,0 +1,176 @@
+import re
+import time
+import asyncio
+from llm_cache import get_cache
+from rate_limiter import get_limiter, estimate_tokens
+from llm_telemetry import get_telemetry
+
+"""
+各脚本共用的大模型请求函数：统一重试逻辑，接入本地响应缓存（llm_cache.py）、
+进程内共享的自适应限流器（rate_limiter.py）和请求遥测（llm_telemetry.py）
+"""
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+TOKEN_ENCODING = "cl100k_base"
+_encoder = None
+# 无tiktoken时的估计规则：BPE对数字每1~3位切分，英文单词、标点各计1个
+_TOKEN_RE = re.compile(r" ?\d{1,3}| ?[A-Za-z]+|\s+|[^\d\sA-Za-z]")
+
+
+# 分类阶段（gpt-4o-mini）批量请求的上下文预算，阶段脚本和token_planner.py共用，保证预估的拆分与实际一致
+CLASSIFY_CONTEXT_BUDGET = 128000
+CLASSIFY_OUTPUT_TOKENS_PER_ITEM = 10
+
+
+def batch_prompt_budget(batch_size, context_budget=CLASSIFY_CONTEXT_BUDGET,
+                        output_tokens_per_item=CLASSIFY_OUTPUT_TOKENS_PER_ITEM) -> int:
+    """批量prompt的token上限（超过时对半拆分）：上下文预算减去为每个问题的输出预留的token"""
+    return context_budget - output_tokens_per_item * batch_size
+
+
+def count_tokens(text: str) -> int:
+    """离线token计数：安装tiktoken时精确计数，否则按规则估计"""
+    global _encoder
+    if tiktoken is not None and _encoder is None:
+        try:
+            _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            _encoder = False  # 编码表无法加载（如离线），退回估计
+    if _encoder:
+        return len(_encoder.encode(text))
+    return len(_TOKEN_RE.findall(text))
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def gpt_chat(client, model, content, max_retries=3, temperature=0.2):
+    telemetry = get_telemetry()
+    call_start = time.monotonic()
+    cache = get_cache()
+    cached = cache.get(model, temperature, content)
+    if cached is not None:
+        telemetry.record(model, "cached")
+        return cached
+    if cache.replay_only:
+        print("回放模式：缓存未命中，跳过请求")
+        telemetry.record(model, "replay_miss")
+        return None
+
+    limiter = get_limiter()
+    est_tokens = estimate_tokens(content)
+    retry_count = 0
+    errors = []
+    api_seconds = 0.0
+    while retry_count < max_retries:
+        limiter.acquire(est_tokens)
+        start = time.monotonic()
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=[{"role": "user", "content": content}]
+            )
+        except BaseException as e:
+            latency = time.monotonic() - start
+            api_seconds += latency
+            limiter.release(False, latency, error=e, estimated_tokens=est_tokens)
+            if not isinstance(e, Exception):
+                raise  # KeyboardInterrupt/任务取消：归还并发名额后直接退出
+            errors.append(type(e).__name__)
+            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
+            retry_count += 1
+            if retry_count < max_retries:
+                time.sleep(limiter.backoff_delay(retry_count - 1, e))
+            continue
+        latency = time.monotonic() - start
+        api_seconds += latency
+        limiter.release(True, latency, estimated_tokens=est_tokens, used_tokens=_used_tokens(response))
+        result = response.choices[0].message.content
+        cache.put(model, temperature, content, result)
+        telemetry.record(model, "ok", time.monotonic() - call_start, api_seconds, retry_count + 1, errors, response)
+        return result
+    print("已达到最大重试次数，请求失败。")
+    telemetry.record(model, "failed", time.monotonic() - call_start, api_seconds, retry_count, errors)
+    return None
+
+
+async def async_gpt_chat(aclient, model, content, max_retries=3, temperature=0.2):
+    telemetry = get_telemetry()
+    call_start = time.monotonic()
+    cache = get_cache()
+    cached = cache.get(model, temperature, content)
+    if cached is not None:
+        telemetry.record(model, "cached")
+        return cached
+    if cache.replay_only:
+        print("回放模式：缓存未命中，跳过请求")
+        telemetry.record(model, "replay_miss")
+        return None
+
+    limiter = get_limiter()
+    est_tokens = estimate_tokens(content)
+    retry_count = 0
+    errors = []
+    api_seconds = 0.0
+    while retry_count < max_retries:
+        await limiter.acquire_async(est_tokens)
+        start = time.monotonic()
+        try:
+            response = await aclient.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=[{"role": "user", "content": content}]
+            )
+        except BaseException as e:
+            latency = time.monotonic() - start
+            api_seconds += latency
+            limiter.release(False, latency, error=e, estimated_tokens=est_tokens)
+            if not isinstance(e, Exception):
+                raise  # KeyboardInterrupt/任务取消：归还并发名额后直接退出
+            errors.append(type(e).__name__)
+            print(f"API请求失败 (尝试 {retry_count + 1}/{max_retries}): {e}")
+            retry_count += 1
+            if retry_count < max_retries:
+                await asyncio.sleep(limiter.backoff_delay(retry_count - 1, e))
+            continue
+        latency = time.monotonic() - start
+        api_seconds += latency
+        limiter.release(True, latency, estimated_tokens=est_tokens, used_tokens=_used_tokens(response))
+        result = response.choices[0].message.content
+        cache.put(model, temperature, content, result)
+        telemetry.record(model, "ok", time.monotonic() - call_start, api_seconds, retry_count + 1, errors, response)
+        return result
+    print("已达到最大重试次数，请求失败。")
+    telemetry.record(model, "failed", time.monotonic() - call_start, api_seconds, retry_count, errors)
+    return None
+
+
+def parse_batch_categories(response, count, label="Category"):
+    """
+    解析批量分类的输出，每行形如 "Question <n> Category: <k>"
+    返回长度为count的列表，缺失、重复或不合法（非1~4）的条目为None，由调用方单独重发
+    """
+    results = [None] * count
+    seen = set()
+    if not response:
+        return results
+    pattern = r'Question\s*(\d+)[^\n\d]*?' + label + r':\s*\[?\s*(\d)'
+    for match in re.finditer(pattern, response):
+        n = int(match.group(1))
+        category = int(match.group(2))
+        if not 1 <= n <= count:
+            continue
+        if n in seen:
+            # 同一题出现多个结果，无法判断，交给单独重发
+            results[n - 1] = None
+            continue
+        seen.add(n)
+        results[n - 1] = category if category in (1, 2, 3, 4) else None
+    return results
@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from record_codec import LazyRecord
+
+"""
+流式流水线：在一个进程内串联README中的各阶段，样本逐条流过，不再等上一阶段写完整个中间文件
+- 每个阶段一个或多个工作线程，阶段之间用有界队列连接（队列满时上游阻塞，内存占用有上限）
+- LLM阶段可开多个线程并发请求（共享进程内的限流器和响应缓存），之后的CPU阶段同时开始处理
+- 多线程阶段的输出经重排后保持输入顺序，与逐个脚本运行的结果顺序一致；重排缓冲区有上限（reorder_window）
+- 每个阶段可选写出中间文件供人工核查；定期打印各阶段吞吐量和队列深度
+"""
+
+_END = object()
+
+
+class Divert:
+    """阶段函数返回Divert(record)时，该样本写入阶段的side_output文件，不再流向下游（如推理错误的样本）"""
+
+    def __init__(self, record):
+        self.record = record
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, output=None, side_output=None, reorder_window=None):
+        """
+        fn(record) -> record / None（丢弃） / Divert(record)
+        output: 该阶段结果的中间文件（可选）；side_output: Divert样本的输出文件（可选）
+        reorder_window: 已取出但尚未按序放行的最大样本数（默认为线程数的4倍），
+            某个慢请求卡住时其他线程最多再处理这么多条，重排缓冲区不会无限增长
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.reorder_window = max(reorder_window or workers * 4, workers)
+        self.output = output
+        self.side_output = side_output
+        self.count_in = 0
+        self.count_out = 0
+        self.count_dropped = 0
+        self.count_diverted = 0
+        self.count_error = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def metrics(self, elapsed):
+        return {
+            "in": self.count_in, "out": self.count_out, "dropped": self.count_dropped,
+            "diverted": self.count_diverted, "errors": self.count_error,
+            "rate": round(self.count_out / elapsed, 2) if elapsed > 0 else 0.0,
+            "busy_seconds": round(self.busy_seconds, 1),
+        }
+
+
+def dumps_record(record) -> str:
+    if isinstance(record, LazyRecord):
+        return record.dumps(ensure_ascii=False)
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _queue_depth(q) -> int:
+    """队列中待处理的样本数，不计结束标记（多线程阶段的线程会把_END放回队列通知其他线程）"""
+    with q.mutex:
+        return sum(1 for item in q.queue if item is not _END)
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=64, report_interval=30.0):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self._start_time = None
+        self._errors = []
+
+    def _run_stage(self, i, stage):
+        in_q, out_q = self.queues[i], self.queues[i + 1]
+        out_file = open(stage.output, 'w', encoding='utf-8') if stage.output else None
+        side_file = open(stage.side_output, 'w', encoding='utf-8') if stage.side_output else None
+        # 序号 -> 结果；多个工作线程乱序完成，按输入序号依次放行
+        pending = {}
+        next_seq = 0
+        emit_lock = threading.Lock()
+        window = threading.Semaphore(stage.reorder_window)  # 在途序号数（已取出、尚未放行）
+
+        def emit(seq, result):
+            nonlocal next_seq
+            with emit_lock:
+                pending[seq] = result
+                while next_seq in pending:
+                    item = pending.pop(next_seq)
+                    next_seq += 1
+                    window.release()
+                    if item is None:
+                        stage.count_dropped += 1
+                    elif isinstance(item, Divert):
+                        stage.count_diverted += 1
+                        if side_file:
+                            side_file.write(dumps_record(item.record) + '\n')
+                    else:
+                        stage.count_out += 1
+                        if out_file:
+                            out_file.write(dumps_record(item) + '\n')
+                        out_q.put(item)
+
+        feed_lock = threading.Lock()
+        feed_seq = 0
+
+        def worker():
+            nonlocal feed_seq
+            while True:
+                # 先占一个在途名额再取样本：最早的样本未完成时，其他线程最多领先reorder_window条
+                window.acquire()
+                # 取样本和分配序号须原子完成，保证序号与输入顺序一致
+                with feed_lock:
+                    record = in_q.get()
+                    if record is _END:
+                        in_q.put(_END)  # 通知同阶段其他线程
+                        window.release()
+                        return
+                    seq = feed_seq
+                    feed_seq += 1
+                with stage._lock:
+                    stage.count_in += 1
+                t0 = time.perf_counter()
+                try:
+                    result = stage.fn(record)
+                except Exception as e:
+                    print(f"[{stage.name}] 处理错误 - {type(e).__name__}: {e}")
+                    with stage._lock:
+                        stage.count_error += 1
+                    result = None
+                with stage._lock:
+                    stage.busy_seconds += time.perf_counter() - t0
+                emit(seq, result)
+
+        threads = [threading.Thread(target=worker, name=f"{stage.name}-{n}", daemon=True)
+                   for n in range(stage.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for f in (out_file, side_file):
+            if f:
+                f.close()
+        out_q.put(_END)
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            "stages": {
+                stage.name: {**stage.metrics(elapsed), "queue_depth": _queue_depth(self.queues[i])}
+                for i, stage in enumerate(self.stages)
+            },
+        }
+
+    def print_metrics(self):
+        m = self.metrics()
+        print(f"---- 流水线运行 {m['elapsed_seconds']}s ----")
+        for name, s in m["stages"].items():
+            print(f"  {name:<16} 输入队列 {s['queue_depth']:>4} | 输入 {s['in']:>7} 输出 {s['out']:>7} "
+                  f"丢弃 {s['dropped']:>5} 分流 {s['diverted']:>5} 错误 {s['errors']:>4} | {s['rate']} 条/s")
+
+    def run(self, source, sink=None):
+        """source: 产出记录的可迭代对象；sink(record): 处理最终结果（如写入文件），返回各阶段统计"""
+        self._start_time = time.perf_counter()
+        threads = [threading.Thread(target=self._run_stage, args=(i, stage), daemon=True)
+                   for i, stage in enumerate(self.stages)]
+        for t in threads:
+            t.start()
+
+        def feed():
+            for record in source:
+                self.queues[0].put(record)
+            self.queues[0].put(_END)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        last_report = time.perf_counter()
+        out_q = self.queues[-1]
+        while True:
+            try:
+                record = out_q.get(timeout=1.0)
+            except queue.Empty:
+                record = None
+            if record is _END:
+                break
+            if record is not None and sink is not None:
+                sink(record)
+            if self.report_interval and time.perf_counter() - last_report >= self.report_interval:
+                self.print_metrics()
+                last_report = time.perf_counter()
+
+        feeder.join()
+        for t in threads:
+            t.join()
+        self.print_metrics()
+        return self.metrics()
+
+
+# ------------------- README流程的各阶段 -------------------
+
+def build_default_stages(out_dir, llm_workers=8, write_intermediate=True, stage_caches=None):
+    """
+    classify_rule_based -> extract_label -> cot_deepseekr1 -> cot_correct -> generate_cot -> extract_step2label_from_output
+    out_dir: 中间文件目录；write_intermediate=False时只写最终结果和推理错误的样本
+    stage_caches: {"extract_label": StageCache, "cot_correct": StageCache}（可只给其中之一），
+        输入和规则未变化的样本复用上次的结果（见stage_cache.py）
+    """
+    import classify_rule_based
+    import extract_label
+    import cot_deepseekr1
+    import cot_correct
+    import generate_cot
+    import extract_step2label_from_output
+
+    def path(name):
+        return os.path.join(out_dir, name) if write_intermediate else None
+
+    def classify(item):
+        idx, line = item
+        result = classify_rule_based.classify_line(idx, line)
+        return LazyRecord(result[1]) if result else None
+
+    stage_caches = stage_caches or {}
+    label_cache = stage_caches.get("extract_label")
+    check_cache = stage_caches.get("cot_correct")
+
+    def label(data):
+        return data if extract_label.label_record(data, label_cache) is not None else None
+
+    def check(data):
+        if check_cache is not None:
+            is_match, step6_label, _ = check_cache.apply(data, cot_correct.check_record)
+        else:
+            is_match, step6_label, _ = cot_correct.check_record(data)
+        print(f" ID {data['id']} : 推理{'正确' if is_match else '失败'} | Step6_label: {step6_label} | label: {data['label']}")
+        return data if is_match else Divert(data)
+
+    def add_cot(data):
+        generate_cot.add_cot_field(data)
+        return data
+
+    def step2(data):
+        # 请求失败的样本丢弃（与cot_deepseekr1阶段一致），不写入带假label的结果
+        if extract_step2label_from_output.step2_record(data) is None:
+            return None
+        return data
+
+    return [
+        Stage("classify", classify, output=path("classified.jsonl")),
+        Stage("extract_label", label, output=path("labeled.jsonl")),
+        Stage("cot_deepseekr1", cot_deepseekr1.cot_record, workers=llm_workers, output=path("cot.jsonl")),
+        Stage("cot_correct", check, output=path("cot_correct.jsonl"),
+              side_output=os.path.join(out_dir, "cot_wrong.jsonl")),
+        Stage("generate_cot", add_cot, output=path("cot_generated.jsonl")),
+        Stage("step2_label", step2, workers=llm_workers),
+    ]
+
+
+def run_default_pipeline(input_file, output_file, out_dir, start_idx=0, end_idx=sys.maxsize,
+                         llm_workers=8, write_intermediate=True, queue_size=64, metrics_file=None,
+                         stage_cache_path=None):
+    """stage_cache_path不为None时extract_label和cot_correct阶段启用阶段缓存，重跑时只重算输入或规则有变化的样本"""
+    from jsonl_index import JsonlIndex
+
+    os.makedirs(out_dir, exist_ok=True)
+    stage_caches = {}
+    if stage_cache_path:
+        from extract_label import label_stage_cache
+        from cot_correct import check_stage_cache
+        stage_caches = {"extract_label": label_stage_cache(stage_cache_path),
+                        "cot_correct": check_stage_cache(stage_cache_path)}
+    pipeline = Pipeline(build_default_stages(out_dir, llm_workers, write_intermediate, stage_caches), queue_size=queue_size)
+    try:
+        with JsonlIndex(input_file) as index, open(output_file, 'w', encoding='utf-8') as f_out:
+            metrics = pipeline.run(index.iter_range(start_idx, end_idx),
+                                   sink=lambda record: f_out.write(dumps_record(record) + '\n'))
+    finally:
+        for cache in stage_caches.values():
+            cache.print_stats()
+            cache.close()
+    if metrics_file:
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, ensure_ascii=False, indent=2)
+    print(f"流水线完成，最终结果已保存到 {output_file}，推理错误的样本见 {os.path.join(out_dir, 'cot_wrong.jsonl')}")
+    return metrics
+
+
+if __name__ == "__main__":
+    from llm_cache import configure_cache, print_cache_stats
+    from llm_telemetry import configure_telemetry, export_telemetry, print_telemetry_stats
+    from rate_limiter import configure_limiter
+    from ts_serializer import configure_serializer
+    import cot_deepseekr1
+
+    input_file = "./sft/chatts_sft_train.jsonl"
+    output_file = "./pipeline_out/final.jsonl"
+    out_dir = "./pipeline_out"
+    start_index = 0  # 起始索引(包含)
+    end_index = 2000  # 结束索引(包含)
+
+    configure_cache("./llm_cache.sqlite", mode="readwrite")
+    llm_workers = 8  # 每个LLM阶段的并发线程数
+    configure_limiter(rpm=60, tpm=400000, max_concurrency=llm_workers)
+    configure_serializer(**cot_deepseekr1.SERIALIZER_CONFIG)
+    configure_telemetry(record_usage=False)  # True时在每条样本中写入llm_usage字段（各LLM阶段的耗时、token数、重试次数）
+
+    run_default_pipeline(input_file, output_file, out_dir, start_index, end_index,
+                         llm_workers=llm_workers, write_intermediate=True,
+                         metrics_file=os.path.join(out_dir, "metrics.json"),
+                         stage_cache_path="./stage_cache.sqlite")
+    print_cache_stats()
+    print_telemetry_stats()
+    export_telemetry(os.path.join(out_dir, "llm_telemetry.json"), os.path.join(out_dir, "llm_telemetry.prom"))
@@ -0,0 +1,131 @@
+import json
+from collections import defaultdict
+from record_codec import LazyRecord
+from cot_correct import check_record, check_stage_cache
+from generate_cot import add_cot_field
+
+'''
+cot_deepseekr1输出的后处理，一次流式读写完成原先三个脚本的工作：
+cot_correct.py（推理正确性判断 + stepx_label） -> generate_cot.py（组成cot字段） -> classify_cnt.py（按任务统计）
+- 推理正确/错误的样本分别写出，cot字段已插入到label之后，正确文件即可直接进入step2_label补充
+- 结束时打印按任务类型的统计报告（可同时保存为JSON）
+'''
+
+TASKS = ["Anomaly detection", "Scenario attribution", "Inferential calculation"]
+REQUIRED_FIELDS = ["id", "task", "output", "timeseries", "cot_deepseekr1", "label"]
+
+
+def postprocess_record(data):
+    """单条样本：提取stepx_label并判断正确性，再插入cot字段（原地修改data），返回 (是否匹配, step6_label, 标签为空的step列表)"""
+    is_match, step6_label, empty_steps = check_record(data)
+    add_cot_field(data)
+    return is_match, step6_label, empty_steps
+
+
+def postprocess_jsonl(input_file: str, correct_file: str, wrong_file: str, stats_file=None, stage_cache_path=None) -> dict:
+    """stage_cache_path不为None时stepx_label提取复用cot_correct的阶段缓存；返回统计结果"""
+    cache = check_stage_cache(stage_cache_path) if stage_cache_path else None
+    by_task = defaultdict(lambda: {"total": 0, "correct": 0, "wrong": 0})
+    empty_label_id = defaultdict(list)
+    unknown_task_id = []
+    error_id = []
+    total_count = 0
+
+    with open(input_file, 'r', encoding="utf-8") as f_in, \
+         open(correct_file, 'w', encoding="utf-8") as f_match, \
+         open(wrong_file, 'w', encoding="utf-8") as f_mismatch:
+
+        for line_num, line in enumerate(f_in, 1):
+            line = line.strip()
+            if not line:
+                continue
+            total_count += 1
+            id = f"第{line_num}行"
+
+            try:
+                # 惰性解码：timeseries等大字段不解析，写出时原样拷贝
+                data = LazyRecord(line)
+                for field in REQUIRED_FIELDS:
+                    if field not in data and not (field == "timeseries" and "timeseries_ref" in data):
+                        raise KeyError(f"缺失必要字段: {field}")
+                id = data["id"]
+                task = data["task"].strip()
+
+                if cache is not None:
+                    # 缓存只覆盖stepx_label，cot字段每次由缓存写回的step6_label重新组成
+                    is_match, step6_label, empty_steps = cache.apply(data, check_record)
+                    add_cot_field(data)
+                else:
+                    is_match, step6_label, empty_steps = postprocess_record(data)
+                for step in empty_steps:
+                    empty_label_id[step].append(id)
+
+                if is_match:
+                    f_match.write(data.dumps(ensure_ascii=False) + "\n")
+                else:
+                    f_mismatch.write(data.dumps(ensure_ascii=False) + "\n")
+
+                if task not in TASKS:
+                    print(f" ID {id} : 未知任务类型 '{task}'")
+                    unknown_task_id.append(id)
+                stats = by_task[task]
+                stats["total"] += 1
+                stats["correct" if is_match else "wrong"] += 1
+                print(f" ID {id} : 推理{'正确' if is_match else '失败'} | Step6_label: {step6_label} | label: {data['label']}")
+
+            except json.JSONDecodeError as e:
+                error_id.append(id)
+                print(f" ID {id} : JSON解析错误 - {str(e)}")
+            except KeyError as e:
+                error_id.append(id)
+                print(f" ID {id} : 字段缺失 - {str(e)}")
+            except Exception as e:
+                error_id.append(id)
+                print(f" ID {id} : 未知错误 - {str(e)}")
+
+    if cache is not None:
+        cache.print_stats()
+        cache.close()
+
+    report = {
+        "total": total_count,
+        "correct": sum(s["correct"] for s in by_task.values()),
+        "wrong": sum(s["wrong"] for s in by_task.values()),
+        "by_task": {task: by_task[task] for task in TASKS + sorted(set(by_task) - set(TASKS)) if task in by_task},
+        "empty_label_id": dict(empty_label_id),
+        "unknown_task_id": unknown_task_id,
+        "error_id": error_id,
+    }
+    print_report(report, correct_file, wrong_file)
+    if stats_file:
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"统计结果已保存到 {stats_file}")
+    return report
+
+
+def print_report(report, correct_file, wrong_file):
+    print("\n" + "=" * 50)
+    print("处理完成！统计结果：")
+    print(f"总数据量：{report['total']} 条")
+    print(f"匹配成功：{report['correct']} 条（输出至 {correct_file}）")
+    print(f"匹配失败：{report['wrong']} 条（输出至 {wrong_file}）")
+    print(f"{'任务':<24}{'总数':>8}{'正确':>8}{'错误':>8}{'正确率':>10}")
+    for task, s in report["by_task"].items():
+        rate = f"{s['correct'] / s['total']:.2%}" if s["total"] else "-"
+        print(f"{task:<24}{s['total']:>8}{s['correct']:>8}{s['wrong']:>8}{rate:>10}")
+    print(f"处理错误：{len(report['error_id'])} 条, 失败ID: {report['error_id']}")
+    print(f"未知任务类型的ID: {report['unknown_task_id']}")
+    for step, ids in report["empty_label_id"].items():
+        print(f"{step} 为空的ID: {ids}")
+
+
+if __name__ == "__main__":
+
+    input_path = "./univariate_0_2000_filtered_labeled_cot.jsonl"
+    correct_path = "./univariate_0_2000_filtered_labeled_cot_stepLabeled_correct_test2.jsonl"  # 匹配成功（已含cot字段）
+    wrong_path = "./univariate_0_2000_filtered_labeled_cot_stepLabeled_wrong_test.jsonl"  # 匹配失败
+    stats_path = "./univariate_0_2000_postprocess_stats.json"
+
+    postprocess_jsonl(input_path, correct_path, wrong_path, stats_file=stats_path,
+                      stage_cache_path="./stage_cache.sqlite")
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import multiprocessing
+from collections import Counter
+from jsonl_shards import split_byte_ranges, iter_lines_in_range
+from record_codec import LazyRecord
+from counter_stats import percentiles, histogram
+
+"""
+数据集概况统计（取代classify_cnt.py），一次流式读取完成：
+- 各任务样本数、单变量/多变量划分、序列长度和变量数直方图、各任务label分布、
+  stepx_label为空的数量、CoT长度分位数
+- 只解码统计用到的小字段；timeseries不解码，直接在原始JSON文本上数逗号得到各变量长度
+- 所有统计都是计数器，内存占用与文件大小无关；可按字节范围分片多进程统计后合并
+每个阶段跑完后都可以用它核对数据：python profile_dataset.py xxx.jsonl [进程数]
+"""
+
+STEP_FIELDS = ["step1_label", "step2_label", "step4_label", "step6_label"]
+COT_FIELDS = ["cot", "cot_deepseekr1"]
+LENGTH_EDGES = [64, 128, 256, 512, 1024, 2048, 4096, 8192]
+LABEL_LIMIT = 10000  # 每个任务最多记录的不同label数，超出的计入"<其他>"（场景归因的label是整句话）
+TOP_LABELS = 10
+NO_TASK = "（未分类）"
+
+
+def series_shape(raw: str) -> list:
+    """由timeseries的原始JSON文本得到各变量的长度，如 "[[1, 2], [3]]" -> [2, 1]，"[1, 2, 3]" -> [3]"""
+    body = raw.strip()[1:-1]
+    if not body.lstrip().startswith("["):
+        return [body.count(",") + 1] if body.strip() else []
+    lengths = []
+    for part in body.split("]"):
+        start = part.find("[")
+        if start < 0:
+            continue
+        values = part[start + 1:]
+        lengths.append(values.count(",") + 1 if values.strip() else 0)
+    return lengths
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
+
+class DatasetProfile:
+    def __init__(self):
+        self.records = 0
+        self.bad_lines = 0
+        self.tasks = Counter()
+        self.variates = Counter()        # 变量数 -> 样本数
+        self.series_lengths = Counter()  # 单个变量的长度 -> 变量数
+        self.labels = {}                 # 任务 -> Counter(label)
+        self.empty_steps = Counter()
+        self.cot_lengths = Counter()     # CoT字符数 -> 样本数
+
+    def add(self, line: str) -> None:
+        try:
+            data = LazyRecord(line)
+            task = data["task"].strip() if "task" in data else NO_TASK
+
+            if "timeseries" in data:
+                lengths = series_shape(data.raw("timeseries"))
+            elif "timeseries_ref" in data:
+                from series_store import open_store
+                ref = data["timeseries_ref"]
+                lengths = open_store(ref["store"]).shape(ref["id"])
+            else:
+                # 没有时序字段时按<ts><ts/>标签数量计变量数
+                text = data.get("question") or data.get("input") or ""
+                lengths = [None] * text.count("<ts><ts/>")
+
+            label = data.get("label")
+            steps = [field for field in STEP_FIELDS if field in data and _is_empty(data[field])]
+            cot = next((data[field] for field in COT_FIELDS if field in data), None)
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            self.bad_lines += 1
+            return
+
+        self.records += 1
+        self.tasks[task] += 1
+        self.variates[len(lengths)] += 1
+        self.series_lengths.update(n for n in lengths if n is not None)
+        if label is not None:
+            counter = self.labels.setdefault(task, Counter())
+            key = str(label).strip()
+            counter["<其他>" if key not in counter and len(counter) >= LABEL_LIMIT else key] += 1
+        self.empty_steps.update(steps)
+        if isinstance(cot, str):
+            self.cot_lengths[len(cot)] += 1
+
+    def merge(self, other: "DatasetProfile") -> "DatasetProfile":
+        self.records += other.records
+        self.bad_lines += other.bad_lines
+        for name in ("tasks", "variates", "series_lengths", "empty_steps", "cot_lengths"):
+            getattr(self, name).update(getattr(other, name))
+        for task, counter in other.labels.items():
+            self.labels.setdefault(task, Counter()).update(counter)
+        return self
+
+    def report(self) -> dict:
+        univariate = self.variates.get(1, 0)
+        return {
+            "records": self.records,
+            "bad_lines": self.bad_lines,
+            "tasks": dict(self.tasks.most_common()),
+            "univariate": univariate,
+            "multivariate": sum(c for n, c in self.variates.items() if n >= 2),
+            "no_series": self.variates.get(0, 0),
+            "variate_count": {str(n): c for n, c in sorted(self.variates.items())},
+            "series_length": {"percentiles": percentiles(self.series_lengths),
+                              "histogram": histogram(self.series_lengths, LENGTH_EDGES)},
+            "labels": {task: {"distinct": len(c), "top": c.most_common(TOP_LABELS)}
+                       for task, c in sorted(self.labels.items())},
+            "empty_step_labels": {field: self.empty_steps.get(field, 0) for field in STEP_FIELDS},
+            "cot_length": percentiles(self.cot_lengths),
+        }
+
+
+def _profile_range(path, byte_start, byte_end) -> DatasetProfile:
+    profile = DatasetProfile()
+    for line in iter_lines_in_range(path, byte_start, byte_end):
+        line = line.decode("utf-8").strip()
+        if line:
+            profile.add(line)
+    return profile
+
+
+def profile_jsonl(path, workers=1) -> dict:
+    """workers>1时按换行符对齐的字节范围切分，多进程统计后合并"""
+    if workers <= 1:
+        profile = _profile_range(path, 0, os.path.getsize(path))
+    else:
+        ranges = split_byte_ranges(path, workers * 4)
+        profile = DatasetProfile()
+        with multiprocessing.Pool(workers) as pool:
+            for part in pool.starmap(_profile_range, [(path, start, end) for start, end in ranges]):
+                profile.merge(part)
+    return profile.report()
+
+
+def print_profile(report) -> None:
+    print(f"样本数: {report['records']}（无法解析的行: {report['bad_lines']}）")
+    print(f"单变量: {report['univariate']}  多变量: {report['multivariate']}  无时序: {report['no_series']}")
+    print(f"{'任务':<26}{'样本数':>8}{'不同label':>10}  最常见label")
+    for task, count in report["tasks"].items():
+        labels = report["labels"].get(task, {"distinct": 0, "top": []})
+        top = ", ".join(f"{label[:20]}({c})" for label, c in labels["top"][:3])
+        print(f"{task:<26}{count:>8}{labels['distinct']:>10}  {top}")
+    print("变量数: " + "  ".join(f"{n}:{c}" for n, c in report["variate_count"].items()))
+    lengths = report["series_length"]
+    if lengths["percentiles"]:
+        p = lengths["percentiles"]
+        print(f"序列长度: min={p['min']} p50={p['p50']} p90={p['p90']} p99={p['p99']} max={p['max']}")
+        peak = max(c for _, c in lengths["histogram"])
+        for label, c in lengths["histogram"]:
+            print(f"    {label:>10} | {'#' * max(1, round(c / peak * 40))} {c}")
+    print("stepx_label为空: " + "  ".join(f"{k}:{v}" for k, v in report["empty_step_labels"].items()))
+    if report["cot_length"]:
+        p = report["cot_length"]
+        print(f"CoT长度(字符): 共{p['count']}条 p50={p['p50']} p90={p['p90']} p99={p['p99']} max={p['max']}")
+
+
+if __name__ == "__main__":
+    input_path = sys.argv[1] if len(sys.argv) > 1 else "./univariate_0_2000_filtered_labeled_cot_stepLabeled_correct_step2label.jsonl"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    report_path = os.path.splitext(input_path)[0] + "_profile.json"
+
+    report = profile_jsonl(input_path, workers)
+    print_profile(report)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"完整统计已保存到 {report_path}")
@@ -0,0 +1,253 @@
+import os
+import re
+import sys
+import json
+import math
+import heapq
+import hashlib
+import multiprocessing
+from collections import Counter, defaultdict
+from jsonl_shards import split_byte_ranges, iter_lines_in_range
+from record_codec import LazyRecord, peek
+from profile_dataset import series_shape, NO_TASK
+from format2jsonl import pretty_record, iter_json_objects
+
+"""
+人工核查（README中分类后抽查约5%、核对推理计算label）的分层抽样
+- 一次流式读取：按 任务 x 单/多变量 分层，每层按比例抽样（每层至少min_per_stratum条）
+- 抽样可复现：每条样本的随机数由 seed + id 哈希得到，每层取随机数最小的k个，与文件顺序无关
+- 需要重点核查的样本全部纳入，不参与抽样：推理计算label非数字/label为空/stepx_label为空
+  （与extract_label、cot_correct打印的失败ID判定一致），以及额外传入的ID列表（如日志中打印的失败ID）
+- 只记录被选中行的字节偏移，最后按偏移读回这些行，不整体载入文件；可按字节范围分片多进程扫描
+- 核查文件为格式化JSON（每个字段一行），timeseries等大数组替换为形状摘要；修改后用merge_review合并回原文件
+"""
+
+ELIDED_FIELDS = ["timeseries", "timeseries2"]
+QA_FIELD = "_qa"
+_LEADING_ID_RE = re.compile(r'\{\s*"id"\s*:\s*(-?\d+|"[^"\\]*")\s*[,}]')
+OVERSAMPLE = 4.0  # 读取时保留随机数小于 rate*OVERSAMPLE 的候选，读完后再按各层样本数取前k个
+
+
+def sample_key(id, seed) -> float:
+    """样本的确定性随机数，[0, 1)"""
+    digest = hashlib.blake2b(f"{seed}:{json.dumps(id, ensure_ascii=False)}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def load_ids(path) -> set:
+    """读取ID列表文件：JSON数组（可直接粘贴日志中打印的失败ID列表）或每行一个ID"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read().strip()
+    try:
+        ids = json.loads(text)
+    except json.JSONDecodeError:
+        ids = [line.strip() for line in text.splitlines() if line.strip()]
+        ids = [int(i) if i.lstrip("-").isdigit() else i for i in ids]
+    return set(ids if isinstance(ids, list) else [ids])
+
+
+def _variate_count(data) -> int:
+    if "timeseries" in data:
+        return len(series_shape(data.raw("timeseries")))
+    text = data.get("question") or data.get("input") or ""
+    return text.count("<ts><ts/>")
+
+
+def record_flags(data) -> list:
+    """需要全部核查的原因"""
+    flags = []
+    task = data["task"].strip() if "task" in data else ""
+    if "label" in data:
+        label = data["label"]
+        if label is None or str(label).strip() == "":
+            flags.append("empty_label")
+        elif task == "Inferential calculation" and not str(label).isdigit():
+            flags.append("non_digit_label")
+    if any(field in data and (data[field] is None or str(data[field]).strip() == "")
+           for field in ("step1_label", "step2_label", "step4_label", "step6_label")):
+        flags.append("empty_step_label")
+    return flags
+
+
+def _scan_range(path, byte_start, byte_end, seed, id_lists, threshold, min_per_stratum, keep_strata=None):
+    """
+    扫描一个字节范围，返回 (各层样本数, 各层重点核查数, 重点核查样本[(偏移, 分层, 原因)], 各层候选{分层: [(随机数, 偏移)]})
+    候选为随机数低于threshold的样本，加上每层随机数最小的min_per_stratum个（保证小分层不需要再读一遍）
+    keep_strata不为None时只收集这些分层的全部样本作为候选
+    """
+    totals, n_flagged = Counter(), Counter()
+    flagged = []
+    candidates = defaultdict(list)
+    smallest = defaultdict(list)  # 分层 -> 随机数不低于threshold的样本中最小的几个 (-随机数, 偏移)
+    offset = byte_start
+    for raw_line in iter_lines_in_range(path, byte_start, byte_end):
+        line_offset = offset
+        offset += len(raw_line)
+        line = raw_line.decode("utf-8").strip()
+        if not line:
+            continue
+        try:
+            data = LazyRecord(line)
+            id = data["id"]
+            task = data["task"].strip() if "task" in data else NO_TASK
+            stratum = f"{task} | {'multi' if _variate_count(data) >= 2 else 'uni'}"
+            reasons = record_flags(data) + [name for name, ids in id_lists.items() if id in ids]
+        except (json.JSONDecodeError, KeyError, AttributeError) as e:
+            if keep_strata is None:
+                print(f"第{line_offset}字节处的样本无法解析，跳过: {e}")
+            continue
+
+        totals[stratum] += 1
+        if reasons:
+            flagged.append((line_offset, stratum, reasons))
+            n_flagged[stratum] += 1
+            continue
+        if keep_strata is not None:
+            if stratum in keep_strata:
+                candidates[stratum].append((sample_key(id, seed), line_offset))
+            continue
+        key = sample_key(id, seed)
+        if key < threshold:
+            candidates[stratum].append((key, line_offset))
+            continue
+        heap = smallest[stratum]
+        if len(heap) < min_per_stratum:
+            heapq.heappush(heap, (-key, line_offset))
+        elif -heap[0][0] > key:
+            heapq.heapreplace(heap, (-key, line_offset))
+
+    for stratum, heap in smallest.items():
+        candidates[stratum].extend((-neg_key, line_offset) for neg_key, line_offset in heap)
+    return totals, n_flagged, flagged, dict(candidates)
+
+
+def _scan(path, workers, *args):
+    """按字节范围分片扫描后合并；各样本的随机数只与id有关，分片方式不影响抽样结果"""
+    totals, n_flagged = Counter(), Counter()
+    flagged = []
+    candidates = defaultdict(list)
+    if workers <= 1:
+        parts = [_scan_range(path, 0, os.path.getsize(path), *args)]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            parts = pool.starmap(_scan_range, [(path, start, end, *args) for start, end in split_byte_ranges(path, workers * 4)])
+    for part_totals, part_n_flagged, part_flagged, part_candidates in parts:
+        totals.update(part_totals)
+        n_flagged.update(part_n_flagged)
+        flagged.extend(part_flagged)
+        for stratum, items in part_candidates.items():
+            candidates[stratum].extend(items)
+    return totals, n_flagged, flagged, candidates
+
+
+def select_samples(input_file, rate=0.05, min_per_stratum=5, seed=0, id_lists=None, workers=1):
+    """
+    每层取抽样随机数最小的 max(min_per_stratum, ceil(rate*该层样本数)) 条（bottom-k蓄水池，结果与读取顺序无关）
+    读取时只保留候选；个别分层候选不足时（概率极低）再读一遍，只收集这些分层的全部随机数
+    id_lists: {名称: ID集合}，其中的样本全部纳入
+    返回 (按文件顺序的 [(字节偏移, 分层, 纳入原因)], 各层统计)
+    """
+    args = (seed, id_lists or {}, rate * OVERSAMPLE, min_per_stratum)
+    totals, n_flagged, selected, candidates = _scan(input_file, workers, *args)
+
+    quota = {stratum: min(max(min_per_stratum, math.ceil(rate * (total - n_flagged[stratum]))), total - n_flagged[stratum])
+             for stratum, total in totals.items()}
+    short = {stratum for stratum, k in quota.items() if len(candidates[stratum]) < k}
+    if short:
+        print(f"分层 {sorted(short)} 的候选不足，重新读取")
+        candidates.update(_scan(input_file, workers, *args, short)[3])
+
+    stats = {}
+    for stratum in sorted(totals):
+        chosen = heapq.nsmallest(quota[stratum], candidates[stratum])
+        selected.extend((line_offset, stratum, ["sampled"]) for _, line_offset in chosen)
+        stats[stratum] = {"total": totals[stratum], "flagged": n_flagged[stratum], "sampled": len(chosen)}
+    selected.sort()
+    return selected, stats
+
+
+def write_review(input_file, review_file, selected) -> None:
+    """按字节偏移读回选中的行，写出格式化的核查文件（大数组替换为形状摘要）"""
+    with open(input_file, 'rb') as f_in, open(review_file, 'w', encoding='utf-8') as f_out:
+        for line_offset, stratum, reasons in selected:
+            f_in.seek(line_offset)
+            data = LazyRecord(f_in.readline().decode("utf-8"))
+            for field in ELIDED_FIELDS:
+                if field in data:
+                    lengths = series_shape(data.raw(field))
+                    data[field] = f"<已省略: {len(lengths)}个变量, 长度{lengths}>"
+            data[QA_FIELD] = {"stratum": stratum, "reasons": reasons}
+            f_out.write(pretty_record(data))
+
+
+def sample_for_review(input_file, review_file, rate=0.05, min_per_stratum=5, seed=0, id_lists=None, workers=1) -> dict:
+    selected, stats = select_samples(input_file, rate, min_per_stratum, seed, id_lists, workers)
+    write_review(input_file, review_file, selected)
+    print(f"{'分层':<36}{'样本数':>8}{'重点核查':>10}{'抽样':>8}")
+    for stratum, s in stats.items():
+        print(f"{stratum:<36}{s['total']:>8}{s['flagged']:>10}{s['sampled']:>8}")
+    print(f"共 {len(selected)} 条写入核查文件 {review_file}")
+    return stats
+
+
+def merge_review(input_file, review_file, output_file) -> dict:
+    """
+    把核查文件中修改过的字段按id合并回原文件，写出到output_file
+    省略的大数组和_qa字段不会覆盖原值；未修改的字段保持原始JSON文本
+    """
+    edits = {}
+    with open(review_file, 'r', encoding='utf-8', newline='') as f:
+        for byte_offset, line, obj, error, _ in iter_json_objects(f):
+            if error is not None:
+                print(f"核查文件第{line}行的样本 {obj} 格式错误，未合并: {error}")
+                continue
+            edits[json.dumps(obj.get("id"), ensure_ascii=False)] = obj
+
+    updated, changed_fields = 0, defaultdict(int)
+    with open(input_file, 'r', encoding='utf-8') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
+        for line in f_in:
+            line = line.strip()
+            if not line:
+                continue
+            # id是第一个字段时直接从行首取出，不在核查文件中的样本原样写出，不解析整行
+            match = _LEADING_ID_RE.match(line)
+            if match and match.group(1) not in edits:
+                f_out.write(line + '\n')
+                continue
+            try:
+                data = LazyRecord(line)
+            except json.JSONDecodeError as e:
+                print(f"原文件中有无法解析的行，原样保留: {e}")
+                f_out.write(line + '\n')
+                continue
+            edited = edits.pop(json.dumps(data["id"], ensure_ascii=False), None) if "id" in data else None
+            if edited is not None:
+                changed = False
+                for key, value in edited.items():
+                    if key == QA_FIELD or key in ELIDED_FIELDS:
+                        continue
+                    if key not in data or peek(data, key) != value:
+                        data[key] = value
+                        changed_fields[key] += 1
+                        changed = True
+                updated += changed
+            f_out.write(data.dumps(ensure_ascii=False) + '\n')
+
+    print(f"合并完成：{updated} 条样本有修改，各字段修改次数 {dict(changed_fields)}，结果保存到 {output_file}")
+    if edits:
+        print(f"核查文件中有 {len(edits)} 条样本在原文件中找不到: {list(edits)[:20]}")
+    return {"updated": updated, "changed_fields": dict(changed_fields), "missing": list(edits)}
+
+
+if __name__ == "__main__":
+    input_path = "./univariate_classified_2001_6000_testttt.jsonl"
+    review_path = os.path.splitext(input_path)[0] + "_qa_review.json"
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--merge":
+        # 核查修改完后：python qa_sampler.py --merge
+        merge_review(input_path, review_path, os.path.splitext(input_path)[0] + "_qa_merged.jsonl")
+    else:
+        # 额外重点核查的ID列表（如extract_label、cot_correct打印的失败ID，保存为JSON数组文件）
+        id_lists = {name: load_ids(path) for name, path in [("wrong_id", "./wrong_id.json")] if os.path.exists(path)}
+        sample_for_review(input_path, review_path, rate=0.05, min_per_stratum=5, seed=0, id_lists=id_lists,
+                          workers=os.cpu_count() or 1)
@@ -0,0 +1,159 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+"""
+进程内共享的自适应限流器，替代各脚本中固定的time.sleep
+- 令牌桶：同时限制每分钟请求数(RPM)和每分钟token数(TPM)
+- AIMD：请求成功时并发上限加性增长，遇到429/错误或延迟超标时乘性减半
+- 重试退避：指数退避+随机抖动；服务端返回Retry-After时按其要求暂停所有请求
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # 粗略估计：英文约4个字符一个token
+    return max(1, len(text) // 4)
+
+
+def get_retry_after(exc) -> float | None:
+    """从openai异常携带的HTTP响应头中解析Retry-After（秒）"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # HTTP-date格式
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limit_error(exc) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+class RateLimiter:
+    def __init__(self, rpm=500, tpm=200000, max_concurrency=16, min_concurrency=1,
+                 latency_target=None, backoff_base=1.0, backoff_cap=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target  # 秒；None表示不按延迟调整并发
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._lock = threading.Lock()
+        self._request_tokens = float(rpm)
+        self._token_tokens = float(tpm)
+        self._last_refill = time.monotonic()
+        self._concurrency = float(min(max_concurrency, max(min_concurrency, 4)))
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._concurrency)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_tokens = min(self.rpm, self._request_tokens + elapsed * self.rpm / 60)
+        self._token_tokens = min(self.tpm, self._token_tokens + elapsed * self.tpm / 60)
+
+    def _try_acquire(self, tokens):
+        """成功返回0，否则返回建议的等待秒数"""
+        tokens = min(tokens, self.tpm)  # 单个超大请求不能永远等待
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._in_flight >= int(self._concurrency):
+                return 0.05
+            if self._request_tokens < 1:
+                return (1 - self._request_tokens) * 60 / self.rpm
+            if self._token_tokens < tokens:
+                return (tokens - self._token_tokens) * 60 / self.tpm
+            self._request_tokens -= 1
+            self._token_tokens -= tokens
+            self._in_flight += 1
+            return 0
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, tokens=1):
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, success, latency=None, error=None, estimated_tokens=0, used_tokens=None):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            # 用实际消耗修正预扣的token（可为负，相当于欠账）
+            if used_tokens is not None:
+                self._token_tokens -= used_tokens - estimated_tokens
+
+            now = time.monotonic()
+            slow = self.latency_target is not None and latency is not None and latency > self.latency_target
+            if success and not slow:
+                # 加性增长：大约每完成一轮并发量的请求，上限+1
+                self._concurrency = min(self.max_concurrency, self._concurrency + 1 / self._concurrency)
+            elif now - self._last_decrease > 1.0:
+                # 乘性减少，1秒内只减一次，避免同一批失败把并发压到底
+                self._concurrency = max(self.min_concurrency, self._concurrency / 2)
+                self._last_decrease = now
+
+            if error is not None and is_rate_limit_error(error):
+                retry_after = get_retry_after(error)
+                if retry_after:
+                    # 服务端要求等待时，所有调用方一起暂停
+                    self._paused_until = max(self._paused_until, now + retry_after)
+
+    def backoff_delay(self, attempt, error=None) -> float:
+        """第attempt次失败后的等待时间：优先Retry-After，否则指数退避+全抖动"""
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.5)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+
+_limiter = None
+
+
+def configure_limiter(**kwargs) -> RateLimiter:
+    """设置进程内共享的限流器，参数同RateLimiter，需在第一次请求前调用"""
+    global _limiter
+    _limiter = RateLimiter(**kwargs)
+    return _limiter
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,274 @@
+import re
+import json
+
+"""
+JSONL记录的惰性编解码
+- 只扫描一遍顶层对象，记录每个字段值在原始行中的位置，不解析值本身
+- 阶段需要哪个字段才解码哪个字段；未改动的字段（尤其是timeseries/timeseries2这类大数组）
+  写出时直接拷贝原始JSON文本，省去float列表的解析和重新序列化
+- 用下标取出的列表/字典可以原地修改，写出时按修改后的值重新序列化；只读大数组时用peek，不影响原样拷贝
+- JSON后端可切换，默认标准库json；安装orjson时可用set_json_backend("orjson")加速解码
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(value, ensure_ascii):
+    return json.dumps(value, ensure_ascii=ensure_ascii)
+
+
+_LONG_DIGITS_RE = re.compile(r"\d{19}")
+
+
+def _orjson_loads(text):
+    # 超出64位的整数orjson会解码为float（或报错），NaN/Infinity（时序中可能出现）orjson不接受，这些情况退回标准库解析
+    if _LONG_DIGITS_RE.search(text):
+        return json.loads(text)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+
+# 默认使用标准库；orjson只用于解码（需显式set_json_backend("orjson")）。
+# 编码始终用标准库：orjson会把NaN写成null，且输出紧凑分隔符，与原样拷贝的字段格式不一致
+_BACKENDS = {"json": (json.loads, _json_dumps)}
+if orjson is not None:
+    _BACKENDS["orjson"] = (_orjson_loads, _json_dumps)
+
+_loads, _dumps = _BACKENDS["json"]
+
+
+def set_json_backend(name: str) -> None:
+    """切换JSON后端：'json' 或 'orjson'（需已安装）"""
+    global _loads, _dumps
+    if name not in _BACKENDS:
+        raise ValueError(f"JSON后端不可用: {name}，可选 {list(_BACKENDS)}")
+    _loads, _dumps = _BACKENDS[name]
+
+
+def register_json_backend(name: str, loads, dumps) -> None:
+    """注册自定义后端，dumps签名为 dumps(value, ensure_ascii) -> str"""
+    _BACKENDS[name] = (loads, dumps)
+
+
+_WS_RE = re.compile(r'\s*')
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)  # 展开循环写法，长字符串上比逐字符分支快数倍
+_STRUCT_RE = re.compile(r'[\[\]{}"]')
+_SCALAR_RE = re.compile(r'[^,}\]\s]+')
+
+
+class RecordDecodeError(json.JSONDecodeError):
+    """继承JSONDecodeError，调用方原有的 except json.JSONDecodeError 仍然适用"""
+
+
+class RawValue(str):
+    """已是合法JSON文本的值，写出时原样拷贝"""
+
+
+def _skip_value(text, pos):
+    """返回从pos开始的一个JSON值的结束位置"""
+    ch = text[pos:pos + 1]
+    if ch == '"':
+        match = _STRING_RE.match(text, pos)
+        if not match:
+            raise RecordDecodeError("字符串未闭合", text, pos)
+        return match.end()
+    if ch in ('[', '{'):
+        depth = 0
+        while True:
+            match = _STRUCT_RE.search(text, pos)
+            if not match:
+                raise RecordDecodeError("数组/对象未闭合", text, pos)
+            c = match.group()
+            if c == '"':
+                string_match = _STRING_RE.match(text, match.start())
+                if not string_match:
+                    raise RecordDecodeError("字符串未闭合", text, match.start())
+                pos = string_match.end()
+                continue
+            pos = match.end()
+            if c in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+    match = _SCALAR_RE.match(text, pos)
+    if not match:
+        raise RecordDecodeError("无法识别的值", text, pos)
+    return match.end()
+
+
+class LazyRecord:
+    """
+    惰性解码的JSON对象：get只解码被访问的字段，dumps时未改动字段原样输出
+    字段顺序与原始记录一致，支持在指定字段后插入新字段
+    """
+
+    def __init__(self, line: str):
+        self._keys = []        # 字段名，保持原始顺序
+        self._raw = {}         # key -> 原始值文本
+        self._values = {}      # key -> 已解码或新设置的值
+        self._parse(line)
+
+    def _parse(self, text):
+        pos = _WS_RE.match(text, 0).end()
+        if text[pos:pos + 1] != '{':
+            raise RecordDecodeError("记录不是JSON对象", text, pos)
+        pos = _WS_RE.match(text, pos + 1).end()
+        if text[pos:pos + 1] == '}':
+            self._check_end(text, pos + 1)
+            return
+        while True:
+            key_match = _STRING_RE.match(text, pos)
+            if not key_match:
+                raise RecordDecodeError("缺少字段名", text, pos)
+            key = json.loads(key_match.group())
+            pos = _WS_RE.match(text, key_match.end()).end()
+            if text[pos:pos + 1] != ':':
+                raise RecordDecodeError("缺少冒号", text, pos)
+            pos = _WS_RE.match(text, pos + 1).end()
+            end = _skip_value(text, pos)
+            if key not in self._raw:
+                self._keys.append(key)
+            self._raw[key] = text[pos:end]
+            self._values.pop(key, None)
+            pos = _WS_RE.match(text, end).end()
+            ch = text[pos:pos + 1]
+            if ch == ',':
+                pos = _WS_RE.match(text, pos + 1).end()
+                continue
+            if ch == '}':
+                self._check_end(text, pos + 1)
+                return
+            raise RecordDecodeError("缺少逗号或右括号", text, pos)
+
+    @staticmethod
+    def _check_end(text, pos):
+        """与json.loads一致：对象结束后只允许空白"""
+        pos = _WS_RE.match(text, pos).end()
+        if pos != len(text):
+            raise RecordDecodeError("对象结束后有多余内容", text, pos)
+
+    def __contains__(self, key):
+        return key in self._raw or key in self._values
+
+    def keys(self):
+        return list(self._keys)
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in self._raw:
+            raise KeyError(key)
+        value = _loads(self._raw[key])
+        self._values[key] = value
+        if isinstance(value, (list, dict)):
+            # 调用方可能原地修改返回的列表/字典，写出时须按解码后的值重新序列化
+            del self._raw[key]
+        return value
+
+    def peek(self, key):
+        """只读取字段值：不缓存解码结果，字段仍按原始文本原样写出（修改返回值不会写回记录）"""
+        if key in self._values:
+            return self._values[key]
+        if key not in self._raw:
+            raise KeyError(key)
+        return _loads(self._raw[key])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def raw(self, key) -> RawValue:
+        """字段的原始JSON文本（未改动时），可直接放入新记录原样写出"""
+        if key in self._raw:
+            return RawValue(self._raw[key])
+        return RawValue(_dumps(self._values[key], False))
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._keys.append(key)
+        self._raw.pop(key, None)
+        self._values[key] = value
+
+    def insert_after(self, anchor, key, value):
+        """在anchor字段之后插入新字段；anchor不存在时追加到末尾"""
+        if key in self:
+            self._keys.remove(key)
+        self._raw.pop(key, None)
+        self._values[key] = value
+        if anchor in self._keys:
+            self._keys.insert(self._keys.index(anchor) + 1, key)
+        else:
+            self._keys.append(key)
+
+    def put_raw(self, key, raw_text, anchor=None):
+        """以原始JSON文本设置字段：已存在时原位替换，否则插入到anchor之后（anchor不存在时追加）"""
+        if key not in self:
+            if anchor in self._keys:
+                self._keys.insert(self._keys.index(anchor) + 1, key)
+            else:
+                self._keys.append(key)
+        self._values.pop(key, None)
+        self._raw[key] = raw_text
+
+    def remove(self, key):
+        """删除字段，字段不存在时忽略"""
+        if key in self:
+            self._keys.remove(key)
+        self._raw.pop(key, None)
+        self._values.pop(key, None)
+
+    def items(self):
+        """(key, 值)；未改动的字段给出RawValue"""
+        for key in self._keys:
+            yield key, (RawValue(self._raw[key]) if key in self._raw else self._values[key])
+
+    def dumps(self, ensure_ascii=True) -> str:
+        parts = []
+        for key in self._keys:
+            encoded = self._raw[key] if key in self._raw else _dumps(self._values[key], ensure_ascii)
+            parts.append(f"{json.dumps(key, ensure_ascii=ensure_ascii)}: {encoded}")
+        return "{" + ", ".join(parts) + "}"
+
+
+def dumps_fields(pairs, ensure_ascii=True) -> str:
+    """按顺序序列化(key, value)对，RawValue原样拷贝；格式与json.dumps默认输出一致"""
+    parts = []
+    for key, value in pairs:
+        encoded = value if isinstance(value, RawValue) else _dumps(value, ensure_ascii)
+        parts.append(f"{json.dumps(key, ensure_ascii=ensure_ascii)}: {encoded}")
+    return "{" + ", ".join(parts) + "}"
+
+
+def insert_after(data, anchor, key, value) -> None:
+    """在anchor字段之后插入新字段（原地修改，LazyRecord和dict均可）；anchor不存在时追加到末尾，key已存在时移到新位置"""
+    if isinstance(data, LazyRecord):
+        data.insert_after(anchor, key, value)
+        return
+    items = [(k, v) for k, v in data.items() if k != key]
+    data.clear()
+    for k, v in items:
+        data[k] = v
+        if k == anchor:
+            data[key] = value
+    if key not in data:
+        data[key] = value
+
+
+def peek(data, key):
+    """只读取字段值：LazyRecord时不影响原样写出，dict时直接取值"""
+    return data.peek(key) if isinstance(data, LazyRecord) else data[key]
+
+
+def decode_fields(line: str, fields) -> dict:
+    """只解码指定字段，返回 {字段: 值}，不存在的字段不出现在结果中"""
+    record = LazyRecord(line)
+    return {key: record[key] for key in fields if key in record}
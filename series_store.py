@@ -0,0 +1,239 @@
+import os
+import json
+import numpy as np
+from record_codec import LazyRecord, peek
+
+"""
+时序数据的列式存储：每个数据集一个目录，JSONL记录里只保留引用
+- values.f64: 所有数据点按float64连续存放，读取时np.memmap映射，不整体载入内存
+- var_ptr.npy: 每个变量在values中的起止偏移（支持不等长的多变量序列）
+- rec_ptr.npy: 每条记录在var_ptr中的起止下标；rec_ndim.npy: 原始timeseries是一维还是二维列表
+- rec_int.npy: 每条记录数值的类型：0 全为浮点，1 全为整数，2 整数与浮点混合；
+  int_pos.npy: 混合记录中整数值在values中的位置（有序）。读取时按此还原int，保证展开后与原记录一致
+- ids.json: 记录id列表，与rec_ptr一一对应
+记录中的timeseries/timeseries2替换为 "timeseries_ref": {"store": 目录, "id": id}，
+保留4位小数的timeseries2不再重复存储，读取时按需计算
+"""
+
+REF_FIELD = "timeseries_ref"
+ALL_FLOAT, ALL_INT, MIXED = 0, 1, 2
+_MAX_EXACT_INT = 2 ** 53  # float64能精确表示的整数范围
+
+
+# 自定义异常：用于标识timeseries中的非数值类型错误
+class NonNumericValueError(Exception):
+    pass
+
+
+def round_floats(seq, decimals=4):
+    """向量化按decimals位小数舍入；恰在舍入边界附近或量级过大的少数值退回内置round，结果与逐点round一致"""
+    arr = np.asarray(seq, dtype=np.float64)
+    scale = 10.0 ** decimals
+    scaled = arr * scale
+    rounded = (np.rint(scaled) / scale).tolist()
+    with np.errstate(invalid='ignore'):
+        # 乘法误差不超过|scaled|的半个ulp，容差按量级放宽
+        tol = np.maximum(np.abs(scaled) * 1e-15, 1e-9)
+        suspect = (np.abs(scaled - np.floor(scaled) - 0.5) < tol) | ~(np.abs(scaled) < 1e15)
+    for i in np.flatnonzero(suspect).tolist():
+        rounded[i] = round(float(seq[i]), decimals)
+    return rounded
+
+
+class SeriesStoreWriter:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._values = open(os.path.join(store_dir, "values.f64"), "wb")
+        self._var_ptr = [0]
+        self._rec_ptr = [0]
+        self._rec_ndim = []
+        self._rec_int = []
+        self._int_pos = []
+        self._ids = []
+
+    def add(self, id, timeseries) -> None:
+        """
+        timeseries为一维列表（单变量）或二维列表（每个变量一个列表，可不等长）
+        只接受int/float数值（字符串、bool、null、更深的嵌套抛出NonNumericValueError，不做隐式转换）；
+        整数超出float64可精确表示的范围时抛出ValueError。检查通过后才写入，出错的记录不会留下部分数据
+        """
+        if timeseries and all(isinstance(seq, list) for seq in timeseries):
+            variables, ndim = timeseries, 2
+        else:
+            variables, ndim = [timeseries], 1
+        types = set()
+        for seq in variables:
+            types.update(map(type, seq))
+        if not types <= {int, float}:
+            bad = next(v for seq in variables for v in seq if type(v) not in (int, float))
+            raise NonNumericValueError(f"ID {id}: timeseries中存在非数值类型数据: {bad!r}(类型: {type(bad).__name__})")
+        int_pos = []
+        if int in types:
+            start = self._var_ptr[-1]
+            for seq in variables:
+                for i, v in enumerate(seq):
+                    if type(v) is int:
+                        if abs(v) > _MAX_EXACT_INT:
+                            raise ValueError(f"ID {id}: 整数 {v} 超出float64可精确表示的范围，无法写入列式存储")
+                        int_pos.append(start + i)
+                start += len(seq)
+        for seq in variables:
+            arr = np.asarray(seq, dtype=np.float64)
+            self._values.write(arr.tobytes())
+            self._var_ptr.append(self._var_ptr[-1] + arr.size)
+        self._rec_ptr.append(len(self._var_ptr) - 1)
+        self._rec_ndim.append(ndim)
+        if types == {int}:
+            self._rec_int.append(ALL_INT)
+        elif int in types:
+            self._rec_int.append(MIXED)
+            self._int_pos.extend(int_pos)
+        else:
+            self._rec_int.append(ALL_FLOAT)
+        self._ids.append(id)
+
+    def close(self) -> None:
+        self._values.close()
+        np.save(os.path.join(self.store_dir, "var_ptr.npy"), np.asarray(self._var_ptr, dtype=np.int64))
+        np.save(os.path.join(self.store_dir, "rec_ptr.npy"), np.asarray(self._rec_ptr, dtype=np.int64))
+        np.save(os.path.join(self.store_dir, "rec_ndim.npy"), np.asarray(self._rec_ndim, dtype=np.int8))
+        np.save(os.path.join(self.store_dir, "rec_int.npy"), np.asarray(self._rec_int, dtype=np.int8))
+        np.save(os.path.join(self.store_dir, "int_pos.npy"), np.asarray(self._int_pos, dtype=np.int64))
+        with open(os.path.join(self.store_dir, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self._ids, f, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SeriesStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        values_path = os.path.join(store_dir, "values.f64")
+        if os.path.getsize(values_path) > 0:
+            self.values = np.memmap(values_path, dtype=np.float64, mode="r")
+        else:
+            self.values = np.zeros(0, dtype=np.float64)
+        self.var_ptr = np.load(os.path.join(store_dir, "var_ptr.npy"))
+        self.rec_ptr = np.load(os.path.join(store_dir, "rec_ptr.npy"))
+        self.rec_ndim = np.load(os.path.join(store_dir, "rec_ndim.npy"))
+        self.rec_int = np.load(os.path.join(store_dir, "rec_int.npy")).astype(np.int8)  # 旧版存储为bool（全为整数）
+        int_pos_path = os.path.join(store_dir, "int_pos.npy")
+        self.int_pos = np.load(int_pos_path) if os.path.exists(int_pos_path) else np.zeros(0, dtype=np.int64)
+        with open(os.path.join(store_dir, "ids.json"), encoding="utf-8") as f:
+            self._id_to_rec = {id: i for i, id in enumerate(json.load(f))}
+
+    def __len__(self):
+        return len(self._id_to_rec)
+
+    def __contains__(self, id):
+        return id in self._id_to_rec
+
+    def get_arrays(self, id, decimals=None) -> list:
+        """返回每个变量的数组（memmap视图，decimals不为None时为舍入后的副本，与内置round结果一致）"""
+        rec = self._id_to_rec[id]
+        arrays = []
+        for v in range(self.rec_ptr[rec], self.rec_ptr[rec + 1]):
+            arr = self.values[self.var_ptr[v]:self.var_ptr[v + 1]]
+            arrays.append(np.asarray(round_floats(arr, decimals)) if decimals is not None else arr)
+        return arrays
+
+    def shape(self, id) -> list:
+        """返回各变量的长度，不读取数值"""
+        rec = self._id_to_rec[id]
+        return [int(self.var_ptr[v + 1] - self.var_ptr[v]) for v in range(self.rec_ptr[rec], self.rec_ptr[rec + 1])]
+
+    def get(self, id, decimals=None) -> list:
+        """返回与原始timeseries字段结构相同的Python列表"""
+        rec = self._id_to_rec[id]
+        arrays = self.get_arrays(id, decimals)
+        if self.rec_int[rec] == ALL_INT:
+            lists = [arr.astype(np.int64).tolist() for arr in arrays]
+        else:
+            lists = [arr.tolist() for arr in arrays]
+        if self.rec_int[rec] == MIXED:
+            # 整数值round后仍为原整数，按位置还原为int
+            for v, seq in zip(range(self.rec_ptr[rec], self.rec_ptr[rec + 1]), lists):
+                start = self.var_ptr[v]
+                lo, hi = np.searchsorted(self.int_pos, [start, self.var_ptr[v + 1]])
+                for pos in (self.int_pos[lo:hi] - start).tolist():
+                    seq[pos] = int(seq[pos])
+        if self.rec_ndim[rec] == 1:
+            return lists[0]
+        return lists
+
+
+_open_stores = {}
+
+
+def open_store(store_dir) -> SeriesStore:
+    store = _open_stores.get(store_dir)
+    if store is None:
+        store = _open_stores[store_dir] = SeriesStore(store_dir)
+    return store
+
+
+def resolve_timeseries(data, decimals=None):
+    """
+    取记录的时序数据：记录内联timeseries时直接返回，带引用时从列式存储读取
+    decimals=4 即得到timeseries2
+    """
+    if REF_FIELD in data:
+        ref = peek(data, REF_FIELD)
+        return open_store(ref["store"]).get(ref["id"], decimals)
+    if decimals is not None and "timeseries2" in data:
+        return peek(data, "timeseries2")
+    return peek(data, "timeseries")
+
+
+def externalize_jsonl(input_file, output_file, store_dir) -> None:
+    """将JSONL中的timeseries写入列式存储，记录中替换为引用（原位置），并去掉冗余的timeseries2"""
+    count = 0
+    with SeriesStoreWriter(store_dir) as writer, \
+         open(input_file, "r", encoding="utf-8") as f_in, \
+         open(output_file, "w", encoding="utf-8") as f_out:
+        for line in f_in:
+            line = line.strip()
+            if not line:
+                continue
+            data = LazyRecord(line)
+            if "timeseries" not in data:
+                f_out.write(line + "\n")
+                continue
+            id = data["id"]
+            try:
+                writer.add(id, data["timeseries"])
+            except (NonNumericValueError, ValueError) as e:
+                # 无法无损写入的记录保持内联
+                print(f"{e}，该记录保留内联timeseries")
+                f_out.write(line + "\n")
+                continue
+            data.insert_after("timeseries", REF_FIELD, {"store": store_dir, "id": id})
+            data.remove("timeseries")
+            data.remove("timeseries2")
+            f_out.write(data.dumps(ensure_ascii=False) + "\n")
+            count += 1
+    print(f"已将 {count} 条时序写入 {store_dir}，引用文件保存到 {output_file}")
+
+
+def materialize_jsonl(input_file, output_file, with_timeseries2=True) -> None:
+    """externalize_jsonl的逆操作：把引用展开回timeseries（及4位小数的timeseries2），用于发布最终数据集"""
+    with open(input_file, "r", encoding="utf-8") as f_in, \
+         open(output_file, "w", encoding="utf-8") as f_out:
+        for line in f_in:
+            line = line.strip()
+            if not line:
+                continue
+            data = LazyRecord(line)
+            if REF_FIELD in data:
+                ref = data[REF_FIELD]
+                store = open_store(ref["store"])
+                data.insert_after(REF_FIELD, "timeseries", store.get(ref["id"]))
+                if with_timeseries2:
+                    data.insert_after("timeseries", "timeseries2", store.get(ref["id"], decimals=4))
+                data.remove(REF_FIELD)
+            f_out.write(data.dumps(ensure_ascii=False) + "\n")
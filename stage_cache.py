@@ -0,0 +1,148 @@
+import hashlib
+import inspect
+import json
+import sqlite3
+import threading
+
+"""
+阶段级的增量重算缓存（SQLite）
+- 每条样本的指纹 = 阶段代码哈希 + 配置版本 + 该阶段读取的输入字段原始JSON文本的哈希
+- 指纹不变的样本直接复用上次的结果：只保存阶段输出的字段（原始JSON文本及插入位置）和返回值，
+  命中时原样写回记录，不再执行阶段逻辑
+- 代码版本只取阶段实际用到的函数和规则表（可按任务类型分别计算）：改了某个任务的规则时只重算该任务的样本，
+  脚本中__main__的路径、索引范围等与结果无关的改动不影响缓存；只改了部分样本的输入时只重算这些样本
+"""
+
+DEFAULT_STAGE_CACHE_PATH = "./stage_cache.sqlite"
+COMMIT_EVERY = 500
+
+# 同一文件的多个阶段缓存（如流水线中的extract_label和cot_correct）共用一个连接：
+# 写事务攒够COMMIT_EVERY条才提交，各用一个连接时会互相等待写锁
+_connections = {}  # 路径 -> [连接, 锁, 引用数]
+_connections_lock = threading.Lock()
+
+
+def _acquire_connection(path):
+    with _connections_lock:
+        entry = _connections.get(path)
+        if entry is None:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stage_records ("
+                "stage TEXT, record_key TEXT, fingerprint TEXT, result TEXT, delta TEXT, "
+                "PRIMARY KEY (stage, record_key))"
+            )
+            conn.commit()
+            entry = _connections[path] = [conn, threading.Lock(), 0]
+        entry[2] += 1
+        return entry[0], entry[1]
+
+
+def _release_connection(path):
+    with _connections_lock:
+        entry = _connections[path]
+        entry[2] -= 1
+        if entry[2] == 0:
+            with entry[1]:
+                entry[0].commit()
+                entry[0].close()
+            del _connections[path]
+
+
+def code_hash(*objs) -> str:
+    """阶段代码的哈希：函数/类取其源码，规则表（列表、字典、编译后的正则等）取其repr"""
+    h = hashlib.sha256()
+    for obj in objs:
+        if inspect.isfunction(obj) or inspect.isclass(obj) or inspect.ismodule(obj) or hasattr(obj, "__wrapped__"):
+            text = inspect.getsource(obj)
+        else:
+            text = repr(obj)
+        h.update(text.encode("utf-8") + b"\x00")
+    return h.hexdigest()[:16]
+
+
+class StageCache:
+    def __init__(self, stage, input_fields, output_fields, code_version, config_version="1",
+                 path=DEFAULT_STAGE_CACHE_PATH):
+        """
+        stage: 阶段名；input_fields: 阶段读取的字段（这些字段不变且代码不变时复用结果）
+        output_fields: 阶段写入的字段
+        code_version: 阶段用到的函数和规则表的code_hash；也可以是函数code_version(data) -> str，按样本（如任务类型）给出版本
+        config_version: 阶段配置（影响结果的参数）变化时修改
+        """
+        self.stage = stage
+        self.input_fields = list(input_fields)
+        self.output_fields = list(output_fields)
+        self.code_version = code_version
+        self.config_version = str(config_version)
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._path = path
+        self._conn, self._lock = _acquire_connection(path)
+
+    def fingerprint(self, data) -> str:
+        """输入字段直接取原始JSON文本计算哈希，无需解码（data为LazyRecord）"""
+        code_version = self.code_version(data) if callable(self.code_version) else self.code_version
+        h = hashlib.sha256(f"{code_version}|{self.config_version}".encode("utf-8"))
+        for field in self.input_fields:
+            h.update(b"\x00" + field.encode("utf-8") + b"\x01")
+            if field in data:
+                h.update(data.raw(field).encode("utf-8"))
+        return h.hexdigest()
+
+    def apply(self, data, compute):
+        """
+        data: LazyRecord；compute(data)原地修改data并返回可JSON序列化的结果
+        指纹命中时把缓存的字段写回data并返回缓存的结果，否则执行compute并记录
+        """
+        record_key = data.raw("id")
+        fp = self.fingerprint(data)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, result, delta FROM stage_records WHERE stage = ? AND record_key = ?",
+                (self.stage, record_key)
+            ).fetchone()
+        if row is not None and row[0] == fp:
+            for key, anchor, raw_text in json.loads(row[2]):
+                data.put_raw(key, raw_text, anchor)
+            self.hits += 1
+            return json.loads(row[1])
+
+        self.misses += 1
+        result = compute(data)
+        keys = data.keys()
+        delta = []
+        for key in (k for k in keys if k in self.output_fields):
+            i = keys.index(key)
+            delta.append((key, keys[i - 1] if i > 0 else None, str(data.raw(key))))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stage_records VALUES (?, ?, ?, ?, ?)",
+                (self.stage, record_key, fp, json.dumps(result, ensure_ascii=False), json.dumps(delta, ensure_ascii=False))
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._conn.commit()
+                self._pending = 0
+        return result
+
+    def print_stats(self) -> None:
+        total = self.hits + self.misses
+        print(f"阶段缓存[{self.stage}]: 复用 {self.hits} 条, 重算 {self.misses} 条"
+              + (f", 复用率 {self.hits / total:.2%}" if total else ""))
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.commit()
+        self._conn = None
+        _release_connection(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
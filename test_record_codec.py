@@ -0,0 +1,57 @@
+import json
+import pytest
+from record_codec import LazyRecord, RecordDecodeError, peek, insert_after
+
+"""record_codec的回归测试：python -m pytest test_record_codec.py"""
+
+LINE = '{"id": 7, "timeseries": [1, 2.5, 0.00001], "meta": {"k": "v"}, "task": "Others"}'
+
+
+def test_untouched_fields_pass_through():
+    record = LazyRecord(LINE)
+    assert record["task"] == "Others"
+    assert record.dumps() == LINE
+
+
+def test_inplace_list_edit_is_written():
+    record = LazyRecord(LINE)
+    record["timeseries"][0] = 9
+    assert json.loads(record.dumps())["timeseries"] == [9, 2.5, 0.00001]
+
+
+def test_inplace_dict_edit_is_written():
+    record = LazyRecord(LINE)
+    record["meta"]["k"] = "changed"
+    assert json.loads(record.dumps())["meta"] == {"k": "changed"}
+    assert json.loads(record.raw("meta")) == {"k": "changed"}
+
+
+def test_peek_keeps_raw_text():
+    record = LazyRecord(LINE)
+    assert peek(record, "timeseries") == [1, 2.5, 0.00001]
+    assert record.dumps() == LINE  # 0.00001 原样写出，而不是重新序列化为 1e-05
+    assert peek({"timeseries": [1]}, "timeseries") == [1]
+
+
+@pytest.mark.parametrize("line", ['{"a": 1}garbage', '{"a": 1} {"b": 2}', '{}x', '{"a": 1}}'])
+def test_trailing_content_is_rejected(line):
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(line)
+    with pytest.raises(RecordDecodeError):
+        LazyRecord(line)
+
+
+def test_trailing_whitespace_is_accepted():
+    assert LazyRecord('{"a": 1}  \n')["a"] == 1
+    assert LazyRecord('{} \r\n').keys() == []
+
+
+def test_insert_after_dict_matches_lazy_record():
+    data = json.loads(LINE)
+    record = LazyRecord(LINE)
+    for target in (data, record):
+        insert_after(target, "id", "label", "x")
+        insert_after(target, "missing", "tail", 1)
+        insert_after(target, "task", "label", "y")  # 已存在的字段移到新位置
+    assert list(json.loads(record.dumps()).items()) == list(data.items())
+    assert list(data) == ["id", "timeseries", "meta", "task", "label", "tail"]
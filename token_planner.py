@@ -0,0 +1,238 @@
+import json
+from collections import Counter, defaultdict
+from llm_utils import count_tokens, batch_prompt_budget, CLASSIFY_CONTEXT_BUDGET, CLASSIFY_OUTPUT_TOKENS_PER_ITEM
+from jsonl_index import JsonlIndex
+from counter_stats import percentiles, histogram
+
+"""
+LLM阶段运行前的token预算规划（dry-run，不发起任何请求）
+- 按各阶段完全相同的方式拼装prompt（直接调用阶段脚本中的prompt构造函数），离线计数token
+- 按任务类型、变量数量统计prompt token分布（直方图/分位数）
+- 根据并发数、RPM/TPM限额和延迟模型预估总耗时，并指出瓶颈
+- 标记超出上下文预算的样本；分类阶段按阶段的行号范围和分批方式模拟打包，
+  超预算的批次按阶段实际逻辑（llm_utils.batch_prompt_budget）对半拆分
+"""
+
+HIST_EDGES = [512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072]
+
+
+def _summarize(values):
+    counter = Counter(values)
+    stats = percentiles(counter)
+    return {
+        "count": len(values),
+        "total": sum(values),
+        **{key: stats.get(key, 0) for key in ("mean", "p50", "p90", "p99", "max")},
+        "histogram": histogram(counter, HIST_EDGES),
+    }
+
+
+def project_wall_clock(requests, concurrency, rpm=None, tpm=None, base_latency=1.0, output_tps=50.0):
+    """
+    requests: [(prompt_tokens, output_tokens), ...]
+    单个请求延迟按 base_latency + output_tokens / output_tps 估计；
+    总耗时取 并发、RPM、TPM 三个约束中最慢者
+    """
+    n = len(requests)
+    total_tokens = sum(p + o for p, o in requests)
+    bounds = {"concurrency": sum(base_latency + o / output_tps for _, o in requests) / max(concurrency, 1)}
+    if rpm:
+        bounds["rpm"] = n / rpm * 60
+    if tpm:
+        bounds["tpm"] = total_tokens / tpm * 60
+    bottleneck = max(bounds, key=bounds.get) if n else "concurrency"
+    return {"requests": n, "total_tokens": total_tokens, "seconds": round(bounds[bottleneck], 1),
+            "bottleneck": bottleneck, "bounds": {k: round(v, 1) for k, v in bounds.items()}}
+
+
+def _iter_records(input_file):
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _report(entries, requests, flagged, context_budget, rate):
+    by_task = defaultdict(list)
+    by_vars = defaultdict(list)
+    for task, var_count, tokens in entries:
+        by_task[task].append(tokens)
+        by_vars[var_count].append(tokens)
+    return {
+        "records": len(entries),
+        "context_budget": context_budget,
+        "prompt_tokens": _summarize([t for _, _, t in entries]),
+        "by_task": {task: _summarize(v) for task, v in sorted(by_task.items())},
+        "by_var_count": {str(k): _summarize(v) for k, v in sorted(by_vars.items())},
+        "projection": project_wall_clock(requests, **rate),
+        "over_budget": flagged,
+    }
+
+
+def plan_cot(input_file, context_budget=64000, output_tokens=2000, **rate):
+    """预估cot_deepseekr1.py：每条样本一个请求；prompt加预计输出超出context_budget的样本标记出来（无法拆分）"""
+    import cot_deepseekr1
+    from ts_serializer import configure_serializer
+    configure_serializer(**cot_deepseekr1.SERIALIZER_CONFIG, report_tokens=False)
+
+    entries, requests, flagged = [], [], []
+    for data in _iter_records(input_file):
+        prompt = cot_deepseekr1.build_prompt(data)
+        if prompt is None:
+            continue
+        tokens = count_tokens(prompt)
+        entries.append((data.get('task', ''), data['question'].count('<ts><ts/>'), tokens))
+        requests.append((tokens, output_tokens))
+        if tokens + output_tokens > context_budget:
+            flagged.append({"id": data.get('id'), "prompt_tokens": tokens})
+    return _report(entries, requests, flagged, context_budget, rate)
+
+
+def _split_batch(items, build_single, build_batch, max_prompt_tokens):
+    """与classify_batch/verify_batch的拆分逻辑一致：超预算的批次对半拆分，返回[(prompt_tokens, 问题数)]"""
+    if len(items) == 1:
+        return [(count_tokens(build_single(*items[0])), 1)]
+    tokens = count_tokens(build_batch(items))
+    if max_prompt_tokens and tokens > max_prompt_tokens:
+        mid = len(items) // 2
+        return (_split_batch(items[:mid], build_single, build_batch, max_prompt_tokens)
+                + _split_batch(items[mid:], build_single, build_batch, max_prompt_tokens))
+    return [(tokens, len(items))]
+
+
+def _plan_batches(records, groups, build_single, build_batch, batch_size, context_budget, output_tokens_per_item, rate):
+    """
+    records: [(id, task, var_count, 单条prompt参数)]
+    groups: 阶段每次调用classify_batch/verify_batch时的样本（records下标列表），按阶段的分批方式给出
+    """
+    entries, requests, flagged = [], [], []
+    max_prompt_tokens = batch_prompt_budget(batch_size, context_budget, output_tokens_per_item)
+    for id, task, var_count, args in records:
+        tokens = count_tokens(build_single(*args))
+        entries.append((task, var_count, tokens))
+        if tokens + output_tokens_per_item > context_budget:
+            flagged.append({"id": id, "prompt_tokens": tokens})
+    split_count = 0
+    for group in groups:
+        batch = [records[i][3] for i in group]
+        parts = _split_batch(batch, build_single, build_batch, max_prompt_tokens)
+        split_count += len(parts) - 1
+        requests.extend((tokens, output_tokens_per_item * n) for tokens, n in parts)
+    report = _report(entries, requests, flagged, context_budget, rate)
+    report["batch_size"] = batch_size
+    report["batch_splits"] = split_count
+    report["max_prompt_tokens"] = max_prompt_tokens
+    return report
+
+
+def _iter_index_range(input_file, start_idx, end_idx):
+    """与阶段相同：借助JsonlIndex按行号读取[start_idx, end_idx]，返回 (行号, 记录)，跳过无法解析的行"""
+    with JsonlIndex(input_file) as index:
+        end_idx = len(index) - 1 if end_idx is None else end_idx
+        for idx, line in index.iter_range(start_idx, end_idx):
+            try:
+                yield idx, json.loads(line.strip())
+            except json.JSONDecodeError:
+                continue
+
+
+def plan_classification_1round(input_file, start_idx=0, end_idx=None, batch_size=10, cascade=True,
+                               confidence_threshold=0.9, context_budget=CLASSIFY_CONTEXT_BUDGET,
+                               output_tokens_per_item=CLASSIFY_OUTPUT_TOKENS_PER_ITEM, **rate):
+    """预估classification_gpt4omini_1round.py；id为阶段使用的行号，cascade=True时规则可判定的样本不计入请求"""
+    import classification_gpt4omini_1round as stage
+    from classify_rule_based import classify_ts_task_with_confidence
+
+    records, groups, rule_routed = [], [], 0
+    # 与process_data的分批一致：攒够batch_size条GPT样本，或连同规则样本累计1000条时发出一批
+    group, pending = [], 0
+    for idx, data in _iter_index_range(input_file, start_idx, end_idx):
+        if "input" not in data:
+            continue
+        pending += 1
+        if cascade and classify_ts_task_with_confidence(data["input"], data.get("output", ""))[1] >= confidence_threshold:
+            rule_routed += 1
+        else:
+            group.append(len(records))
+            records.append((idx, "", data["input"].count('<ts><ts/>'), (data["input"],)))
+        if len(group) >= batch_size or pending >= max(batch_size, 1000):
+            if group:
+                groups.append(group)
+            group, pending = [], 0
+    if group:
+        groups.append(group)
+    report = _plan_batches(records, groups, stage.build_single_prompt,
+                           lambda items: stage.build_batch_prompt([text for text, in items]),
+                           batch_size, context_budget, output_tokens_per_item, rate)
+    report["rule_routed"] = rule_routed
+    return report
+
+
+def plan_classification_2round(input_file, start_idx=0, end_idx=None, batch_size=10,
+                               context_budget=CLASSIFY_CONTEXT_BUDGET,
+                               output_tokens_per_item=CLASSIFY_OUTPUT_TOKENS_PER_ITEM, **rate):
+    """预估classification_gpt4omini_2round.py（与阶段相同按行号范围读取、每batch_size条有效样本一批）"""
+    import classification_gpt4omini_2round as stage
+
+    records = []
+    for _, data in _iter_index_range(input_file, start_idx, end_idx):
+        if not all(key in data for key in ("id", "question", "task")) or data["task"] not in stage.task_to_category:
+            continue
+        records.append((data["id"], data["task"], data["question"].count('<ts><ts/>'),
+                        (data["question"], data["task"])))
+    groups = [list(range(start, min(start + batch_size, len(records)))) for start in range(0, len(records), batch_size)]
+    return _plan_batches(records, groups, stage.build_single_prompt, stage.build_batch_prompt,
+                         batch_size, context_budget, output_tokens_per_item, rate)
+
+
+def print_report(report):
+    print(f"样本数: {report['records']}，上下文预算: {report['context_budget']} tokens")
+    if "rule_routed" in report:
+        print(f"规则直接判定（不发请求）: {report['rule_routed']} 条")
+    if "batch_size" in report:
+        print(f"批量大小: {report['batch_size']}，因超过 {report['max_prompt_tokens']} tokens 额外拆分 {report['batch_splits']} 次")
+
+    def show(title, s):
+        print(f"{title}: 共{s['count']}条 总计{s['total']} 平均{s['mean']} "
+              f"p50={s['p50']} p90={s['p90']} p99={s['p99']} max={s['max']}")
+        peak = max((c for _, c in s["histogram"]), default=1)
+        for label, c in s["histogram"]:
+            print(f"    {label:>13} | {'#' * max(1, round(c / peak * 40))} {c}")
+
+    show("prompt tokens（全部）", report["prompt_tokens"])
+    for task, s in report["by_task"].items():
+        show(f"任务 {task or '（未分类）'}", s)
+    for var_count, s in report["by_var_count"].items():
+        show(f"变量数 {var_count}", s)
+
+    p = report["projection"]
+    print(f"预计请求 {p['requests']} 次，总token {p['total_tokens']}，"
+          f"预计耗时 {p['seconds'] / 60:.1f} 分钟（瓶颈: {p['bottleneck']}，各约束: {p['bounds']}）")
+    if report["over_budget"]:
+        print(f"超出上下文预算的样本 {len(report['over_budget'])} 条: {[r['id'] for r in report['over_budget']]}")
+
+
+if __name__ == "__main__":
+    stage = "cot"  # "cot" / "classify1" / "classify2"
+    input_file = "./multivariate_classified_2001_6000 copy 2.jsonl"
+    report_file = "./token_plan.json"
+
+    # 与对应阶段__main__中的配置保持一致（行号范围、批量大小；上下文预算两边都取自llm_utils）
+    rate = dict(concurrency=8, rpm=60, tpm=400000, base_latency=1.0, output_tps=50.0)
+
+    if stage == "cot":
+        report = plan_cot(input_file, context_budget=64000, output_tokens=2000, **rate)
+    elif stage == "classify1":
+        report = plan_classification_1round(input_file, start_idx=0, end_idx=2000, batch_size=10, cascade=True, **rate)
+    else:
+        report = plan_classification_2round(input_file, start_idx=0, end_idx=250, batch_size=10, **rate)
+
+    print_report(report)
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"完整报告已保存到 {report_file}")
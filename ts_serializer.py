@@ -0,0 +1,87 @@
+import math
+from series_store import round_floats
+from llm_utils import count_tokens
+
+"""
+构造prompt时的时序序列化
+- 原先直接 ', '.join(map(str, seq))，float64完整表示（如0.30000000000000004）大幅增加token数
+- 可配置保留小数位数、去掉末尾多余的0、各变量共享10的幂缩放、紧凑分隔符
+- 可统计每条样本序列化前后的token数（安装tiktoken时精确计数，否则按数字切分规则估计）
+"""
+
+_config = {
+    "precision": 4,        # 保留小数位数；None时沿用原先的str(value)
+    "strip_zeros": True,   # 去掉末尾多余的0（1.2500 -> 1.25，3.0000 -> 3）
+    "scale": False,        # 各变量按最大绝对值共享10的幂缩放，序列前标注缩放倍数
+    "sep": ",",            # 数据点分隔符，原先为", "
+    "report_tokens": False,  # 统计并打印每条样本序列化前后的token数
+}
+_stats = {"records": 0, "before": 0, "after": 0}
+
+
+def configure_serializer(**kwargs) -> None:
+    for key, value in kwargs.items():
+        if key not in _config:
+            raise KeyError(f"未知的序列化配置项: {key}，可选 {list(_config)}")
+        _config[key] = value
+
+
+def _format_values(values, precision, strip_zeros):
+    if precision is None:
+        return list(map(str, values))
+    rounded = round_floats(values, precision)
+    if not strip_zeros:
+        return [f"{v:.{precision}f}" for v in rounded]
+    out = []
+    for v in rounded:
+        # 舍入后的float其最短repr即为去掉末尾0的写法
+        s = repr(v)
+        if s.endswith(".0"):
+            s = s[:-2]
+        elif "e" in s or "n" in s:
+            # 科学计数法（极大/极小值）或nan/inf
+            s = f"{v:.{precision}f}".rstrip("0").rstrip(".") if math.isfinite(v) else s
+        out.append("0" if s == "-0" else s)
+    return out
+
+
+def _scale_exponent(values):
+    """共享缩放的10的幂：最大绝对值落在[1, 1000)之外时才缩放"""
+    finite = [abs(v) for v in values if math.isfinite(v) and v != 0]
+    if not finite:
+        return 0
+    exp = math.floor(math.log10(max(finite)))
+    return exp if exp >= 3 or exp < 0 else 0
+
+
+def serialize_series(seq) -> str:
+    """将单个变量序列化为prompt中的文本"""
+    values = seq
+    prefix = ""
+    if _config["scale"] and seq:
+        exp = _scale_exponent(seq)
+        if exp:
+            values = [v / 10 ** exp for v in seq]
+            prefix = f"(x1e{exp}) "
+    return prefix + _config["sep"].join(_format_values(values, _config["precision"], _config["strip_zeros"]))
+
+
+def serialize_timeseries(timeseries, record_id=None) -> list:
+    """多变量时序逐个变量序列化，返回字符串列表；report_tokens开启时统计并打印该样本前后的token数"""
+    texts = [serialize_series(seq) for seq in timeseries]
+    if _config["report_tokens"]:
+        before = sum(count_tokens(', '.join(map(str, seq))) for seq in timeseries)
+        after = sum(count_tokens(text) for text in texts)
+        _stats["records"] += 1
+        _stats["before"] += before
+        _stats["after"] += after
+        print(f"ID {record_id}: 时序token数 {before} -> {after}")
+    return texts
+
+
+def print_serializer_stats() -> None:
+    if not _stats["records"]:
+        return
+    before, after = _stats["before"], _stats["after"]
+    print(f"时序序列化统计: {_stats['records']} 条样本, token数 {before} -> {after}, "
+          f"减少 {1 - after / max(before, 1):.2%}")